@@ -1,2 +1,14 @@
 # Backend application package
 
+from pathlib import Path
+
+# Load .env before any module reads its configuration from the environment
+try:
+    from dotenv import load_dotenv
+    env_path = Path(__file__).parent.parent / '.env'
+    if env_path.exists():
+        load_dotenv(env_path)
+    else:
+        load_dotenv()
+except ImportError:
+    pass
@@ -1,10 +1,55 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+import os
+import threading
 import uvicorn
 
 from app.routers import chat, documents
+from app.services import document_processor as document_processor_module
+from app.services import rag_service as rag_service_module
+from app.services.document_processor import get_document_processor
+from app.services.executors import shutdown_cpu_executor
+from app.services.ingestion_jobs import get_ingestion_queue
+from app.services.metrics import MetricFamily, MetricsMiddleware, batch_size_metrics, cache_metrics, metrics
+from app.services.tracing import TracingMiddleware
+from app.services.upload_store import collect_orphaned_uploads
+from app.services.warmup import start_warmup, warmup_state
 
-app = FastAPI(title="RAG Chatbot API", version="1.0.0")
+# Worker processes when started with `python -m app.main` (same as uvicorn --workers)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+
+def _collect_uploads():
+    try:
+        processor = get_document_processor()
+        queue = get_ingestion_queue()
+        collect_orphaned_uploads(
+            lambda content_hash: queue.is_active(content_hash)
+            or processor.find_document_by_hash(content_hash) is not None
+        )
+    except Exception as e:
+        print(f"Upload GC failed: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load models and indexes in the background; /api/ready reports when they are warm
+    start_warmup()
+    # Remove upload files no document refers to, without delaying startup
+    threading.Thread(target=_collect_uploads, daemon=True).start()
+    yield
+    # Requests have finished: let queued embedding and CPU work complete, then stop their threads
+    processor = document_processor_module.document_processor
+    if processor is not None and processor.query_batcher is not None:
+        batcher, processor.query_batcher = processor.query_batcher, None
+        batcher.close(timeout=10)
+    shutdown_cpu_executor()
+
+
+app = FastAPI(title="RAG Chatbot API", version="1.0.0", lifespan=lifespan)
 
 # CORS middleware to allow frontend connection
 app.add_middleware(
@@ -19,11 +64,47 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# In-flight requests and per-route latency for /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Per-request trace: Server-Timing header, slow-request log and opt-in profiles
+app.add_middleware(TracingMiddleware)
+
 # Include routers
 app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
 app.include_router(documents.router, prefix="/api/documents", tags=["documents"])
 
 
+def _service_metrics():
+    """Cache, batching and queue figures, read at scrape time from the services built so far"""
+    caches = {}
+    families = []
+    processor = document_processor_module.document_processor
+    if processor is not None:
+        caches["query_embedding"] = processor.query_embedding_cache.stats()
+        if processor.embedding_cache:
+            stats = processor.embedding_cache.stats()
+            caches["embedding"] = stats
+            families.append(MetricFamily("embedding_cache_size_bytes", "gauge", "Size of the on-disk embedding cache",
+                                         [("", {}, stats["size_bytes"])]))
+        if processor.query_batcher is not None:
+            families.append(batch_size_metrics("embedding_microbatch_size", "Query texts per local encode call",
+                                               processor.query_batcher.batch_sizes))
+        families.append(MetricFamily("indexed_chunks", "gauge", "Chunks in the vector store",
+                                     [("", {}, processor.registry.chunk_count)]))
+    service = rag_service_module.rag_service
+    if service is not None:
+        caches["answer"] = service.answer_cache.stats()
+    families.extend(cache_metrics(caches))
+    families.append(MetricFamily("ingest_jobs", "gauge", "Tracked ingestion jobs by state",
+                                 [("", {"state": state}, count)
+                                  for state, count in get_ingestion_queue().state_counts().items()]))
+    return families
+
+
+metrics.register_collector(_service_metrics)
+
+
 @app.get("/")
 async def root():
     return {"message": "RAG Chatbot API is running"}
@@ -34,6 +115,23 @@ async def health():
     return {"status": "healthy"}
 
 
+@app.get("/api/ready")
+async def ready():
+    """Readiness probe - 503 until the embedding model and vector store are warm"""
+    state = warmup_state.snapshot()
+    if not state["ready"]:
+        return JSONResponse(status_code=503, content=state)
+    return state
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus text exposition of pipeline latencies, cache hit rates, fallbacks and in-flight requests"""
+    # Collectors read the registry and job table, which check SQLite - keep that off the event loop
+    return PlainTextResponse(await run_in_threadpool(metrics.render), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Several workers need the app as an import string so each process can load it
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, workers=WEB_CONCURRENCY)
 
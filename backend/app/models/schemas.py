@@ -18,15 +18,50 @@ class ChatResponse(BaseModel):
     sources: Optional[List[str]] = []
 
 
+class ConversationHistory(BaseModel):
+    messages: List[ChatMessage]
+    total: int = 0
+    limit: int
+    offset: int = 0
+
+
 class DocumentInfo(BaseModel):
     id: str
     filename: str
     upload_date: str
     status: str
+    content_hash: Optional[str] = None
+    page_count: int = 0
+    chunk_count: int = 0
+    embedding_model: Optional[str] = None
+    extract_seconds: Optional[float] = None
+    embed_seconds: Optional[float] = None
+    store_seconds: Optional[float] = None
+    total_seconds: Optional[float] = None
+
+
+class DocumentList(BaseModel):
+    documents: List[DocumentInfo]
+    total_chunks: int = 0
 
 
 class UploadResponse(BaseModel):
     message: str
     document_id: str
     filename: str
+    job_id: Optional[str] = None
+    status: str = "queued"
+
+
+class JobStatus(BaseModel):
+    job_id: str
+    document_id: str
+    filename: str
+    state: str  # "queued", "running", "completed" or "failed"
+    pages_done: int = 0
+    total_pages: Optional[int] = None
+    chunks_embedded: int = 0
+    total_chunks: Optional[int] = None
+    elapsed_seconds: float = 0.0
+    error: Optional[str] = None
 
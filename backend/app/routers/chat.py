@@ -1,14 +1,17 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import json
 import uuid
 
-from app.models.schemas import ChatRequest, ChatResponse
-from app.services.rag_service import rag_service
+from app.models.schemas import ChatRequest, ChatResponse, ConversationHistory
+from app.services.rag_service import get_rag_service
+from app.services.conversation_store import get_conversation_store
+from app.services.prompt_assembler import PROMPT_HISTORY_MESSAGES
+from app.services.tracing import trace_span
 
 router = APIRouter()
 
-# Simple in-memory conversation storage (use a proper DB in production)
-conversations = {}
-
 
 @router.post("/", response_model=ChatResponse)
 async def chat(request: ChatRequest):
@@ -16,24 +19,21 @@ async def chat(request: ChatRequest):
     try:
         # Get or create conversation ID
         conversation_id = request.conversation_id or str(uuid.uuid4())
+        store = get_conversation_store()
         
-        if conversation_id not in conversations:
-            conversations[conversation_id] = []
+        # Earlier turns give follow-up questions their context
+        with trace_span("history") as attributes:
+            history = await run_in_threadpool(store.recent_messages, conversation_id, PROMPT_HISTORY_MESSAGES)
+            attributes["messages"] = len(history)
         
         # Add user message to conversation
-        conversations[conversation_id].append({
-            "role": "user",
-            "content": request.message
-        })
+        await run_in_threadpool(store.append, conversation_id, "user", request.message)
         
-        # Get RAG response
-        response, sources = rag_service.query(request.message)
+        # Get RAG response - awaits embedding and LLM calls instead of blocking the event loop
+        response, sources = await get_rag_service().aquery(request.message, history)
         
         # Add assistant response to conversation
-        conversations[conversation_id].append({
-            "role": "assistant",
-            "content": response
-        })
+        await run_in_threadpool(store.append, conversation_id, "assistant", response)
         
         return ChatResponse(
             response=response,
@@ -44,10 +44,57 @@ async def chat(request: ChatRequest):
         raise HTTPException(status_code=500, detail=f"Error processing chat: {str(e)}")
 
 
-@router.get("/conversation/{conversation_id}")
-async def get_conversation(conversation_id: str):
-    """Get conversation history"""
-    if conversation_id not in conversations:
-        return {"messages": []}
-    return {"messages": conversations[conversation_id]}
+def _sse(event: str, data: dict) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/stream")
+async def chat_stream(request: ChatRequest):
+    """Handle chat messages with RAG, streaming the answer as server-sent events:
+    "token" events with the text as it is generated, then a "done" event with
+    sources and conversation_id (or an "error" event)"""
+    # Get or create conversation ID
+    conversation_id = request.conversation_id or str(uuid.uuid4())
+    store = get_conversation_store()
+    
+    # Earlier turns give follow-up questions their context
+    with trace_span("history") as attributes:
+        history = await run_in_threadpool(store.recent_messages, conversation_id, PROMPT_HISTORY_MESSAGES)
+        attributes["messages"] = len(history)
+    
+    # Add user message to conversation
+    await run_in_threadpool(store.append, conversation_id, "user", request.message)
+    
+    async def events():
+        parts = []
+        try:
+            pieces, sources = await get_rag_service().astream_query(request.message, history)
+            async for piece in pieces:
+                parts.append(piece)
+                yield _sse("token", {"text": piece})
+        except Exception as e:
+            print(f"Error streaming chat: {e}")
+            yield _sse("error", {"detail": f"Error processing chat: {str(e)}"})
+            return
+        
+        # Add assistant response to conversation
+        await run_in_threadpool(store.append, conversation_id, "assistant", "".join(parts))
+        yield _sse("done", {"conversation_id": conversation_id, "sources": sources})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/conversation/{conversation_id}", response_model=ConversationHistory)
+async def get_conversation(conversation_id: str, limit: int = Query(50, ge=1, le=500), offset: int = Query(0, ge=0)):
+    """Get conversation history, oldest message first, one page at a time"""
+    store = get_conversation_store()
+    messages = await run_in_threadpool(store.get_messages, conversation_id, limit, offset)
+    total = await run_in_threadpool(store.message_count, conversation_id)
+    return ConversationHistory(messages=messages, total=total, limit=limit, offset=offset)
 
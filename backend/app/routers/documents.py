@@ -1,19 +1,32 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException
 from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 from pathlib import Path
-import shutil
 
-from app.models.schemas import UploadResponse
+from app.models.schemas import UploadResponse, JobStatus, DocumentInfo, DocumentList
 from app.services.document_processor import get_document_processor
+from app.services.ingestion_jobs import get_ingestion_queue, IngestionQueueFull
+from app.services.upload_store import save_upload, upload_path_for
 
 router = APIRouter()
 
 ALLOWED_EXTENSIONS = {'.pdf', '.doc', '.docx'}
 
 
+def _remove_unreferenced_upload(processor, content_hash: str, upload_path: Path):
+    """Delete a content-addressed upload unless a document or an ingestion job
+    (in any worker process) still uses the same content"""
+    if get_ingestion_queue().is_active(content_hash) or processor.find_document_by_hash(content_hash):
+        return
+    try:
+        upload_path.unlink()
+    except FileNotFoundError:
+        pass
+
+
 @router.post("/upload", response_model=UploadResponse)
 async def upload_document(file: UploadFile = File(...)):
-    """Upload and process a document"""
+    """Upload a document and queue it for background processing"""
     # Check file extension
     file_ext = Path(file.filename).suffix.lower()
     if file_ext not in ALLOWED_EXTENSIONS:
@@ -23,45 +36,94 @@ async def upload_document(file: UploadFile = File(...)):
         )
     
     upload_path = None
+    content_hash = None
+    processor = None
     try:
-        # Save uploaded file temporarily (in backend/uploads directory)
-        upload_path = Path("uploads") / file.filename
-        upload_path.parent.mkdir(exist_ok=True, parents=True)
-        
-        with open(upload_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Save uploaded file under its SHA-256 (in backend/uploads directory)
+        upload_path, content_hash = await run_in_threadpool(save_upload, file.file, file_ext)
         
-        # Process the document
-        processor = get_document_processor()
-        document_id = processor.process_document(upload_path, file.filename)
+        # Identical content was already indexed - reuse that document
+        processor = await run_in_threadpool(get_document_processor)
+        existing_id = await run_in_threadpool(processor.find_document_by_hash, content_hash)
+        if existing_id:
+            return UploadResponse(
+                message="Document was already uploaded and processed",
+                document_id=existing_id,
+                filename=file.filename,
+                status="duplicate"
+            )
         
-        # Optionally delete the temporary file after processing
-        # upload_path.unlink()
+        # Process the document in the background - poll /jobs/{job_id} for progress
+        queue = await run_in_threadpool(get_ingestion_queue)
+        job = await run_in_threadpool(queue.submit, upload_path, file.filename, content_hash)
         
         return UploadResponse(
-            message="Document uploaded and processed successfully",
-            document_id=document_id,
-            filename=file.filename
+            message="Document uploaded and queued for processing",
+            document_id=job.document_id,
+            filename=file.filename,
+            job_id=job.id,
+            status=job.state
         )
+    except IngestionQueueFull as e:
+        # Another worker may be ingesting the same content from this very file
+        if upload_path is not None:
+            await run_in_threadpool(_remove_unreferenced_upload, processor, content_hash, upload_path)
+        raise HTTPException(status_code=503, detail=f"Server busy, please retry shortly: {str(e)}")
     except Exception as e:
-        # Clean up on error
-        if upload_path and upload_path.exists():
-            try:
-                upload_path.unlink()
-            except:
-                pass
         raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
 
 
-@router.get("/list")
+@router.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job_status(job_id: str):
+    """Get the progress of a background ingestion job"""
+    # The first call builds the queue; jobs no longer in memory are read from SQLite
+    queue = await run_in_threadpool(get_ingestion_queue)
+    job = await run_in_threadpool(queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_status()
+
+
+@router.get("/list", response_model=DocumentList)
 async def list_documents():
     """List all processed documents"""
     try:
-        # Get unique documents from collection metadata
-        processor = get_document_processor()
-        collection = processor.collection
-        # This is simplified - in production, maintain a separate document registry
-        return {"documents": [], "message": "Document listing not fully implemented in MVP"}
+        processor = await run_in_threadpool(get_document_processor)
+        documents = await run_in_threadpool(processor.registry.list_documents)
+        total_chunks = await run_in_threadpool(lambda: processor.registry.chunk_count)
+        return DocumentList(
+            documents=[DocumentInfo(**document) for document in documents],
+            total_chunks=total_chunks
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error listing documents: {str(e)}")
 
+
+@router.get("/{document_id}", response_model=DocumentInfo)
+async def get_document(document_id: str):
+    """Get details of a processed document"""
+    processor = await run_in_threadpool(get_document_processor)
+    document = await run_in_threadpool(processor.registry.get, document_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return DocumentInfo(**document)
+
+
+@router.delete("/{document_id}")
+async def delete_document(document_id: str):
+    """Delete a document, its chunks and its stored pages"""
+    try:
+        processor = await run_in_threadpool(get_document_processor)
+        document = await run_in_threadpool(processor.delete_document, document_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting document: {str(e)}")
+    if document is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    # Remove the uploaded file unless another document or job has the same content
+    content_hash = document.get("content_hash")
+    if content_hash:
+        upload_path = upload_path_for(content_hash, Path(document["filename"]).suffix.lower())
+        await run_in_threadpool(_remove_unreferenced_upload, processor, content_hash, upload_path)
+    
+    return {"message": "Document deleted", "document_id": document_id}
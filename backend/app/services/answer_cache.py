@@ -0,0 +1,104 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# Answers kept for reuse; least recently used answers are evicted beyond this
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+# Minimum cosine similarity between a new question and a cached one to reuse its answer
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+
+
+class CachedAnswer(NamedTuple):
+    vector: np.ndarray  # unit-length question embedding
+    primary_term: str
+    response: str
+    sources: List[str]
+
+
+class AnswerCache:
+    """Semantic cache of chat answers, valid for one corpus version
+
+    A question hits when its embedding is within the similarity threshold of
+    a cached question and both have the same primary search term, so
+    "define complete graph" never reuses the answer to "define complete path"
+    however close their embeddings are. Any change to the corpus (see
+    DocumentRegistry.corpus_version) empties the cache."""
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_SIZE, threshold: float = ANSWER_CACHE_THRESHOLD):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> CachedAnswer
+        self._next_key = 0
+        self._corpus_version = None
+        # Stacked vectors of all entries, rebuilt lazily after changes
+        self._matrix = None
+        self._keys = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _is_stale(self, corpus_version: int) -> bool:
+        return self._corpus_version is not None and corpus_version < self._corpus_version
+
+    def _sync_version(self, corpus_version: int):
+        if corpus_version != self._corpus_version:
+            self._entries.clear()
+            self._matrix = None
+            self._corpus_version = corpus_version
+
+    def lookup(self, embedding: List[float], primary_term: str, corpus_version: int) -> Optional[Tuple[str, List[str]]]:
+        """Cached (response, sources) for a question, or None"""
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            # A request that read the corpus version before a change must not roll the cache back
+            if self._is_stale(corpus_version):
+                self.misses += 1
+                return None
+            self._sync_version(corpus_version)
+            if not self._entries:
+                self.misses += 1
+                return None
+            if self._matrix is None:
+                self._keys = list(self._entries)
+                self._matrix = np.stack([self._entries[key].vector for key in self._keys])
+            similarities = self._matrix @ _unit(embedding)
+            for i in np.argsort(-similarities):
+                if similarities[i] < self.threshold:
+                    break
+                entry = self._entries[self._keys[i]]
+                if entry.primary_term == primary_term:
+                    self._entries.move_to_end(self._keys[i])
+                    self.hits += 1
+                    return entry.response, list(entry.sources)
+            self.misses += 1
+            return None
+
+    def store(self, embedding: List[float], primary_term: str, corpus_version: int, response: str, sources: List[str]):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            # An answer built from an older corpus than the cache has seen is already stale
+            if self._is_stale(corpus_version):
+                return
+            self._sync_version(corpus_version)
+            self._entries[self._next_key] = CachedAnswer(_unit(embedding), primary_term, response, list(sources))
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "corpus_version": self._corpus_version}
+
+
+def _unit(embedding: List[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
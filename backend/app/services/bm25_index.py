@@ -0,0 +1,213 @@
+import os
+import re
+import math
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from app.services.shared_state import connect_sqlite
+
+# SQLite file holding the inverted index, next to the vector store by default
+BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH", "./bm25_index.sqlite3")
+# BM25 term-frequency saturation and length normalisation
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+# Query terms found in more than this share of chunks are skipped: they barely move BM25 scores
+# but have the longest posting lists
+BM25_MAX_DF_RATIO = float(os.getenv("BM25_MAX_DF_RATIO", "0.1"))
+# Reciprocal rank fusion constant: larger values flatten the gap between top ranks
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+
+# Terms in fewer chunks than this are never skipped, so small corpora keep every term
+_MIN_DF_CUTOFF = 50
+_TERM_RE = re.compile(r"\w+")
+
+# English function words: neither indexed nor searched
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between both
+but by can could did do does doing down during each few for from further had has have having he her here hers
+herself him himself his how i if in into is it its itself just me more most my myself no nor not now of off on
+once only or other our ours ourselves out over own same she should so some such than that the their theirs them
+themselves then there these they this those through to too under until up very was we were what when where which
+while who whom why will with would you your yours yourself yourselves
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    return _TERM_RE.findall(text.lower())
+
+
+class BM25Index:
+    """Inverted index over chunk text with BM25 scoring
+
+    Postings live only in SQLite, clustered by term with each chunk's length
+    alongside, so a query reads just the posting lists of its own terms and
+    nothing is loaded at startup. Stopwords are not indexed, and query terms
+    in more than BM25_MAX_DF_RATIO of the chunks are skipped, which bounds the
+    rows a query reads. Searches use a per-thread read connection and one
+    read transaction, so they score outside the write lock on a consistent
+    snapshot, and see what other worker processes committed without any
+    refresh."""
+
+    def __init__(self, path: str = BM25_INDEX_PATH, k1: float = BM25_K1, b: float = BM25_B,
+                 max_df_ratio: float = BM25_MAX_DF_RATIO):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.max_df_ratio = max_df_ratio
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._conn = connect_sqlite(path)
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                document_id TEXT NOT NULL,
+                length INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_document ON chunks (document_id)")
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(postings)")]
+        if columns and "length" not in columns:
+            self._migrate_postings()
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                chunk INTEGER NOT NULL,
+                tf INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                PRIMARY KEY (term, chunk)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_postings_chunk ON postings (chunk)")
+        # Corpus stats for BM25, kept in the same transactions as the postings
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('chunks', (SELECT COUNT(*) FROM chunks))")
+        self._conn.execute("INSERT OR IGNORE INTO meta (key, value) "
+                           "VALUES ('total_length', (SELECT COALESCE(SUM(length), 0) FROM chunks))")
+        self._conn.commit()
+
+    def _migrate_postings(self):
+        """Rebuild postings from the first layout (rowid table, no lengths, stopwords included)"""
+        print("BM25 index: migrating postings to the term-clustered layout")
+        self._conn.execute("ALTER TABLE postings RENAME TO postings_old")
+        self._conn.execute("DROP INDEX IF EXISTS idx_postings_chunk")
+        self._conn.execute("""
+            CREATE TABLE postings (
+                term TEXT NOT NULL,
+                chunk INTEGER NOT NULL,
+                tf INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                PRIMARY KEY (term, chunk)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute(
+            f"INSERT INTO postings (term, chunk, tf, length) "
+            f"SELECT p.term, p.chunk, p.tf, c.length FROM postings_old p JOIN chunks c ON c.row = p.chunk "
+            f"WHERE p.term NOT IN ({','.join('?' * len(STOPWORDS))})", sorted(STOPWORDS))
+        self._conn.execute("DROP TABLE postings_old")
+
+    def _reader(self):
+        """This thread's read connection; WAL readers never wait for the writer"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect_sqlite(self.path)
+        return conn
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT value FROM meta WHERE key = 'chunks'").fetchone()[0]
+
+    def add(self, document_id: str, ids: List[str], texts: List[str]):
+        """Index a batch of chunks belonging to one document"""
+        with self._lock:
+            postings = []
+            added = 0
+            added_length = 0
+            for chunk_id, text in zip(ids, texts):
+                terms = tokenize(text)
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO chunks (id, document_id, length) VALUES (?, ?, ?)",
+                    (chunk_id, document_id, len(terms)))
+                if not cursor.rowcount:
+                    continue  # already indexed
+                added += 1
+                added_length += len(terms)
+                postings.extend((term, cursor.lastrowid, tf, len(terms))
+                                for term, tf in Counter(terms).items() if term not in STOPWORDS)
+            self._conn.executemany("INSERT INTO postings (term, chunk, tf, length) VALUES (?, ?, ?, ?)", postings)
+            self._update_stats(added, added_length)
+            self._conn.commit()
+
+    def _update_stats(self, chunks: int, length: int):
+        self._conn.executemany("UPDATE meta SET value = value + ? WHERE key = ?",
+                               [(chunks, "chunks"), (length, "total_length")])
+
+    def delete_document(self, document_id: str):
+        with self._lock:
+            rows = self._conn.execute("SELECT row, length FROM chunks WHERE document_id = ?",
+                                      (document_id,)).fetchall()
+            if not rows:
+                return
+            for start in range(0, len(rows), 500):
+                part = [row for row, _ in rows[start:start + 500]]
+                self._conn.execute(f"DELETE FROM postings WHERE chunk IN ({','.join('?' * len(part))})", part)
+            self._conn.execute("DELETE FROM chunks WHERE document_id = ?", (document_id,))
+            self._update_stats(-len(rows), -sum(length for _, length in rows))
+            self._conn.commit()
+
+    def search(self, query: str, n_results: int = 20) -> List[Tuple[str, float]]:
+        """Top chunks for the query as (chunk id, BM25 score), best first"""
+        terms = {term for term in tokenize(query) if term not in STOPWORDS}
+        if not terms or n_results <= 0:
+            return []
+        conn = self._reader()
+        # One read transaction: stats, postings and ids all come from the same snapshot
+        conn.execute("BEGIN")
+        try:
+            stats = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('chunks', 'total_length')"))
+            total = stats.get("chunks", 0)
+            if not total:
+                return []
+            avg_length = stats.get("total_length", 0) / total or 1.0
+            max_df = max(_MIN_DF_CUTOFF, int(total * self.max_df_ratio))
+            rows = []
+            scores = []
+            for term in terms:
+                # Counting stops at the cutoff and builds no Python rows, so common terms cost little
+                df = conn.execute("SELECT COUNT(*) FROM (SELECT 1 FROM postings WHERE term = ? LIMIT ?)",
+                                  (term, max_df + 1)).fetchone()[0]
+                if not df or df > max_df:
+                    continue
+                postings = np.asarray(conn.execute("SELECT chunk, tf, length FROM postings WHERE term = ?",
+                                                   (term,)).fetchall(), dtype=np.float64)
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                tf = postings[:, 1]
+                norm = self.k1 * (1 - self.b + self.b * postings[:, 2] / avg_length)
+                rows.append(postings[:, 0].astype(np.int64))
+                scores.append(idf * tf * (self.k1 + 1) / (tf + norm))
+            if not rows:
+                return []
+            chunks, inverse = np.unique(np.concatenate(rows), return_inverse=True)
+            totals = np.bincount(inverse, weights=np.concatenate(scores))
+            k = min(n_results, len(totals))
+            best = np.argpartition(-totals, k - 1)[:k]
+            best = best[np.argsort(-totals[best])]
+            best_rows = [int(chunks[i]) for i in best]
+            ids = dict(conn.execute(f"SELECT row, id FROM chunks WHERE row IN ({','.join('?' * len(best_rows))})",
+                                    best_rows))
+            return [(ids[row], float(totals[i])) for row, i in zip(best_rows, best) if row in ids]
+        finally:
+            conn.commit()
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = HYBRID_RRF_K) -> List[str]:
+    """Merge ranked id lists: each id scores sum(1 / (k + rank)) over the lists it appears in"""
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] += 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -0,0 +1,146 @@
+import os
+from typing import Dict, FrozenSet, List, NamedTuple, Optional
+
+from app.services.prompt_assembler import TokenCounter
+from app.services.sentence_index import IndexedChunk, as_indexed
+
+# Remove overlap and near-duplicates from the selected chunks before generation
+CONTEXT_COMPACTION = os.getenv("CONTEXT_COMPACTION", "true").lower() == "true"
+# Share of a chunk's word shingles found in a better-ranked chunk above which it is dropped as a near-duplicate
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+# MMR trade-off between rank (1.0 keeps the selection order) and novelty against chunks already placed
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+
+# Words per shingle when comparing chunks
+_SHINGLE_WORDS = 5
+
+
+class CompactedContext(NamedTuple):
+    chunks: List[str]
+    tokens_before: int
+    tokens_after: int
+    merged: int      # chunks joined into a neighbour from the same document
+    duplicates: int  # near-duplicate chunks dropped
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+def _shingles(chunk: IndexedChunk) -> FrozenSet[int]:
+    words = chunk.lower_text.split()
+    if len(words) <= _SHINGLE_WORDS:
+        return frozenset([hash(tuple(words))])
+    return frozenset(hash(tuple(words[i:i + _SHINGLE_WORDS])) for i in range(len(words) - _SHINGLE_WORDS + 1))
+
+
+def _containment(candidate: FrozenSet[int], other: FrozenSet[int]) -> float:
+    """Share of the candidate's shingles found in the other chunk; a long chunk that merely
+    contains a short one is not contained in it"""
+    if not candidate or not other:
+        return 0.0
+    return len(candidate & other) / len(candidate)
+
+
+def _overlap_words(first: List[str], second: List[str]) -> int:
+    """Length of the longest run of words that ends first and starts second"""
+    for k in range(min(len(first), len(second)), 0, -1):
+        if first[-k] == second[0] and first[-k:] == second[:k]:
+            return k
+    return 0
+
+
+class ContextCompactor:
+    """Shrinks the selected context chunks without losing their content
+
+    Chunks overlap by design (see DocumentProcessor.iter_chunks), so the
+    selection often repeats passages. Three steps, all on text already in
+    memory:
+    1. neighbouring chunks of one document (consecutive chunk_index) are
+       joined into one, with the overlapping words kept once, in the place
+       of the better-ranked of them;
+    2. a chunk whose word shingles are mostly contained in a better-ranked
+       one is dropped;
+    3. the rest are reordered by maximal marginal relevance, so a chunk that
+       largely repeats the ones before it moves behind more novel ones and is
+       the first to be cut by the prompt budget.
+    The first chunk always stays first."""
+
+    def __init__(self, counter: Optional[TokenCounter] = None, duplicate_threshold: float = CONTEXT_DUPLICATE_THRESHOLD,
+                 mmr_lambda: float = CONTEXT_MMR_LAMBDA):
+        self.counter = counter or TokenCounter()
+        self.duplicate_threshold = duplicate_threshold
+        self.mmr_lambda = mmr_lambda
+
+    def compact(self, chunks: List[str]) -> CompactedContext:
+        indexed = [as_indexed(chunk) for chunk in chunks]
+        tokens_before = sum(self.counter.count(chunk) for chunk in indexed)
+        merged_chunks = self._merge_neighbours(indexed)
+        shingles = [_shingles(chunk) for chunk in merged_chunks]
+        kept = self._drop_duplicates(merged_chunks, shingles)
+        ordered = self._diversify(kept, shingles)
+        result = [merged_chunks[i] for i in ordered]
+        # Joined chunks are counted afresh; overlap only shows up as savings once it is gone
+        tokens_after = sum(self.counter.count(chunk) for chunk in result)
+        return CompactedContext(result, tokens_before, tokens_after,
+                                len(indexed) - len(merged_chunks), len(merged_chunks) - len(kept))
+
+    def _merge_neighbours(self, chunks: List[IndexedChunk]) -> List[IndexedChunk]:
+        """Join runs of consecutive chunks of one document; each run takes its best rank"""
+        by_document: Dict[str, List[int]] = {}
+        for rank, chunk in enumerate(chunks):
+            if chunk.document_id is not None and chunk.chunk_index is not None:
+                by_document.setdefault(chunk.document_id, []).append(rank)
+        replacement: Dict[int, IndexedChunk] = {}  # best rank of a run -> joined chunk
+        absorbed = set()
+        for ranks in by_document.values():
+            ranks.sort(key=lambda rank: chunks[rank].chunk_index)
+            run = [ranks[0]]
+            for rank in ranks[1:] + [None]:
+                if rank is not None and chunks[rank].chunk_index == chunks[run[-1]].chunk_index + 1:
+                    run.append(rank)
+                    continue
+                if len(run) > 1:
+                    replacement[min(run)] = self._join([chunks[r] for r in run])
+                    absorbed.update(run)
+                if rank is not None:
+                    run = [rank]
+        merged = []
+        for rank, chunk in enumerate(chunks):
+            if rank in replacement:
+                merged.append(replacement[rank])
+            elif rank not in absorbed:
+                merged.append(chunk)
+        return merged
+
+    @staticmethod
+    def _join(run: List[IndexedChunk]) -> IndexedChunk:
+        """One chunk from consecutive chunks (in chunk_index order), overlapping words kept once"""
+        words = run[0].split(" ")
+        for chunk in run[1:]:
+            following = chunk.split(" ")
+            words.extend(following[_overlap_words(words, following):])
+        return IndexedChunk(" ".join(words), None, run[0].document_id, run[0].chunk_index)
+
+    def _drop_duplicates(self, chunks: List[IndexedChunk], shingles: List[FrozenSet[int]]) -> List[int]:
+        kept = []
+        for i in range(len(chunks)):
+            if all(_containment(shingles[i], shingles[j]) < self.duplicate_threshold for j in kept):
+                kept.append(i)
+        return kept
+
+    def _diversify(self, candidates: List[int], shingles: List[FrozenSet[int]]) -> List[int]:
+        """MMR order: relevance from the selection rank, redundancy as the highest overlap with a chunk placed earlier"""
+        if len(candidates) <= 2 or self.mmr_lambda >= 1.0:
+            return list(candidates)
+        relevance = {i: 1.0 - position / len(candidates) for position, i in enumerate(candidates)}
+        ordered = [candidates[0]]
+        redundancy = {i: _containment(shingles[i], shingles[candidates[0]]) for i in candidates[1:]}
+        while redundancy:
+            best = max(redundancy, key=lambda i: (self.mmr_lambda * relevance[i]
+                                                  - (1.0 - self.mmr_lambda) * redundancy[i], relevance[i]))
+            ordered.append(best)
+            del redundancy[best]
+            for i in redundancy:
+                redundancy[i] = max(redundancy[i], _containment(shingles[i], shingles[best]))
+        return ordered
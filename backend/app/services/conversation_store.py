@@ -0,0 +1,173 @@
+import os
+import time
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+from app.services.shared_state import connect_sqlite, data_version
+from app.services.ttl_cache import TTLCache
+
+# SQLite database holding every conversation message
+CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", "./conversations.sqlite3")
+# Conversations kept in the in-memory hot tier, and how long an idle one stays there
+CONVERSATION_CACHE_SIZE = int(os.getenv("CONVERSATION_CACHE_SIZE", "1000"))
+CONVERSATION_CACHE_TTL = int(os.getenv("CONVERSATION_CACHE_TTL", "1800"))
+# Most recent messages of a hot conversation held in memory
+CONVERSATION_HOT_MESSAGES = int(os.getenv("CONVERSATION_HOT_MESSAGES", "20"))
+
+
+class ConversationStore:
+    """Chat history, one ordered list of {"role", "content"} messages per conversation"""
+
+    def append(self, conversation_id: str, role: str, content: str):
+        raise NotImplementedError
+
+    def get_messages(self, conversation_id: str, limit: int = 50, offset: int = 0) -> List[Dict[str, str]]:
+        """A page of messages, oldest first"""
+        raise NotImplementedError
+
+    def recent_messages(self, conversation_id: str, n: int) -> List[Dict[str, str]]:
+        """The last n messages, oldest first"""
+        raise NotImplementedError
+
+    def message_count(self, conversation_id: str) -> int:
+        raise NotImplementedError
+
+
+class _HotConversation:
+    def __init__(self, messages: List[Dict[str, str]], total: int, version: int):
+        self.messages = deque(messages, maxlen=CONVERSATION_HOT_MESSAGES)
+        self.total = total
+        # Database data_version when total was last known to be current
+        self.version = version
+
+
+class SQLiteConversationStore(ConversationStore):
+    """Conversations persisted in SQLite (WAL) with an LRU + TTL in-memory tier
+
+    The hot tier holds only the tail of recently active conversations, so
+    memory stays bounded however long the process runs; everything else is
+    read from SQLite on demand. With several worker processes a conversation
+    can be continued by any of them: a hot entry is checked against the
+    database's message count whenever another process has committed since."""
+
+    def __init__(self, path: str = CONVERSATION_DB_PATH, cache_size: int = CONVERSATION_CACHE_SIZE,
+                 cache_ttl: int = CONVERSATION_CACHE_TTL):
+        self._lock = threading.Lock()
+        self._hot = TTLCache(cache_size, cache_ttl)
+        self._conn = connect_sqlite(path)
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                message_count INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                conversation_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (conversation_id, seq)
+            )
+        """)
+        self._conn.commit()
+
+    def _count(self, conversation_id: str) -> int:
+        row = self._conn.execute("SELECT message_count FROM conversations WHERE id = ?",
+                                 (conversation_id,)).fetchone()
+        return row[0] if row else 0
+
+    def _load_tail(self, conversation_id: str, n: int) -> List[Dict[str, str]]:
+        rows = self._conn.execute(
+            "SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY seq DESC LIMIT ?",
+            (conversation_id, n)).fetchall()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+    def _cached(self, conversation_id: str) -> Optional[_HotConversation]:
+        """The hot entry, unless another process has added messages it is missing"""
+        hot = self._hot.get(conversation_id)
+        if hot is not None:
+            version = data_version(self._conn)
+            if version != hot.version:
+                if self._count(conversation_id) != hot.total:
+                    self._hot.pop(conversation_id)
+                    return None
+                hot.version = version
+        return hot
+
+    def _hot_conversation(self, conversation_id: str) -> _HotConversation:
+        hot = self._cached(conversation_id)
+        if hot is None:
+            version = data_version(self._conn)
+            hot = _HotConversation(self._load_tail(conversation_id, CONVERSATION_HOT_MESSAGES),
+                                   self._count(conversation_id), version)
+        # (Re)inserting refreshes both its LRU position and its TTL
+        self._hot.put(conversation_id, hot)
+        return hot
+
+    def append(self, conversation_id: str, role: str, content: str):
+        now = time.time()
+        with self._lock:
+            hot = self._hot_conversation(conversation_id)
+            # The count is bumped first: that takes the database write lock, so the
+            # sequence number read back is ours even if another process appends too
+            self._conn.execute(
+                "INSERT INTO conversations (id, created_at, updated_at, message_count) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT(id) DO UPDATE SET updated_at = excluded.updated_at, message_count = message_count + 1",
+                (conversation_id, now, now))
+            seq = self._count(conversation_id) - 1
+            self._conn.execute(
+                "INSERT INTO messages (conversation_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                (conversation_id, seq, role, content, now))
+            self._conn.commit()
+            if seq != hot.total:
+                # Another process appended in between; reload the tail on next use
+                self._hot.pop(conversation_id)
+                return
+            hot.messages.append({"role": role, "content": content})
+            hot.total += 1
+
+    def get_messages(self, conversation_id: str, limit: int = 50, offset: int = 0) -> List[Dict[str, str]]:
+        with self._lock:
+            hot = self._cached(conversation_id)
+            # Pages that fall inside the in-memory tail don't touch the database
+            if hot is not None and offset >= hot.total - len(hot.messages):
+                start = offset - (hot.total - len(hot.messages))
+                return [dict(m) for m in list(hot.messages)[start:start + limit]]
+            rows = self._conn.execute(
+                "SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY seq LIMIT ? OFFSET ?",
+                (conversation_id, limit, offset)).fetchall()
+            return [{"role": role, "content": content} for role, content in rows]
+
+    def recent_messages(self, conversation_id: str, n: int) -> List[Dict[str, str]]:
+        if n <= 0:
+            return []
+        with self._lock:
+            hot = self._hot_conversation(conversation_id)
+            if n <= len(hot.messages) or len(hot.messages) == hot.total:
+                return [dict(m) for m in list(hot.messages)[-n:]]
+            return self._load_tail(conversation_id, n)
+
+    def message_count(self, conversation_id: str) -> int:
+        with self._lock:
+            hot = self._cached(conversation_id)
+            return hot.total if hot is not None else self._count(conversation_id)
+
+
+# Global instance - lazy initialization
+conversation_store = None
+_store_lock = threading.Lock()
+
+
+def get_conversation_store() -> ConversationStore:
+    global conversation_store
+    if conversation_store is None:
+        with _store_lock:
+            if conversation_store is None:
+                conversation_store = SQLiteConversationStore()
+    return conversation_store
@@ -1,295 +1,723 @@
 import os
+import re
+import time
+import asyncio
 import uuid
+import threading
+import importlib.util
+from bisect import bisect_right
+from itertools import chain
 from pathlib import Path
-from typing import List, Tuple, Dict
-import PyPDF2
+from typing import List, Tuple, Dict, Optional, Callable, Iterable, Iterator, NamedTuple
 import docx
+import numpy as np
 from datetime import datetime
 
-# For embeddings - using OpenAI (can be replaced with other providers)
-try:
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
+from app.services.pdf_extraction import extract_pdf_pages, iter_pdf_pages, count_pages
+from app.services.embedding_cache import EmbeddingCache
+from app.services.page_store import PageStore
+from app.services.document_registry import DocumentRegistry
+from app.services.bm25_index import BM25Index, reciprocal_rank_fusion
+from app.services.ttl_cache import TTLCache
+from app.services.executors import run_cpu
+from app.services.micro_batcher import MicroBatcher
+from app.services.metrics import FALLBACKS, INGEST_CHUNKS, INGEST_DOCUMENTS, INGEST_STAGE_SECONDS, RAG_STAGE_SECONDS
+from app.services.tracing import annotate, trace_span
+from app.services.sentence_index import IndexedChunk, decode_sentences, encode_sentences, segment_sentences
+from app.services.embedding_compression import EMBEDDING_DIMENSIONS, truncate_embeddings
+
+# For embeddings - using OpenAI (can be replaced with other providers).
+# Only checked for here; the SDKs are imported when the processor is built, not at import time.
+OPENAI_AVAILABLE = importlib.util.find_spec("openai") is not None
+if not OPENAI_AVAILABLE:
     print("Warning: OpenAI not installed. Set OPENAI_API_KEY or install openai package.")
 
 # Vector database
-try:
-    import chromadb
-    CHROMADB_AVAILABLE = True
-except ImportError:
-    CHROMADB_AVAILABLE = False
+CHROMADB_AVAILABLE = importlib.util.find_spec("chromadb") is not None
+if not CHROMADB_AVAILABLE:
     print("Warning: ChromaDB not installed. Install chromadb package.")
 
+from app.services.vector_store import VECTOR_STORE_BACKEND, create_vector_store
+
 # Create uploads directory relative to backend folder
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+OPENAI_EMBEDDING_MODEL = "text-embedding-3-small"
+LOCAL_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# Number of chunks sent per embedding request / encode call
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
+# OpenAI embedding request limits (2048 inputs, 300k tokens per request).
+# Token counts are estimated from characters, so stay well under the hard cap.
+OPENAI_MAX_BATCH_INPUTS = 2048
+OPENAI_MAX_BATCH_TOKENS = int(os.getenv("OPENAI_MAX_BATCH_TOKENS", "250000"))
+
+# In-memory cache of query embeddings, keyed by model and normalized query text
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+QUERY_EMBEDDING_CACHE_TTL = int(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "3600"))
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Paragraph breaks and words, matched the same way as text.split('\n\n') then para.split()
+_TOKEN_RE = re.compile(r'\n\n|\S+')
+
+
+class TextChunk(NamedTuple):
+    text: str
+    start: int  # character offset of the first word in the concatenated document text
+    end: int    # character offset just past the last word
+
+
+def _iter_tokens(pieces: Iterable[str]) -> Iterator[Optional[Tuple[str, int, int]]]:
+    """Yield (word, start, end) for the words of streamed text, with None marking each
+    paragraph break. Offsets index into the concatenation of all pieces."""
+    tail = ""
+    base = 0  # offset of tail[0] in the concatenated text
+    for piece in pieces:
+        text = tail + piece
+        # Hold back the trailing whitespace run or partial word - it may continue in the next piece
+        cut = len(text)
+        trailing_space = text[-1:].isspace()
+        while cut > 0 and text[cut - 1].isspace() == trailing_space:
+            cut -= 1
+        for match in _TOKEN_RE.finditer(text, 0, cut):
+            token = match.group()
+            yield None if token == '\n\n' else (token, base + match.start(), base + match.end())
+        tail = text[cut:]
+        base += cut
+    for match in _TOKEN_RE.finditer(tail):
+        token = match.group()
+        yield None if token == '\n\n' else (token, base + match.start(), base + match.end())
+
+
+def _make_chunk(words: List[Tuple[str, int, int]]) -> TextChunk:
+    return TextChunk(" ".join(word for word, _, _ in words), words[0][1], words[-1][2])
+
+
+class PageOffsets:
+    """Page numbers of character offsets in the concatenated text of pages read so far,
+    each page followed by a newline"""
+    
+    def __init__(self):
+        self._starts = []
+        self._numbers = []
+        self._end = 0
+    
+    def add(self, page_num: int, page_text: str):
+        self._starts.append(self._end)
+        self._numbers.append(page_num)
+        self._end += len(page_text) + 1
+    
+    def page_at(self, offset: int) -> int:
+        return self._numbers[max(0, bisect_right(self._starts, offset) - 1)]
+
 
 class DocumentProcessor:
     def __init__(self):
-        if not CHROMADB_AVAILABLE:
+        if VECTOR_STORE_BACKEND == "chroma" and not CHROMADB_AVAILABLE:
             raise ImportError("ChromaDB is required. Install it with: pip install chromadb")
         
-        # Use PersistentClient for newer ChromaDB versions
+        # Chunk embeddings (ChromaDB or the in-process numpy store, see VECTOR_STORE_BACKEND)
+        self.vector_store = create_vector_store()
+        
+        # Page texts for page queries, persisted alongside the vector store
+        self.page_store = PageStore()
+        
+        # Registry of indexed documents and cached corpus stats
+        self.registry = DocumentRegistry()
+        self.registry.reconcile(self.vector_store.count())
+        
+        # Lexical index for hybrid search; without it search is vector-only
         try:
-            self.client = chromadb.PersistentClient(path="./chroma_db")
-        except AttributeError:
-            # Fallback for older versions
-            from chromadb.config import Settings
-            self.client = chromadb.Client(Settings(
-                chroma_db_impl="duckdb+parquet",
-                persist_directory="./chroma_db"
-            ))
+            self.bm25_index = BM25Index()
+            if not len(self.bm25_index) and self.vector_store.count():
+                self._backfill_bm25_index()
+        except Exception as e:
+            print(f"Warning: BM25 index unavailable, using vector search only: {e}")
+            self.bm25_index = None
         
-        # Get or create collection
-        self.collection = self.client.get_or_create_collection(
-            name="documents"
-        )
+        # Corpus version the in-memory indexes last caught up with; other worker processes ingest too
+        self._synced_version = self.registry.corpus_version
+        self._sync_lock = threading.Lock()
         
         # Initialize OpenAI client if available
         self.openai_client = None
+        self.async_openai_client = None
+        self.embedding_model = None
+        self.query_batcher = None
         if OPENAI_AVAILABLE:
             api_key = os.getenv("OPENAI_API_KEY")
             if api_key:
+                from openai import OpenAI, AsyncOpenAI
                 self.openai_client = OpenAI(api_key=api_key)
+                # Used by request handlers so embedding calls don't block the event loop
+                self.async_openai_client = AsyncOpenAI(api_key=api_key)
         
         # Fallback: use sentence transformers if OpenAI not available
         if not self.openai_client:
             try:
                 from sentence_transformers import SentenceTransformer
-                self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+                self.embedding_model = SentenceTransformer(LOCAL_EMBEDDING_MODEL)
                 print("Using sentence-transformers for embeddings")
+                # Concurrent chat queries share forward passes instead of encoding one string each
+                self.query_batcher = MicroBatcher(lambda texts: self._encode_local(texts, EMBEDDING_BATCH_SIZE),
+                                                  name="query-embedding-batcher")
             except ImportError:
                 print("Warning: No embedding model available. Install openai or sentence-transformers")
                 self.embedding_model = None
+        self.embedding_model_name = OPENAI_EMBEDDING_MODEL if self.openai_client else LOCAL_EMBEDDING_MODEL
+        if EMBEDDING_DIMENSIONS:
+            # Shortened vectors are a different embedding space - keep them apart in caches and the registry
+            self.embedding_model_name += f"@{EMBEDDING_DIMENSIONS}"
+        
+        # Persistent embedding cache - a failure here only costs re-embedding
+        try:
+            self.embedding_cache = EmbeddingCache()
+        except Exception as e:
+            print(f"Warning: embedding cache unavailable: {e}")
+            self.embedding_cache = None
+        
+        # Users repeat the same questions; their embeddings stay in memory and never reach the provider
+        self.query_embedding_cache = TTLCache(QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL)
+    
+    def _backfill_bm25_index(self, page_size: int = 1000):
+        """Index chunks stored before the BM25 index existed"""
+        offset = 0
+        while True:
+            items = self.vector_store.get(limit=page_size, offset=offset)
+            if not items["ids"]:
+                break
+            by_document = {}
+            for chunk_id, text, metadata in zip(items["ids"], items["documents"], items["metadatas"]):
+                document_id = (metadata or {}).get("document_id", "")
+                ids, texts = by_document.setdefault(document_id, ([], []))
+                ids.append(chunk_id)
+                texts.append(text)
+            for document_id, (ids, texts) in by_document.items():
+                self.bm25_index.add(document_id, ids, texts)
+            offset += len(items["ids"])
+        print(f"BM25 index built for {len(self.bm25_index)} existing chunks")
     
     def get_embedding(self, text: str) -> List[float]:
-        """Generate embedding for text"""
-        if self.openai_client:
+        """Generate embedding for a query text"""
+        return self.get_query_embeddings([text])[0]
+    
+    def get_embeddings(self, texts: List[str], batch_size: int = None) -> List[List[float]]:
+        """Generate embeddings for many texts in batches, preserving input order.
+        Texts already in the embedding cache are not re-embedded."""
+        if not texts:
+            return []
+        batch_size = max(1, batch_size or EMBEDDING_BATCH_SIZE)
+        
+        embeddings = [None] * len(texts)
+        if self.embedding_cache:
+            embeddings = self.embedding_cache.get_many(self.embedding_model_name, texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            computed = self._compute_embeddings([texts[i] for i in missing], batch_size)
+            for i, embedding in zip(missing, computed):
+                embeddings[i] = embedding
+        return embeddings
+    
+    def get_query_embeddings(self, queries: List[str]) -> List[List[float]]:
+        """Embed search queries, in order, through the in-memory query cache.
+        All cache misses are embedded together in one batch."""
+        with trace_span("embed", RAG_STAGE_SECONDS) as attributes:
+            embeddings, missing = self._lookup_query_embeddings(queries)
+            attributes.update(texts=len(queries), cache_misses=len(missing))
+            if missing:
+                # Embed the normalized text so a cached vector never depends on which spelling arrived first
+                texts = [text for _, text in missing]
+                if self.query_batcher is not None:
+                    computed = self.query_batcher(texts)
+                else:
+                    computed = self._compute_embeddings(texts, EMBEDDING_BATCH_SIZE, persist=False)
+                self._fill_query_embeddings(embeddings, missing, computed)
+            return embeddings
+    
+    async def aget_query_embeddings(self, queries: List[str]) -> List[List[float]]:
+        """Async get_query_embeddings: OpenAI through the async client, local encoding through the micro-batcher"""
+        with trace_span("embed", RAG_STAGE_SECONDS) as attributes:
+            embeddings, missing = self._lookup_query_embeddings(queries)
+            attributes.update(texts=len(queries), cache_misses=len(missing))
+            if missing:
+                computed = await self._acompute_query_embeddings([text for _, text in missing])
+                self._fill_query_embeddings(embeddings, missing, computed)
+            return embeddings
+    
+    def _lookup_query_embeddings(self, queries: List[str]):
+        """Cached embeddings in query order (None where missing) and {cache key: positions} of the misses"""
+        keys = [(self.embedding_model_name, _WHITESPACE_RE.sub(' ', query).strip().lower()) for query in queries]
+        embeddings = [self.query_embedding_cache.get(key) for key in keys]
+        missing = {}
+        for i, (key, embedding) in enumerate(zip(keys, embeddings)):
+            if embedding is None:
+                missing.setdefault(key, []).append(i)
+        return embeddings, missing
+    
+    def _fill_query_embeddings(self, embeddings: List, missing: Dict, computed: List[List[float]]):
+        for (key, positions), embedding in zip(missing.items(), computed):
+            self.query_embedding_cache.put(key, embedding)
+            for i in positions:
+                embeddings[i] = embedding
+    
+    async def _acompute_query_embeddings(self, texts: List[str]) -> List[List[float]]:
+        if self.async_openai_client:
             try:
-                response = self.openai_client.embeddings.create(
-                    model="text-embedding-3-small",
-                    input=text
+                options = {"dimensions": EMBEDDING_DIMENSIONS} if EMBEDDING_DIMENSIONS else {}
+                response = await self.async_openai_client.embeddings.create(
+                    model=OPENAI_EMBEDDING_MODEL,
+                    input=texts,
+                    **options
                 )
-                return response.data[0].embedding
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
             except Exception as e:
                 print(f"OpenAI embedding error: {e}, falling back to sentence-transformers")
-                if self.embedding_model:
-                    return self.embedding_model.encode(text).tolist()
-                raise Exception(f"OpenAI failed and no fallback: {e}")
+                if not self.embedding_model:
+                    raise Exception(f"OpenAI failed and no fallback: {e}")
+                FALLBACKS.inc(kind="local_embedding")
+                annotate(embedding_error=type(e).__name__)
+        if self.query_batcher is not None:
+            # Wait for the batch without holding an executor thread
+            return await asyncio.wrap_future(self.query_batcher.submit(texts))
+        raise Exception("No embedding model available")
+    
+    def _compute_embeddings(self, texts: List[str], batch_size: int, persist: bool = True) -> List[List[float]]:
+        """Embed texts with the configured provider and, if persist, write them to the embedding cache"""
+        if self.openai_client:
+            embeddings = []
+            for batch in self._openai_batches(texts, batch_size):
+                batch_embeddings, from_primary = self._embed_openai_batch(batch, batch_size)
+                # Fallback vectors come from a different model and must not be cached as OpenAI's
+                if from_primary and persist:
+                    self._cache_embeddings(batch, batch_embeddings)
+                embeddings.extend(batch_embeddings)
+            return embeddings
         elif self.embedding_model:
-            return self.embedding_model.encode(text).tolist()
+            embeddings = self._encode_local(texts, batch_size)
+            if persist:
+                self._cache_embeddings(texts, embeddings)
+            return embeddings
         else:
             raise Exception("No embedding model available")
     
-    def extract_text_from_pdf(self, file_path: Path) -> Tuple[str, List[Tuple[int, str]]]:
-        """Extract text from PDF file with page information
+    def _cache_embeddings(self, texts: List[str], embeddings: List[List[float]]):
+        if self.embedding_cache:
+            try:
+                self.embedding_cache.put_many(self.embedding_model_name, texts, embeddings)
+            except Exception as e:
+                print(f"Embedding cache write error: {e}")
+    
+    def _embed_openai_batch(self, batch: List[str], batch_size: int) -> Tuple[List[List[float]], bool]:
+        """Embed one request-sized batch with OpenAI, falling back to sentence-transformers
+        Returns: (embeddings, whether they came from OpenAI)"""
+        try:
+            options = {"dimensions": EMBEDDING_DIMENSIONS} if EMBEDDING_DIMENSIONS else {}
+            response = self.openai_client.embeddings.create(
+                model=OPENAI_EMBEDDING_MODEL,
+                input=batch,
+                **options
+            )
+            # The API documents that data follows input order, but sort by index to be safe
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)], True
+        except Exception as e:
+            print(f"OpenAI embedding error: {e}, falling back to sentence-transformers")
+            if self.embedding_model:
+                FALLBACKS.inc(kind="local_embedding")
+                annotate(embedding_error=type(e).__name__)
+                return self._encode_local(batch, batch_size), False
+            raise Exception(f"OpenAI failed and no fallback: {e}")
+    
+    def _encode_local(self, texts: List[str], batch_size: int) -> List[List[float]]:
+        """Embed with sentence-transformers, shortened to EMBEDDING_DIMENSIONS if configured"""
+        embeddings = self.embedding_model.encode(texts, batch_size=batch_size)
+        return truncate_embeddings(embeddings, EMBEDDING_DIMENSIONS).tolist()
+    
+    def _openai_batches(self, texts: List[str], batch_size: int):
+        """Yield consecutive slices of texts that fit the OpenAI per-request limits"""
+        max_inputs = min(batch_size, OPENAI_MAX_BATCH_INPUTS)
+        batch = []
+        batch_tokens = 0
+        for text in texts:
+            # Rough estimate: ~4 characters per token for English text
+            tokens = len(text) // 4 + 1
+            if batch and (len(batch) >= max_inputs or batch_tokens + tokens > OPENAI_MAX_BATCH_TOKENS):
+                yield batch
+                batch = []
+                batch_tokens = 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            yield batch
+    
+    def extract_text_from_pdf(self, file_path: Path, workers: Optional[int] = None) -> Tuple[str, List[Tuple[int, str]]]:
+        """Extract text from PDF file with page information (large files use a process pool)
         Returns: (full_text, list of (page_num, page_text))"""
-        full_text = ""
-        pages_data = []
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page_num, page in enumerate(pdf_reader.pages, start=1):
-                page_text = page.extract_text()
-                full_text += page_text + "\n"
-                pages_data.append((page_num, page_text))
+        pages_data = extract_pdf_pages(file_path, workers)
+        full_text = "".join(f"{page_text}\n" for _, page_text in pages_data)
         return full_text, pages_data
     
     def extract_text_from_docx(self, file_path: Path) -> str:
         """Extract text from DOCX file"""
         doc = docx.Document(file_path)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
+        return "".join(f"{paragraph.text}\n" for paragraph in doc.paragraphs)
+    
+    def iter_document_pages(self, file_path: Path, filename: str) -> Iterator[Tuple[int, str]]:
+        """Yield (page_num, page_text) for a document without loading it all at once"""
+        if filename.endswith('.pdf'):
+            yield from iter_pdf_pages(file_path)
+        elif filename.endswith(('.doc', '.docx')):
+            # For DOCX, treat as single "page"
+            yield 1, self.extract_text_from_docx(file_path)
+        else:
+            raise ValueError(f"Unsupported file type: {filename}")
     
     def chunk_text(self, text: str, chunk_size: int = 1500, overlap: int = 300) -> List[str]:
         """Split text into chunks with overlap - larger chunks for better context"""
-        # Try to split by paragraphs first for better semantic units
-        paragraphs = text.split('\n\n')
-        chunks = []
+        return [chunk.text for chunk in self.iter_chunks([text], chunk_size, overlap)]
+    
+    @staticmethod
+    def iter_chunks(pieces: Iterable[str], chunk_size: int = 1500, overlap: int = 300) -> Iterator[TextChunk]:
+        """Stream chunks out of text arriving in pieces (e.g. pages), holding at most one chunk
+        and one paragraph window in memory. Produces the same chunks as splitting the
+        concatenated text by paragraphs: paragraphs are packed into chunks of up to
+        chunk_size words, and paragraphs larger than chunk_size are cut into overlapping
+        word windows. Each chunk carries its character span in the concatenated text."""
+        step = chunk_size - overlap
         current_chunk = []
-        current_length = 0
+        para_words = []
+        windowed = False  # current paragraph is larger than chunk_size
         
-        for para in paragraphs:
-            para_words = para.split()
-            para_length = len(para_words)
+        # A trailing None closes the last paragraph
+        for token in chain(_iter_tokens(pieces), [None]):
+            if token is not None:
+                para_words.append(token)
+                if windowed:
+                    if len(para_words) == chunk_size:
+                        yield _make_chunk(para_words)
+                        del para_words[:step]
+                elif len(para_words) > chunk_size:
+                    # Paragraph is too large - save current chunk, then split it into windows
+                    if current_chunk:
+                        yield _make_chunk(current_chunk)
+                        current_chunk = []
+                    windowed = True
+                    yield _make_chunk(para_words[:chunk_size])
+                    del para_words[:step]
+                continue
             
-            # If paragraph is too large, split it
-            if para_length > chunk_size:
-                # First, save current chunk if exists
-                if current_chunk:
-                    chunks.append(" ".join(current_chunk))
-                    current_chunk = []
-                    current_length = 0
-                
-                # Split large paragraph into smaller chunks
-                for i in range(0, para_length, chunk_size - overlap):
-                    chunk = " ".join(para_words[i:i + chunk_size])
-                    if chunk.strip():
-                        chunks.append(chunk)
+            # End of paragraph
+            if windowed:
+                while para_words:
+                    yield _make_chunk(para_words[:chunk_size])
+                    del para_words[:step]
+                windowed = False
             else:
                 # Check if adding this para would exceed chunk size
-                if current_length + para_length > chunk_size and current_chunk:
-                    chunks.append(" ".join(current_chunk))
+                if len(current_chunk) + len(para_words) > chunk_size and current_chunk:
+                    yield _make_chunk(current_chunk)
                     # Keep overlap - take last few words from previous chunk
                     overlap_words = min(overlap // 10, len(current_chunk))
                     current_chunk = current_chunk[-overlap_words:] if overlap_words > 0 else []
-                    current_length = len(current_chunk)
                 
                 # Add paragraph to current chunk
                 current_chunk.extend(para_words)
-                current_length += para_length
+            para_words = []
         
         # Add remaining chunk
         if current_chunk:
-            chunks.append(" ".join(current_chunk))
+            yield _make_chunk(current_chunk)
+    
+    def process_document(self, file_path: Path, filename: str, document_id: Optional[str] = None,
+                         progress: Optional[Callable[..., None]] = None, content_hash: Optional[str] = None) -> str:
+        """Process a document and store it in the vector database with page information
+        progress, if given, is called with keyword updates (pages_done, total_pages,
+        chunks_embedded, total_chunks) as ingestion advances"""
+        document_id = document_id or str(uuid.uuid4())
+        upload_date = datetime.now().isoformat()
+        started = time.perf_counter()
+        # Seconds spent per ingest stage; the stages interleave as the pipeline streams.
+        # The registry records extract, embed and store; the rest only go to /metrics.
+        timings = {"extract_seconds": 0.0, "embed_seconds": 0.0, "store_seconds": 0.0, "chunk_seconds": 0.0,
+                   "sentence_index_seconds": 0.0, "page_store_seconds": 0.0}
         
-        # Fallback: if no chunks created, use word-based splitting
-        if not chunks:
-            words = text.split()
-            for i in range(0, len(words), chunk_size - overlap):
-                chunk = " ".join(words[i:i + chunk_size])
-                if chunk.strip():
-                    chunks.append(chunk)
+        if filename.endswith('.pdf') and progress:
+            progress(total_pages=count_pages(file_path))
         
-        return chunks
-    
-    def process_document(self, file_path: Path, filename: str) -> str:
-        """Process a document and store it in the vector database with page information"""
-        document_id = str(uuid.uuid4())
+        # Pages are written to the page store for page queries; everything downstream streams
+        page_writer = self.page_store.writer(document_id)
+        # For mapping chunks back to the pages they were cut from
+        page_offsets = PageOffsets()
         
-        # Extract text based on file type
-        pages_data = None
-        if filename.endswith('.pdf'):
-            text, pages_data = self.extract_text_from_pdf(file_path)
-        elif filename.endswith(('.doc', '.docx')):
-            text = self.extract_text_from_docx(file_path)
-            # For DOCX, treat as single "page"
-            pages_data = [(1, text)]
-        else:
-            raise ValueError(f"Unsupported file type: {filename}")
+        def page_texts():
+            pages = self.iter_document_pages(file_path, filename)
+            while True:
+                extract_start = time.perf_counter()
+                page = next(pages, None)
+                timings["extract_seconds"] += time.perf_counter() - extract_start
+                if page is None:
+                    break
+                page_num, page_text = page
+                store_start = time.perf_counter()
+                page_writer.add_page(page_num, page_text)
+                timings["page_store_seconds"] += time.perf_counter() - store_start
+                page_offsets.add(page_num, page_text)
+                if progress:
+                    progress(pages_done=page_num)
+                yield page_text + "\n"
+        
+        # Stream pages -> chunks -> batched embeddings -> vector store, so peak memory
+        # depends on EMBEDDING_BATCH_SIZE rather than on the document size
+        chunk_count = 0
+        batch = []
+        chunks = self.iter_chunks(page_texts())
+        try:
+            while True:
+                chunk_start = time.perf_counter()
+                reading = timings["extract_seconds"] + timings["page_store_seconds"]
+                chunk = next(chunks, None)
+                # The chunker pulls pages in as it goes; their extraction and storage are stages of their own
+                timings["chunk_seconds"] += (time.perf_counter() - chunk_start
+                                             - (timings["extract_seconds"] + timings["page_store_seconds"] - reading))
+                if chunk is None:
+                    break
+                # Every page a chunk was cut from has been read by the time it is yielded
+                batch.append((chunk, page_offsets.page_at(chunk.start), page_offsets.page_at(chunk.end - 1)))
+                if len(batch) >= EMBEDDING_BATCH_SIZE:
+                    self._store_chunk_batch(document_id, filename, upload_date, content_hash, chunk_count, batch, timings)
+                    chunk_count += len(batch)
+                    batch = []
+                    if progress:
+                        progress(chunks_embedded=chunk_count)
+            if batch:
+                self._store_chunk_batch(document_id, filename, upload_date, content_hash, chunk_count, batch, timings)
+                chunk_count += len(batch)
+            
+            if chunk_count == 0:
+                raise ValueError("No text extracted from document")
+        except Exception:
+            INGEST_DOCUMENTS.inc(outcome="failed")
+            # Don't leave a partially indexed document behind
+            page_writer.abort()
+            if chunk_count:
+                try:
+                    self.vector_store.delete(where={"document_id": document_id})
+                    if self.bm25_index is not None:
+                        self.bm25_index.delete_document(document_id)
+                except Exception as e:
+                    print(f"Error removing partial chunks for document {document_id}: {e}")
+            raise
         
-        if not text.strip():
-            raise ValueError("No text extracted from document")
+        if progress:
+            progress(chunks_embedded=chunk_count, total_chunks=chunk_count)
         
-        # Store pages data for page queries
-        if not hasattr(self, '_document_pages'):
-            self._document_pages = {}
-        self._document_pages[document_id] = pages_data if pages_data else []
-        print(f"Stored {len(pages_data) if pages_data else 0} pages for document {document_id}")
+        store_start = time.perf_counter()
+        page_writer.commit()
+        timings["page_store_seconds"] += time.perf_counter() - store_start
+        timings["total_seconds"] = time.perf_counter() - started
+        self.registry.add({
+            "id": document_id,
+            "filename": filename,
+            "content_hash": content_hash,
+            "status": "ready",
+            "page_count": page_writer.page_count,
+            "chunk_count": chunk_count,
+            "embedding_model": self.embedding_model_name,
+            "upload_date": upload_date,
+            **{key: round(timings[key], 3) for key in ("extract_seconds", "embed_seconds", "store_seconds",
+                                                       "total_seconds")}
+        })
+        print(f"Stored {page_writer.page_count} pages and {chunk_count} chunks for document {document_id} "
+              f"in {timings['total_seconds']:.1f}s")
+        INGEST_DOCUMENTS.inc(outcome="completed")
+        INGEST_CHUNKS.inc(chunk_count)
+        for stage in ("extract", "chunk", "sentence_index", "embed", "store", "page_store"):
+            INGEST_STAGE_SECONDS.observe(timings[f"{stage}_seconds"], stage=stage)
         
-        # Chunk the text
-        chunks = self.chunk_text(text)
+        return document_id
+    
+    def _store_chunk_batch(self, document_id: str, filename: str, upload_date: str, content_hash: Optional[str],
+                           first_index: int, batch: List[Tuple[TextChunk, int, int]], timings: Dict[str, float]):
+        """Embed one batch of (chunk, start page, end page) and write it to the vector store"""
+        texts = [chunk.text for chunk, _, _ in batch]
+        sentence_start = time.perf_counter()
+        # Sentence boundaries and definition flags for the extractive answer path
+        sentences = [encode_sentences(segment_sentences(text)) for text in texts]
+        timings["sentence_index_seconds"] += time.perf_counter() - sentence_start
+        embed_start = time.perf_counter()
+        embeddings = self.get_embeddings(texts)
+        timings["embed_seconds"] += time.perf_counter() - embed_start
         
-        # Generate embeddings and store in vector DB
-        embeddings = []
         ids = []
         metadatas = []
-        documents = []
-        
-        for i, chunk in enumerate(chunks):
-            chunk_id = f"{document_id}_{i}"
-            embedding = self.get_embedding(chunk)
-            
-            # Determine which page this chunk likely belongs to
-            page_num = 1
-            if pages_data:
-                # Find page by checking which page contains most of this chunk
-                chunk_lower = chunk.lower()
-                best_page = 1
-                max_overlap = 0
-                for pnum, ptext in pages_data:
-                    # Count word overlap
-                    chunk_words = set(chunk_lower.split())
-                    page_words = set(ptext.lower().split())
-                    overlap = len(chunk_words & page_words)
-                    if overlap > max_overlap:
-                        max_overlap = overlap
-                        best_page = pnum
-                page_num = best_page
-            
-            embeddings.append(embedding)
-            ids.append(chunk_id)
+        for i, ((chunk, page_start, page_end), chunk_sentences) in enumerate(zip(batch, sentences), start=first_index):
+            ids.append(f"{document_id}_{i}")
             metadatas.append({
                 "document_id": document_id,
                 "filename": filename,
                 "chunk_index": i,
-                "page_number": page_num,
-                "upload_date": datetime.now().isoformat()
+                "page_number": page_start,
+                "page_start": page_start,
+                "page_end": page_end,
+                "char_start": chunk.start,
+                "char_end": chunk.end,
+                "upload_date": upload_date,
+                "content_hash": content_hash or "",
+                "sentences": chunk_sentences
             })
-            documents.append(chunk)
         
-        # Add to collection
-        self.collection.add(
-            embeddings=embeddings,
+        store_start = time.perf_counter()
+        self.vector_store.add(
             ids=ids,
-            metadatas=metadatas,
-            documents=documents
+            embeddings=embeddings,
+            documents=texts,
+            metadatas=metadatas
         )
-        
-        return document_id
+        if self.bm25_index is not None:
+            self.bm25_index.add(document_id, ids, texts)
+        timings["store_seconds"] += time.perf_counter() - store_start
+    
+    def find_document_by_hash(self, content_hash: str) -> Optional[str]:
+        """Return the id of an already indexed document with this file hash, if any"""
+        document = self.registry.find_by_hash(content_hash)
+        return document["id"] if document else None
+    
+    def delete_document(self, document_id: str) -> Optional[dict]:
+        """Remove a document's chunks, pages and registry entry, returning its record"""
+        document = self.registry.get(document_id)
+        if document is None:
+            return None
+        self.vector_store.delete(where={"document_id": document_id})
+        if self.bm25_index is not None:
+            self.bm25_index.delete_document(document_id)
+        self.page_store.delete(document_id)
+        return self.registry.delete(document_id)
     
     def get_page_content(self, document_id: str, page_num: int) -> str:
         """Get content of a specific page"""
-        if not hasattr(self, '_document_pages'):
-            print(f"Warning: _document_pages not found")
+        page_text = self.page_store.get_page(document_id, page_num)
+        if page_text is None:
+            print(f"Page {page_num} not found in document {document_id}")
             return ""
-        pages_data = self._document_pages.get(document_id, [])
-        print(f"Looking for page {page_num} in document {document_id}, found {len(pages_data)} pages")
-        for pnum, ptext in pages_data:
-            if pnum == page_num:
-                print(f"Found page {page_num}, content length: {len(ptext)}")
-                return ptext
-        print(f"Page {page_num} not found in document {document_id}")
-        return ""
+        return page_text
     
     def get_total_pages(self, document_id: str) -> int:
         """Get total number of pages for a document"""
-        if not hasattr(self, '_document_pages'):
-            return 0
-        pages_data = self._document_pages.get(document_id, [])
-        return len(pages_data) if pages_data else 0
+        return self.page_store.page_count(document_id)
     
     def search_documents(self, query: str, n_results: int = 10) -> List[Tuple[str, float]]:
-        """Search for relevant document chunks with better retrieval"""
+        """Search for relevant document chunks, fusing vector and BM25 rankings
+        Returns: (text, distance) pairs, most relevant first; the texts are IndexedChunks"""
         try:
-            query_embedding = self.get_embedding(query)
-            
-            # Get more results than needed, then filter
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=min(n_results * 2, 20)  # Get more results for better selection
-            )
-            
-            # Format results: (text, distance)
-            retrieved_chunks = []
-            if results.get('documents') and len(results['documents'][0]) > 0:
-                documents = results['documents'][0]
-                distances = results.get('distances', [])[0] if results.get('distances') else [0] * len(documents)
-                
-                # Pair documents with distances and sort by relevance (lower distance = more relevant)
-                chunk_distances = list(zip(documents, distances))
-                chunk_distances.sort(key=lambda x: x[1])  # Sort by distance (ascending)
-                
-                # Return top n_results
-                for doc, distance in chunk_distances[:n_results]:
-                    retrieved_chunks.append((doc, distance))
-            
-            return retrieved_chunks
+            return self.search_embedded([query], self.get_query_embeddings([query]), n_results)
         except Exception as e:
             print(f"Search error: {e}")
             return []
+    
+    async def asearch_variants(self, queries: List[str], n_results: int = 10) -> List[Tuple[str, float]]:
+        """Search with each query variant in turn and return the first non-empty result.
+        All variants are embedded up front in a single batch (or served from the query cache);
+        the search itself runs on the CPU executor."""
+        try:
+            query_embeddings = await self.aget_query_embeddings(queries)
+            return await run_cpu(self.search_embedded, queries, query_embeddings, n_results)
+        except Exception as e:
+            print(f"Search error: {e}")
+            return []
+    
+    def search_embedded(self, queries: List[str], query_embeddings: List[List[float]],
+                        n_results: int = 10) -> List[Tuple[str, float]]:
+        """First non-empty search result among already embedded query variants"""
+        self._sync_corpus()
+        for query, query_embedding in zip(queries, query_embeddings):
+            results = self._search(query, query_embedding, n_results)
+            if results:
+                return results
+        return []
+    
+    def _sync_corpus(self):
+        """Bring in documents other worker processes added or removed since the last search
+        (the BM25 index reads SQLite directly and is always current)"""
+        version = self.registry.corpus_version
+        if version == self._synced_version:
+            return
+        with self._sync_lock:
+            if version == self._synced_version:
+                return
+            self.vector_store.refresh()
+            self._synced_version = version
+    
+    def _search(self, query: str, query_embedding: List[float], n_results: int) -> List[Tuple[str, float]]:
+        # Get more results than needed, then filter
+        n_candidates = min(n_results * 2, 20)
+        with trace_span("vector_search", RAG_STAGE_SECONDS) as attributes:
+            hits = self.vector_store.query([query_embedding], n_results=n_candidates)[0]
+            attributes["candidates"] = len(hits)
+        
+        if self.bm25_index is None:
+            # Format results: (text, distance), sorted by relevance (lower distance = more relevant)
+            chunk_distances = sorted(((self._indexed_chunk(hit.document, hit.metadata), hit.distance) for hit in hits),
+                                     key=lambda x: x[1])
+            return chunk_distances[:n_results]
+        
+        # Exact-term matches outside the vector top-k still make it into the candidates
+        with trace_span("lexical_search", RAG_STAGE_SECONDS) as attributes:
+            lexical_ids = [chunk_id for chunk_id, _ in self.bm25_index.search(query, n_candidates)]
+            fused_ids = reciprocal_rank_fusion([[hit.id for hit in hits], lexical_ids])[:n_results]
+            
+            results = {hit.id: (self._indexed_chunk(hit.document, hit.metadata), hit.distance) for hit in hits}
+            missing = [chunk_id for chunk_id in fused_ids if chunk_id not in results]
+            attributes.update(candidates=len(lexical_ids), lexical_only=len(missing))
+            if missing:
+                results.update(self._lexical_only_results(missing, query_embedding))
+            return [results[chunk_id] for chunk_id in fused_ids if chunk_id in results]
+    
+    def _lexical_only_results(self, ids: List[str], query_embedding: List[float]) -> Dict[str, Tuple[str, float]]:
+        """Text and squared L2 distance to the query for chunks the vector search did not return"""
+        items = self.vector_store.get(ids=ids, include_embeddings=True)
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        results = {}
+        for chunk_id, text, metadata, embedding in zip(items["ids"], items["documents"], items["metadatas"],
+                                                       items["embeddings"]):
+            difference = np.asarray(embedding, dtype=np.float32) - query_vector
+            results[chunk_id] = (self._indexed_chunk(text, metadata), float(difference @ difference))
+        return results
+    
+    @staticmethod
+    def _indexed_chunk(text: str, metadata: Optional[dict]) -> IndexedChunk:
+        """Chunk text with its source and the sentence index stored at ingest (segmented on demand for older chunks)"""
+        metadata = metadata or {}
+        sentences = decode_sentences(metadata.get("sentences"))
+        if sentences and sentences[-1].end > len(text):
+            sentences = None
+        return IndexedChunk(text, sentences, metadata.get("document_id"), metadata.get("chunk_index"))
+    
+    def warm_up_embeddings(self):
+        """Load the embedding model's weights with a first encode (OpenAI has nothing local to warm)"""
+        if self.embedding_model is not None:
+            self._encode_local(["warm-up"], 1)
+        elif self.openai_client is None:
+            raise RuntimeError("No embedding model available")
+    
+    def warm_up_vector_store(self):
+        """Run one query so the vector index is loaded before the first user search"""
+        items = self.vector_store.get(limit=1, include_embeddings=True)
+        if items["ids"]:
+            self.vector_store.query([items["embeddings"][0]], n_results=1)
 
 
 # Global instance - lazy initialization
 document_processor = None
+_processor_lock = threading.Lock()
 
 def get_document_processor():
     global document_processor
     if document_processor is None:
-        document_processor = DocumentProcessor()
+        # Startup warm-up and early requests may get here at the same time - build it once
+        with _processor_lock:
+            if document_processor is None:
+                document_processor = DocumentProcessor()
     return document_processor
 
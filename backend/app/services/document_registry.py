@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import threading
+from typing import List, Optional
+
+from app.services.shared_state import connect_sqlite, data_version
+
+# SQLite database tracking every indexed document
+DOCUMENT_REGISTRY_PATH = os.getenv("DOCUMENT_REGISTRY_PATH", "./documents.sqlite3")
+
+_COLUMNS = [
+    "id", "filename", "content_hash", "status", "page_count", "chunk_count", "embedding_model",
+    "upload_date", "extract_seconds", "embed_seconds", "store_seconds", "total_seconds",
+]
+
+
+class DocumentRegistry:
+    """Indexed documents plus cached corpus stats (version, chunk and document counts)
+
+    The corpus version increases whenever a document is added or removed, so
+    anything derived from the corpus can tell when it is stale. Stats are kept
+    in memory and reloaded only when another worker process has committed to
+    the registry, so per-request checks never query the tables."""
+
+    def __init__(self, path: str = DOCUMENT_REGISTRY_PATH):
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                content_hash TEXT,
+                status TEXT NOT NULL,
+                page_count INTEGER NOT NULL DEFAULT 0,
+                chunk_count INTEGER NOT NULL DEFAULT 0,
+                embedding_model TEXT,
+                upload_date TEXT NOT NULL,
+                extract_seconds REAL,
+                embed_seconds REAL,
+                store_seconds REAL,
+                total_seconds REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_hash ON documents (content_hash)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('corpus_version', 0)")
+        self._conn.commit()
+        self._load_stats()
+        # Chunks in the vector store that predate the registry (see reconcile)
+        self._untracked_chunks = 0
+
+    def _load_stats(self):
+        self._data_version = data_version(self._conn)
+        row = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(chunk_count), 0) FROM documents").fetchone()
+        self._document_count, self._chunk_count = row[0], row[1]
+        self._corpus_version = self._conn.execute(
+            "SELECT value FROM meta WHERE key = 'corpus_version'").fetchone()[0]
+
+    def _bump_version(self):
+        self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'corpus_version'")
+        self._corpus_version += 1
+
+    def _refresh(self):
+        """Reload the stats if another process added or removed documents"""
+        with self._lock:
+            if data_version(self._conn) != self._data_version:
+                self._load_stats()
+
+    def reconcile(self, vector_store_count: int):
+        """Account for chunks indexed before documents were registered"""
+        self._untracked_chunks = max(0, vector_store_count - self._chunk_count)
+        if self._untracked_chunks:
+            print(f"Document registry: {self._untracked_chunks} chunks in the vector store are not registered")
+
+    @property
+    def corpus_version(self) -> int:
+        self._refresh()
+        return self._corpus_version
+
+    @property
+    def chunk_count(self) -> int:
+        self._refresh()
+        return self._chunk_count + self._untracked_chunks
+
+    @property
+    def document_count(self) -> int:
+        self._refresh()
+        return self._document_count
+
+    def add(self, document: dict):
+        values = [document.get(column) for column in _COLUMNS]
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO documents ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                values
+            )
+            self._bump_version()
+            self._conn.commit()
+            self._load_stats()
+
+    def delete(self, document_id: str) -> Optional[dict]:
+        """Remove a document, returning its record if it existed"""
+        with self._lock:
+            document = self._get(document_id)
+            if document is None:
+                return None
+            self._conn.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+            self._bump_version()
+            self._conn.commit()
+            self._load_stats()
+            return document
+
+    def _get(self, document_id: str) -> Optional[dict]:
+        row = self._conn.execute("SELECT * FROM documents WHERE id = ?", (document_id,)).fetchone()
+        return dict(row) if row else None
+
+    def get(self, document_id: str) -> Optional[dict]:
+        with self._lock:
+            return self._get(document_id)
+
+    def find_by_hash(self, content_hash: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM documents WHERE content_hash = ? LIMIT 1",
+                                     (content_hash,)).fetchone()
+            return dict(row) if row else None
+
+    def list_documents(self) -> List[dict]:
+        """All documents, newest first"""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM documents ORDER BY upload_date DESC").fetchall()
+            return [dict(row) for row in rows]
+
+    def latest(self) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM documents ORDER BY upload_date DESC LIMIT 1").fetchone()
+            return dict(row) if row else None
@@ -0,0 +1,104 @@
+import os
+import time
+import hashlib
+import threading
+from array import array
+from typing import List, Optional
+
+from app.services.shared_state import connect_sqlite, data_version
+
+# On-disk cache of chunk embeddings keyed by (model, sha256 of the text)
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.sqlite3")
+# Size cap for cached vectors; least recently used entries are evicted beyond it
+EMBEDDING_CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", "512"))
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent LRU cache of embeddings, so unchanged chunks are never embedded twice"""
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_bytes: int = int(EMBEDDING_CACHE_MAX_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._load_size()
+
+    def _load_size(self):
+        self._data_version = data_version(self._conn)
+        row = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+        self._size = row[0]
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Return cached vectors in input order, None where a text is not cached"""
+        hashes = [text_hash(text) for text in texts]
+        found = {}
+        with self._lock:
+            # Stay below SQLite's bound-parameter limit
+            for start in range(0, len(hashes), 500):
+                part = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *part]
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, h) for h in found]
+                )
+                self._conn.commit()
+            self.hits += sum(1 for h in hashes if h in found)
+            self.misses += sum(1 for h in hashes if h not in found)
+        return [array('f', found[h]).tolist() if h in found else None for h in hashes]
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        now = time.time()
+        rows = [(model, text_hash(text), array('f', vector).tobytes(), now)
+                for text, vector in zip(texts, vectors)]
+        with self._lock:
+            if data_version(self._conn) != self._data_version:
+                # Other worker processes share the cache; recount what they added
+                self._load_size()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._size += sum(len(row[2]) for row in rows)
+            if self._size > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache is 10% under its cap"""
+        target = self.max_bytes * 0.9
+        cursor = self._conn.execute("SELECT model, text_hash, LENGTH(vector) FROM embeddings ORDER BY last_used")
+        evicted = []
+        for model, h, size in cursor:
+            if self._size <= target:
+                break
+            evicted.append((model, h))
+            self._size -= size
+        cursor.close()
+        self._conn.executemany("DELETE FROM embeddings WHERE model = ? AND text_hash = ?", evicted)
+        print(f"Embedding cache: evicted {len(evicted)} entries")
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size_bytes": self._size}
@@ -0,0 +1,128 @@
+import os
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+# Keep only the first N embedding dimensions (0 = model default). OpenAI
+# text-embedding-3 models shorten natively via the `dimensions` parameter;
+# other models are cut and re-normalised (Matryoshka-style). Changing this
+# requires re-indexing existing documents.
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0"))
+# Scalar quantization of stored vectors: "none", "float16" or "int8"
+EMBEDDING_QUANTIZATION = os.getenv("EMBEDDING_QUANTIZATION", "none").lower()
+# Candidates fetched from the quantized index per requested result, then rescored at full precision
+EMBEDDING_RESCORE_FACTOR = int(os.getenv("EMBEDDING_RESCORE_FACTOR", "4"))
+
+QUANTIZATION_MODES = ("none", "float16", "int8")
+
+# Rows cast to float32 at a time when scoring codes: small enough to stay in cache, large enough for BLAS
+_SCORE_BLOCK_ROWS = 1024
+
+
+def truncate_embeddings(vectors: np.ndarray, dimensions: int) -> np.ndarray:
+    """Keep the leading dimensions of each row and re-normalise to unit length"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not dimensions or dimensions >= vectors.shape[-1]:
+        return vectors
+    cut = vectors[..., :dimensions]
+    norms = np.linalg.norm(cut, axis=-1, keepdims=True)
+    return cut / np.maximum(norms, 1e-12)
+
+
+class QuantizedMatrix:
+    """Row vectors stored as float16 or per-row scaled int8 codes
+
+    Scores are approximate dot products; callers rescore the best candidates
+    against full-precision vectors (see search_with_rescoring). Codes are
+    cast to float32 block by block so scoring runs through BLAS without a
+    full-size copy: int8 then scores about as fast as float32, while numpy's
+    slow float16 conversion leaves float16 several times slower."""
+
+    def __init__(self, codes: np.ndarray, scales: Optional[np.ndarray], mode: str):
+        self.codes = codes
+        self.scales = scales
+        self.mode = mode
+
+    @classmethod
+    def from_float(cls, vectors: np.ndarray, mode: str = EMBEDDING_QUANTIZATION) -> "QuantizedMatrix":
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode: {mode}")
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if mode == "int8":
+            codes, scales = quantize_int8(vectors)
+            return cls(codes, scales, mode)
+        if mode == "float16":
+            return cls(vectors.astype(np.float16), None, mode)
+        return cls(vectors, None, mode)
+
+    def __len__(self) -> int:
+        return self.codes.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Approximate dot product of every row with the query"""
+        query = np.asarray(query, dtype=np.float32)
+        if self.mode == "none":
+            return self.codes @ query
+        scores = np.empty(len(self.codes), dtype=np.float32)
+        buffer = np.empty((min(_SCORE_BLOCK_ROWS, len(self.codes)), self.codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(self.codes), _SCORE_BLOCK_ROWS):
+            block = self.codes[start:start + _SCORE_BLOCK_ROWS]
+            cast = buffer[:len(block)]
+            np.copyto(cast, block, casting="unsafe")
+            np.matmul(cast, query, out=scores[start:start + len(block)])
+        if self.mode == "int8":
+            # Dot with the raw codes, then apply each row's scale
+            scores *= self.scales
+        return scores
+
+    def to_float(self) -> np.ndarray:
+        if self.mode == "int8":
+            return self.codes.astype(np.float32) * self.scales[:, None]
+        return self.codes.astype(np.float32)
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 quantization: row ~= codes * scale"""
+    scales = np.abs(vectors).max(axis=1, initial=0.0) / 127.0
+    scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first"""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+def search_with_rescoring(index: QuantizedMatrix, full_precision: Callable[[np.ndarray], np.ndarray],
+                          query: np.ndarray, k: int, rescore_factor: int = EMBEDDING_RESCORE_FACTOR,
+                          alive: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+    """Top-k (row, dot product) search over a quantized index
+
+    The quantized scores pick k * rescore_factor candidates; full_precision(rows)
+    returns their float32 vectors, which decide the final order. Rows where
+    alive is False are never returned."""
+    query = np.asarray(query, dtype=np.float32)
+    approximate = index.scores(query)
+    if alive is not None:
+        # Masked before top-k, so deleted rows take no candidate slots
+        approximate[~alive] = -np.inf
+        k = min(k, int(np.count_nonzero(alive)))
+    if index.mode == "none" or rescore_factor <= 1:
+        rows = top_k(approximate, k)
+        return [(int(row), float(approximate[row])) for row in rows]
+    candidates = top_k(approximate, k * rescore_factor)
+    if alive is not None:
+        candidates = candidates[alive[candidates]]
+    exact = full_precision(np.sort(candidates)) @ query
+    order = np.argsort(-exact)[:k]
+    rows = np.sort(candidates)[order]
+    return [(int(row), float(exact[i])) for row, i in zip(rows, order)]
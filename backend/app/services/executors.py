@@ -0,0 +1,42 @@
+import os
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, TypeVar
+
+# Threads for CPU-bound request work (local encoding, vector search, regex extraction).
+# numpy, sentence-transformers and SQLite release the GIL for most of that work.
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+T = TypeVar("T")
+
+_cpu_executor = None
+_cpu_executor_lock = threading.Lock()
+
+
+def get_cpu_executor() -> ThreadPoolExecutor:
+    global _cpu_executor
+    if _cpu_executor is None:
+        with _cpu_executor_lock:
+            if _cpu_executor is None:
+                _cpu_executor = ThreadPoolExecutor(max_workers=max(1, CPU_WORKERS), thread_name_prefix="cpu")
+    return _cpu_executor
+
+
+def shutdown_cpu_executor():
+    """Finish queued CPU work and stop the executor's threads; a later run_cpu starts a new one"""
+    global _cpu_executor
+    with _cpu_executor_lock:
+        executor, _cpu_executor = _cpu_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+async def run_cpu(func: Callable[..., T], *args, **kwargs) -> T:
+    """Run func on the CPU executor without blocking the event loop.
+    Context variables of the caller are visible inside func."""
+    context = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_cpu_executor(), partial(context.run, func, *args, **kwargs))
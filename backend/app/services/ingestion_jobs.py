@@ -0,0 +1,317 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Optional
+
+from app.models.schemas import JobStatus
+from app.services.document_processor import get_document_processor
+from app.services.shared_state import connect_sqlite
+
+# Number of documents ingested concurrently
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# Maximum number of queued + running jobs before uploads are rejected
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "16"))
+# Number of finished jobs kept around for status lookups
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "200"))
+# SQLite table of every worker process's jobs, so any worker can answer a status poll
+INGEST_JOBS_PATH = os.getenv("INGEST_JOBS_PATH", "./ingest_jobs.sqlite3")
+
+# Progress is written to the job table at most this often (state changes always are)
+_PROGRESS_SAVE_INTERVAL = 1.0
+_JOB_COLUMNS = [
+    "id", "document_id", "filename", "content_hash", "state", "pages_done", "total_pages",
+    "chunks_embedded", "total_chunks", "error", "created_at", "started_at", "finished_at",
+]
+
+
+class IngestionQueueFull(Exception):
+    """Raised when too many ingestion jobs are already pending"""
+
+
+class IngestionJob:
+    """State of a single background ingestion job"""
+
+    def __init__(self, document_id: str, filename: str, file_path: Path, content_hash: Optional[str] = None):
+        self.id = str(uuid.uuid4())
+        self.document_id = document_id
+        self.filename = filename
+        self.file_path = file_path
+        self.content_hash = content_hash
+        self.state = "queued"
+        self.pages_done = 0
+        self.total_pages = None
+        self.chunks_embedded = 0
+        self.total_chunks = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.saved_at = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, **fields):
+        with self._lock:
+            for key, value in fields.items():
+                setattr(self, key, value)
+
+    def fields(self) -> dict:
+        with self._lock:
+            return {column: getattr(self, column) for column in _JOB_COLUMNS}
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ("completed", "failed")
+
+    def to_status(self) -> JobStatus:
+        with self._lock:
+            end = self.finished_at or time.time()
+            return JobStatus(
+                job_id=self.id,
+                document_id=self.document_id,
+                filename=self.filename,
+                state=self.state,
+                pages_done=self.pages_done,
+                total_pages=self.total_pages,
+                chunks_embedded=self.chunks_embedded,
+                total_chunks=self.total_chunks,
+                elapsed_seconds=round(end - (self.started_at or self.created_at), 3),
+                error=self.error,
+            )
+
+
+def _process_alive(pid: int) -> bool:
+    if os.name == "nt":
+        return True  # os.kill would terminate the process; the job is trusted to finish
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobTable:
+    """Jobs of every worker process, persisted in SQLite
+
+    With several uvicorn workers, an upload and the polls for its job can land
+    on different processes, and the same content can be uploaded to two of
+    them at once. Each job row records the process running it; jobs of
+    processes that have exited are marked failed."""
+
+    def __init__(self, path: str = INGEST_JOBS_PATH):
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                document_id TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                content_hash TEXT,
+                state TEXT NOT NULL,
+                pages_done INTEGER NOT NULL DEFAULT 0,
+                total_pages INTEGER,
+                chunks_embedded INTEGER NOT NULL DEFAULT 0,
+                total_chunks INTEGER,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                pid INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_hash ON jobs (content_hash, state)")
+        self._conn.commit()
+        self.fail_orphans()
+
+    @staticmethod
+    def _job(row) -> IngestionJob:
+        job = IngestionJob(row["document_id"], row["filename"], None, row["content_hash"])
+        job.update(**{column: row[column] for column in _JOB_COLUMNS})
+        return job
+
+    def _live_active(self, content_hash: str):
+        rows = self._conn.execute(
+            "SELECT * FROM jobs WHERE content_hash = ? AND state IN ('queued', 'running')", (content_hash,))
+        return next((row for row in rows if _process_alive(row["pid"])), None)
+
+    def claim(self, job: IngestionJob) -> Optional[IngestionJob]:
+        """Record a new job, unless a live process is already ingesting the same content;
+        then that process's job is returned instead"""
+        fields = job.fields()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                active = self._live_active(job.content_hash) if job.content_hash else None
+                if active is None:
+                    self._conn.execute(
+                        f"INSERT INTO jobs ({', '.join(_JOB_COLUMNS)}, pid) "
+                        f"VALUES ({', '.join('?' * (len(_JOB_COLUMNS) + 1))})",
+                        [fields[column] for column in _JOB_COLUMNS] + [os.getpid()])
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        return self._job(active) if active is not None else None
+
+    def save(self, job: IngestionJob):
+        fields = job.fields()
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{column} = ?' for column in _JOB_COLUMNS[1:])} WHERE id = ?",
+                [fields[column] for column in _JOB_COLUMNS[1:]] + [fields["id"]])
+            self._conn.commit()
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def find_active(self, content_hash: str) -> Optional[IngestionJob]:
+        with self._lock:
+            row = self._live_active(content_hash)
+        return self._job(row) if row else None
+
+    def fail_orphans(self):
+        """Mark unfinished jobs of processes that have exited as failed"""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, pid FROM jobs WHERE state IN ('queued', 'running')").fetchall()
+            orphans = [(time.time(), row["id"]) for row in rows
+                       if row["pid"] != os.getpid() and not _process_alive(row["pid"])]
+            if orphans:
+                self._conn.executemany(
+                    "UPDATE jobs SET state = 'failed', error = 'Worker process exited', finished_at = ? "
+                    "WHERE id = ?", orphans)
+                self._conn.commit()
+                print(f"Ingestion jobs: {len(orphans)} jobs of exited workers marked failed")
+
+    def prune(self, history: int = INGEST_JOB_HISTORY):
+        """Drop the oldest finished jobs beyond the history limit"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE finished_at IS NOT NULL AND id NOT IN "
+                "(SELECT id FROM jobs WHERE finished_at IS NOT NULL ORDER BY finished_at DESC LIMIT ?)",
+                (history,))
+            self._conn.commit()
+
+
+class IngestionJobQueue:
+    """Runs process_document on a bounded worker pool off the event loop
+
+    Jobs are tracked in memory and mirrored to the shared JobTable, which
+    answers for jobs running in other worker processes."""
+
+    def __init__(self, workers: int = INGEST_WORKERS, max_pending: int = INGEST_MAX_PENDING):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ingest")
+        self._max_pending = max_pending
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._table = JobTable()
+
+    def submit(self, file_path: Path, filename: str, content_hash: Optional[str] = None) -> IngestionJob:
+        """Queue a saved upload for ingestion and return its job
+        An upload whose content is already being ingested returns the existing job"""
+        job = IngestionJob(str(uuid.uuid4()), filename, file_path, content_hash)
+        with self._lock:
+            active = self._find_active(content_hash)
+            if active:
+                return active
+            pending = sum(1 for j in self._jobs.values() if not j.finished)
+            if pending >= self._max_pending:
+                raise IngestionQueueFull(f"{pending} documents are already being processed")
+            # Another worker process may be ingesting the same content
+            active = self._table.claim(job)
+            if active:
+                return active
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None else self._table.get(job_id)
+
+    def state_counts(self) -> dict:
+        """Number of tracked jobs in each state"""
+        with self._lock:
+            counts = {"queued": 0, "running": 0, "completed": 0, "failed": 0}
+            for job in self._jobs.values():
+                counts[job.state] = counts.get(job.state, 0) + 1
+            return counts
+
+    def is_active(self, content_hash: str) -> bool:
+        with self._lock:
+            if self._find_active(content_hash) is not None:
+                return True
+        return self._table.find_active(content_hash) is not None
+
+    def _find_active(self, content_hash: Optional[str]) -> Optional[IngestionJob]:
+        if not content_hash:
+            return None
+        for job in self._jobs.values():
+            if job.content_hash == content_hash and not job.finished:
+                return job
+        return None
+
+    def _prune(self):
+        """Drop the oldest finished jobs beyond the history limit"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - INGEST_JOB_HISTORY)]:
+            del self._jobs[job_id]
+
+    def _update(self, job: IngestionJob, **fields):
+        """Update a job and mirror it to the job table: state changes at once, progress at most once a second"""
+        job.update(**fields)
+        now = time.time()
+        if "state" in fields or now - job.saved_at >= _PROGRESS_SAVE_INTERVAL:
+            job.saved_at = now
+            try:
+                self._table.save(job)
+            except sqlite3.Error as e:
+                print(f"Could not save ingestion job {job.id}: {e}")
+
+    def _run(self, job: IngestionJob):
+        self._update(job, state="running", started_at=time.time())
+        try:
+            processor = get_document_processor()
+            processor.process_document(job.file_path, job.filename,
+                                       document_id=job.document_id, progress=partial(self._update, job),
+                                       content_hash=job.content_hash)
+            self._update(job, state="completed", finished_at=time.time())
+            print(f"Ingestion job {job.id} completed: {job.filename} ({job.chunks_embedded} chunks)")
+        except Exception as e:
+            print(f"Ingestion job {job.id} failed: {e}")
+            self._update(job, state="failed", error=str(e), finished_at=time.time())
+            # Clean up on error
+            try:
+                if job.file_path.exists():
+                    job.file_path.unlink()
+            except OSError:
+                pass
+        finally:
+            try:
+                self._table.prune()
+            except sqlite3.Error as e:
+                print(f"Could not prune ingestion jobs: {e}")
+
+
+# Global instance - lazy initialization
+ingestion_queue = None
+_queue_lock = threading.Lock()
+
+def get_ingestion_queue():
+    global ingestion_queue
+    if ingestion_queue is None:
+        with _queue_lock:
+            if ingestion_queue is None:
+                ingestion_queue = IngestionJobQueue()
+    return ingestion_queue
@@ -0,0 +1,300 @@
+import re
+import time
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, NamedTuple, Sequence, Tuple
+
+# Latency buckets in seconds, from in-process regex work up to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class MetricFamily(NamedTuple):
+    """One metric as produced by a collector: samples are (name suffix, labels, value)"""
+    name: str
+    type: str  # counter, gauge or histogram
+    help: str
+    samples: List[Tuple[str, Dict[str, str], float]]
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def _format_sample(name: str, labels: Dict[str, str], value: float) -> str:
+    if labels:
+        label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+        return f"{name}{{{label_text}}} {_format_value(value)}"
+    return f"{name} {_format_value(value)}"
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values tuple -> value (or histogram state)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def collect(self) -> MetricFamily:
+        with self._lock:
+            samples = [("", self._labels(key), value) for key, value in self._values.items()]
+        return MetricFamily(self.name, self.type, self.help, samples)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (not cumulative) counts, then sum and count
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with block (also when it raises)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self) -> MetricFamily:
+        with self._lock:
+            states = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        samples = []
+        for key, counts, total, count in states:
+            samples.extend(histogram_samples(self._labels(key), self.buckets, counts, total, count))
+        return MetricFamily(self.name, self.type, self.help, samples)
+
+
+def histogram_samples(labels: Dict[str, str], buckets: Sequence[float], counts: Sequence[int],
+                      total: float, count: int) -> List[Tuple[str, Dict[str, str], float]]:
+    """Prometheus histogram samples from per-bucket counts (observations above the last bucket only count in +Inf)"""
+    samples = []
+    cumulative = 0
+    for upper, bucket_count in zip(buckets, counts):
+        cumulative += bucket_count
+        samples.append(("_bucket", {**labels, "le": _format_value(float(upper))}, cumulative))
+    samples.append(("_bucket", {**labels, "le": "+Inf"}, count))
+    samples.append(("_sum", labels, total))
+    samples.append(("_count", labels, count))
+    return samples
+
+
+class MetricsRegistry:
+    """Metrics exposed on /metrics in the Prometheus text format
+
+    Metrics owned by this registry are updated as work happens; collectors
+    registered with register_collector are called at scrape time for values
+    that already live elsewhere (cache hit counters, queue depths)."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def register_collector(self, collector: Callable[[], Iterable[MetricFamily]]):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def collect(self) -> List[MetricFamily]:
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        families = [metric.collect() for metric in metrics]
+        for collector in collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        return families
+
+    def render(self) -> str:
+        lines = []
+        for family in self.collect():
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.type}")
+            for suffix, labels, value in family.samples:
+                lines.append(_format_sample(family.name + suffix, labels, value))
+        return "\n".join(lines) + "\n"
+
+
+def cache_metrics(caches: Dict[str, dict]) -> List[MetricFamily]:
+    """Hit, miss and size families for caches given as {cache name: stats() dict}"""
+    hits, misses, ratios, entries = [], [], [], []
+    for cache, stats in caches.items():
+        labels = {"cache": cache}
+        lookups = stats.get("hits", 0) + stats.get("misses", 0)
+        hits.append(("", labels, stats.get("hits", 0)))
+        misses.append(("", labels, stats.get("misses", 0)))
+        ratios.append(("", labels, stats.get("hits", 0) / lookups if lookups else 0.0))
+        if "entries" in stats:
+            entries.append(("", labels, stats["entries"]))
+    return [
+        MetricFamily("cache_hits_total", "counter", "Cache lookups that found an entry", hits),
+        MetricFamily("cache_misses_total", "counter", "Cache lookups that found nothing", misses),
+        MetricFamily("cache_hit_ratio", "gauge", "Hits over all lookups since start", ratios),
+        MetricFamily("cache_entries", "gauge", "Entries currently cached", entries),
+    ]
+
+
+def batch_size_metrics(name: str, help: str, batch_sizes: Dict[int, int],
+                       buckets: Sequence[int] = (1, 2, 4, 8, 16, 32, 64)) -> MetricFamily:
+    """Histogram family from a {batch size: number of batches} counter"""
+    counts = [0] * len(buckets)
+    for size, batches in batch_sizes.items():
+        for i, upper in enumerate(buckets):
+            if size <= upper:
+                counts[i] += batches
+                break
+    total = sum(size * batches for size, batches in batch_sizes.items())
+    return MetricFamily(name, "histogram", help,
+                        histogram_samples({}, buckets, counts, total, sum(batch_sizes.values())))
+
+
+# Global registry and the pipeline's metrics
+metrics = MetricsRegistry()
+
+RAG_STAGE_SECONDS = metrics.histogram(
+    "rag_stage_seconds", "Time spent in each stage of answering a chat query", ["stage"])
+RAG_QUERIES = metrics.counter(
+    "rag_queries_total", "Chat queries by how they were answered", ["outcome"])
+FALLBACKS = metrics.counter(
+    "rag_fallbacks_total", "Times a primary provider failed and a fallback was used", ["kind"])
+CONTEXT_TOKENS_SAVED = metrics.histogram(
+    "rag_context_tokens_saved", "Context tokens removed per chat query by merging overlapping chunks and dropping "
+    "near-duplicates", buckets=(0, 50, 100, 250, 500, 1000, 2500, 5000, 10000))
+CONTEXT_CHUNKS_REMOVED = metrics.counter(
+    "rag_context_chunks_removed_total", "Selected chunks merged into a neighbour or dropped as near-duplicates",
+    ["reason"])
+INGEST_STAGE_SECONDS = metrics.histogram(
+    "ingest_stage_seconds", "Time per document spent in each ingestion stage", ["stage"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0))
+INGEST_DOCUMENTS = metrics.counter(
+    "ingest_documents_total", "Documents whose ingestion finished, by outcome", ["outcome"])
+INGEST_CHUNKS = metrics.counter(
+    "ingest_chunks_total", "Chunks embedded and stored")
+HTTP_REQUESTS_IN_FLIGHT = metrics.gauge(
+    "http_requests_in_flight", "Requests being handled, including streaming responses still sending")
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "http_request_seconds", "Request duration until the response is fully sent", ["method", "route", "status"])
+
+
+_PATH_PARAM_RE = re.compile(r'\{(\w+)(?::\w+)?\}')
+
+
+def _route_template(scope) -> str:
+    """Full path template of the matched route, e.g. /api/documents/{document_id}
+
+    Routes of included routers may carry only their own part of the path, so
+    the prefix is recovered from the request path."""
+    route = scope.get("route")
+    template = getattr(route, "path", None)
+    if template is None:
+        return "unmatched"
+    params = scope.get("path_params", {})
+    rendered = _PATH_PARAM_RE.sub(lambda m: str(params.get(m.group(1), m.group(0))), template)
+    path = scope.get("path", "")
+    if path.endswith(rendered):
+        return path[:len(path) - len(rendered)] + template
+    return template
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting in-flight requests and timing them until the last body chunk is sent
+
+    Routes are labelled by their path template (/api/documents/{document_id}),
+    never by the raw path, to keep label cardinality bounded."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope["method"],
+                                         route=_route_template(scope), status=status["code"])
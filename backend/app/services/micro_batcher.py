@@ -0,0 +1,111 @@
+import os
+import time
+import queue
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from typing import Callable, List
+
+# Longest a request waits for others to share its forward pass
+EMBEDDING_MICROBATCH_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MICROBATCH_MAX_WAIT_MS", "5"))
+# Most texts encoded in one forward pass
+EMBEDDING_MICROBATCH_MAX_SIZE = int(os.getenv("EMBEDDING_MICROBATCH_MAX_SIZE", "32"))
+
+
+class MicroBatcher:
+    """Coalesces concurrent calls of a batch function into single calls
+
+    Each submit() hands over a list of items and gets a Future for their
+    results. A worker thread waits up to max_wait_ms after the first pending
+    request (or until max_size items are pending), runs fn once over all of
+    them and splits the results back to the callers' futures. Requests that
+    arrive while a batch is running join the next one."""
+
+    def __init__(self, fn: Callable[[List], List], max_wait_ms: float = EMBEDDING_MICROBATCH_MAX_WAIT_MS,
+                 max_size: int = EMBEDDING_MICROBATCH_MAX_SIZE, name: str = "micro-batcher"):
+        self.fn = fn
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_size = max(1, max_size)
+        self.batch_sizes = Counter()  # items per fn call -> number of calls
+        self._queue = queue.Queue()
+        self._carry = None  # request that did not fit in the previous batch
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, items: List) -> Future:
+        if self._closed:
+            raise RuntimeError("MicroBatcher is closed")
+        future = Future()
+        if not items:
+            future.set_result([])
+        else:
+            self._queue.put((list(items), future))
+        return future
+
+    def __call__(self, items: List) -> List:
+        """Blocking submit"""
+        return self.submit(items).result()
+
+    def close(self, timeout: float = None):
+        """Run the requests already submitted, then stop the worker thread"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _next_batch(self):
+        first = self._carry or self._queue.get()
+        self._carry = None
+        if first is None:
+            return None  # closed
+        batch = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_size:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)  # close after this batch
+                break
+            if size + len(request[0]) > self.max_size:
+                self._carry = request
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = []
+            try:
+                requests = self._next_batch()
+                if requests is None:
+                    return
+                # Callers may have cancelled while waiting (a client disconnected); the rest can no longer be cancelled
+                batch = [request for request in requests if request[1].set_running_or_notify_cancel()]
+                if batch:
+                    self._run_batch(batch)
+            except Exception as e:
+                # Never let one batch stop the worker: every later submit() would wait forever
+                print(f"{self._thread.name}: batch failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _run_batch(self, batch: List):
+        items = [item for request_items, _ in batch for item in request_items]
+        self.batch_sizes[len(items)] += 1
+        try:
+            results = self.fn(items)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        start = 0
+        for request_items, future in batch:
+            future.set_result(results[start:start + len(request_items)])
+            start += len(request_items)
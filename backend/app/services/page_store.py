@@ -0,0 +1,148 @@
+import os
+import mmap
+import zlib
+import struct
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+
+# Directory holding one compressed page file per document
+PAGE_STORE_DIR = Path(os.getenv("PAGE_STORE_DIR", "./page_store"))
+# Number of page files kept memory-mapped at once
+PAGE_STORE_OPEN_FILES = int(os.getenv("PAGE_STORE_OPEN_FILES", "64"))
+
+# File layout: MAGIC, zlib-compressed pages back to back, an index of
+# (offset, length) per page, then a footer of (index offset, page count, MAGIC)
+MAGIC = b"PGSTORE1"
+_INDEX_ENTRY = struct.Struct("<QQ")
+_FOOTER = struct.Struct("<QQ8s")
+
+
+class PageStoreWriter:
+    """Writes the pages of one document as they are extracted; nothing is visible until commit()"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        # Per-process temp name: two workers may re-ingest the same document at once
+        self._temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        self._file = open(self._temp_path, "wb")
+        self._file.write(MAGIC)
+        self._index = []
+
+    @property
+    def page_count(self) -> int:
+        return len(self._index)
+
+    def add_page(self, page_num: int, text: str):
+        # Pages are stored by position; fill any gap so page N stays at slot N-1
+        while len(self._index) < page_num - 1:
+            self.add_page(len(self._index) + 1, "")
+        blob = zlib.compress(text.encode("utf-8"), 6)
+        self._index.append((self._file.tell(), len(blob)))
+        self._file.write(blob)
+
+    def commit(self):
+        index_offset = self._file.tell()
+        for entry in self._index:
+            self._file.write(_INDEX_ENTRY.pack(*entry))
+        self._file.write(_FOOTER.pack(index_offset, len(self._index), MAGIC))
+        self._file.close()
+        os.replace(self._temp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        if self._temp_path.exists():
+            self._temp_path.unlink()
+
+
+class _PageFile:
+    def __init__(self, path: Path):
+        self._file = open(path, "rb")
+        # Identifies this version of the file; another worker re-ingesting the document replaces it
+        self.inode = os.fstat(self._file.fileno()).st_ino
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.index_offset, self.page_count, magic = _FOOTER.unpack_from(self._map, len(self._map) - _FOOTER.size)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Not a page store file: {path}")
+
+    def read_page(self, page_num: int) -> Optional[str]:
+        if page_num < 1 or page_num > self.page_count:
+            return None
+        offset, length = _INDEX_ENTRY.unpack_from(self._map, self.index_offset + (page_num - 1) * _INDEX_ENTRY.size)
+        return zlib.decompress(self._map[offset:offset + length]).decode("utf-8")
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+class PageStore:
+    """Persistent, compressed per-document page text with O(1) lookup by (document_id, page_number)
+
+    Files are replaced atomically, so worker processes share the directory;
+    an open file is checked against the path on each lookup and reopened
+    (or dropped) when another process has replaced (or deleted) it."""
+
+    def __init__(self, root: Path = PAGE_STORE_DIR, max_open: int = PAGE_STORE_OPEN_FILES):
+        self.root = Path(root)
+        self.root.mkdir(exist_ok=True, parents=True)
+        self._max_open = max_open
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, document_id: str) -> Path:
+        return self.root / f"{document_id}.pages"
+
+    def writer(self, document_id: str) -> PageStoreWriter:
+        return PageStoreWriter(self._path(document_id))
+
+    def _get_file(self, document_id: str) -> Optional[_PageFile]:
+        """Open file for a document; call with _lock held and finish using it before releasing,
+        since eviction or a replaced file closes its map"""
+        path = self._path(document_id)
+        try:
+            inode = path.stat().st_ino
+        except FileNotFoundError:
+            inode = None
+        page_file = self._open.get(document_id)
+        if page_file is not None:
+            if page_file.inode == inode:
+                self._open.move_to_end(document_id)
+                return page_file
+            del self._open[document_id]
+            page_file.close()
+        if inode is None:
+            return None
+        page_file = _PageFile(path)
+        self._open[document_id] = page_file
+        if len(self._open) > self._max_open:
+            _, evicted = self._open.popitem(last=False)
+            evicted.close()
+        return page_file
+
+    def get_page(self, document_id: str, page_num: int) -> Optional[str]:
+        """Text of one page, or None if the document or page is unknown"""
+        with self._lock:
+            page_file = self._get_file(document_id)
+            return page_file.read_page(page_num) if page_file else None
+
+    def page_count(self, document_id: str) -> int:
+        with self._lock:
+            page_file = self._get_file(document_id)
+            return page_file.page_count if page_file else 0
+
+    def delete(self, document_id: str):
+        with self._lock:
+            page_file = self._open.pop(document_id, None)
+            if page_file:
+                page_file.close()
+            path = self._path(document_id)
+            if path.exists():
+                path.unlink()
+
+    def list_documents(self) -> List[str]:
+        """Document ids with stored pages, most recently written first"""
+        paths = sorted(self.root.glob("*.pages"), key=lambda p: p.stat().st_mtime, reverse=True)
+        return [path.stem for path in paths]
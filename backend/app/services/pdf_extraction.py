@@ -0,0 +1,106 @@
+import os
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+# Kept free of heavy imports: pool workers are spawned and import only this module
+import PyPDF2
+
+# Worker processes used for PDF text extraction (0 = one per CPU core)
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", "0")) or (os.cpu_count() or 1)
+# PDFs with fewer pages than this are extracted serially in-process
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32"))
+# Pages handed to a worker per task
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn, not fork: the parent runs threads (ingest workers, model runtimes)
+                _pool = ProcessPoolExecutor(
+                    max_workers=PDF_EXTRACT_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+    return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def extract_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """Extract text of pages [start, end) - runs inside a pool worker, which opens the file itself"""
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [pdf_reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def count_pages(file_path: Path) -> int:
+    with open(file_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+
+def _iter_pages_serial(file_path: Path) -> Iterator[Tuple[int, str]]:
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        for page_num, page in enumerate(pdf_reader.pages, start=1):
+            yield page_num, page.extract_text() or ""
+
+
+def _iter_pages_parallel(file_path: Path, total_pages: int, workers: int) -> Iterator[Tuple[int, str]]:
+    pool = _get_pool()
+    ranges = [(start, min(start + PDF_PAGES_PER_TASK, total_pages))
+              for start in range(0, total_pages, PDF_PAGES_PER_TASK)]
+    pending = deque()
+    next_range = 0
+    # Keep a small window of ranges in flight so results are consumed in page order
+    # without buffering the whole document
+    while next_range < len(ranges) or pending:
+        while next_range < len(ranges) and len(pending) < workers * 2:
+            start, end = ranges[next_range]
+            pending.append((start, pool.submit(extract_page_range, str(file_path), start, end)))
+            next_range += 1
+        start, future = pending.popleft()
+        for offset, page_text in enumerate(future.result()):
+            yield start + offset + 1, page_text
+
+
+def iter_pdf_pages(file_path: Path, workers: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    """Yield (page_num, page_text) in page order, spreading page ranges across a process pool
+    for large files and falling back to serial extraction for small ones"""
+    workers = PDF_EXTRACT_WORKERS if workers is None else workers
+    total_pages = count_pages(file_path)
+    if workers <= 1 or total_pages < PDF_PARALLEL_MIN_PAGES:
+        yield from _iter_pages_serial(file_path)
+        return
+
+    pages_done = 0
+    try:
+        for page in _iter_pages_parallel(file_path, total_pages, workers):
+            pages_done += 1
+            yield page
+    except BrokenProcessPool as e:
+        print(f"PDF extraction pool failed ({e}), continuing serially")
+        _reset_pool()
+        for page in _iter_pages_serial(file_path):
+            if page[0] > pages_done:
+                yield page
+
+
+def extract_pdf_pages(file_path: Path, workers: Optional[int] = None) -> List[Tuple[int, str]]:
+    """Extract all pages of a PDF as a list of (page_num, page_text)"""
+    return list(iter_pdf_pages(file_path, workers))
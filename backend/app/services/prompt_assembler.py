@@ -0,0 +1,150 @@
+import os
+import re
+from typing import Dict, List, NamedTuple, Optional
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+# Tokens available to the whole prompt (system message, history, context and question)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+# Share of the budget that conversation history may take
+PROMPT_HISTORY_SHARE = float(os.getenv("PROMPT_HISTORY_SHARE", "0.25"))
+# Most recent conversation messages considered for the prompt
+PROMPT_HISTORY_MESSAGES = int(os.getenv("PROMPT_HISTORY_MESSAGES", "6"))
+# A chunk is only truncated into the remaining budget if at least this many tokens are left
+PROMPT_MIN_CHUNK_TOKENS = 50
+
+# Chat format overhead per message and for priming the reply
+_TOKENS_PER_MESSAGE = 4
+_TOKENS_PER_REPLY = 3
+
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+')
+_CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+SYSTEM_PROMPT = "You are a helpful assistant that answers questions based on provided document context."
+
+
+class AssembledPrompt(NamedTuple):
+    messages: List[Dict[str, str]]
+    tokens_used: int
+    tokens_dropped: int  # context and history tokens that did not fit the budget
+    chunks_used: int
+    history_used: int
+
+
+class TokenCounter:
+    """Counts tokens with the model's tokenizer, or estimates ~4 characters per token without tiktoken"""
+
+    def __init__(self, model: str = "gpt-3.5-turbo"):
+        self._encoding = None
+        if TIKTOKEN_AVAILABLE:
+            try:
+                self._encoding = tiktoken.encoding_for_model(model)
+            except Exception as e:
+                print(f"Warning: no tokenizer for {model}, estimating token counts: {e}")
+
+    def count(self, text: str) -> int:
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return len(text) // 4 + 1
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Longest prefix of whole sentences within max_tokens (whole words if even the first sentence is too long)"""
+        if self.count(text) <= max_tokens:
+            return text
+        kept = []
+        used = 0
+        for sentence in _SENTENCE_END_RE.split(text):
+            tokens = self.count(sentence) + (1 if kept else 0)
+            if used + tokens > max_tokens:
+                break
+            kept.append(sentence)
+            used += tokens
+        if kept:
+            return " ".join(kept)
+        words = []
+        used = 0
+        for word in text.split():
+            tokens = self.count(word) + (1 if words else 0)
+            if used + tokens > max_tokens:
+                break
+            words.append(word)
+            used += tokens
+        return " ".join(words)
+
+
+class PromptAssembler:
+    """Builds the chat messages for a question within a token budget
+
+    Recent conversation turns (newest first, up to PROMPT_HISTORY_SHARE of the
+    budget) and then the context chunks in rank order are packed into what the
+    system message and question leave over. The chunk that crosses the budget
+    is cut at a sentence boundary; the rest are dropped."""
+
+    def __init__(self, budget: int = PROMPT_TOKEN_BUDGET, history_share: float = PROMPT_HISTORY_SHARE,
+                 model: str = "gpt-3.5-turbo"):
+        self.budget = budget
+        self.history_share = history_share
+        self.counter = TokenCounter(model)
+
+    def _message_tokens(self, content: str) -> int:
+        return self.counter.count(content) + _TOKENS_PER_MESSAGE
+
+    def assemble(self, query: str, context_chunks: List[str],
+                 history: Optional[List[Dict[str, str]]] = None) -> AssembledPrompt:
+        history = history or []
+        empty_prompt = self._user_prompt(query, "")
+        used = _TOKENS_PER_REPLY + self._message_tokens(SYSTEM_PROMPT) + self._message_tokens(empty_prompt)
+        dropped = 0
+
+        # History: newest turns first, whole messages only
+        history_budget = int(self.budget * self.history_share)
+        history_messages = []
+        history_tokens = 0
+        for message in reversed(history):
+            tokens = self._message_tokens(message["content"])
+            if history_tokens + tokens > history_budget or used + history_tokens + tokens > self.budget:
+                dropped += sum(self.counter.count(m["content"]) for m in history[:len(history) - len(history_messages)])
+                break
+            history_messages.insert(0, {"role": message["role"], "content": message["content"]})
+            history_tokens += tokens
+        used += history_tokens
+
+        # Context: chunks in rank order; the one that crosses the budget is truncated
+        separator_tokens = self.counter.count(_CONTEXT_SEPARATOR)
+        packed = []
+        for i, chunk in enumerate(context_chunks):
+            available = self.budget - used - (separator_tokens if packed else 0)
+            tokens = self.counter.count(chunk)
+            if tokens <= available:
+                packed.append(chunk)
+                used += tokens + (separator_tokens if len(packed) > 1 else 0)
+                continue
+            if available >= PROMPT_MIN_CHUNK_TOKENS:
+                truncated = self.counter.truncate(chunk, available)
+                if truncated:
+                    packed.append(truncated)
+                    truncated_tokens = self.counter.count(truncated)
+                    used += truncated_tokens + (separator_tokens if len(packed) > 1 else 0)
+                    tokens -= truncated_tokens
+            dropped += tokens + sum(self.counter.count(rest) for rest in context_chunks[i + 1:])
+            break
+
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        messages.extend(history_messages)
+        messages.append({"role": "user", "content": self._user_prompt(query, _CONTEXT_SEPARATOR.join(packed))})
+        return AssembledPrompt(messages, used, dropped, len(packed), len(history_messages))
+
+    @staticmethod
+    def _user_prompt(query: str, context: str) -> str:
+        return f"""Answer this question based ONLY on the document content below. Be specific and direct.
+
+Question: "{query}"
+
+Document Content:
+{context}
+
+Answer only what was asked. If asking for a definition, provide the definition from the document:"""
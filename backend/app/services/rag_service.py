@@ -1,37 +1,61 @@
 import os
 import re
-from typing import List, Tuple
-from pathlib import Path
+import time
+import threading
+from bisect import bisect_right
+from typing import AsyncIterator, List, NamedTuple, Optional, Tuple
 
-try:
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
+from app.services.document_processor import OPENAI_AVAILABLE, get_document_processor
+from app.services.answer_cache import AnswerCache
+from app.services.context_compactor import CONTEXT_COMPACTION, ContextCompactor
+from app.services.executors import run_cpu
+from app.services.metrics import (CONTEXT_CHUNKS_REMOVED, CONTEXT_TOKENS_SAVED, FALLBACKS, RAG_QUERIES,
+                                  RAG_STAGE_SECONDS)
+from app.services.prompt_assembler import PromptAssembler
+from app.services.sentence_index import (DEFINITION_KEYWORDS, as_indexed, definition_pattern,
+                                         term_pattern)
+from app.services.tracing import annotate, record_span, trace_span
 
-# Try to load .env file if python-dotenv is available
-try:
-    from dotenv import load_dotenv
-    env_path = Path(__file__).parent.parent.parent / '.env'
-    if env_path.exists():
-        load_dotenv(env_path)
-    else:
-        load_dotenv()
-except ImportError:
-    pass
+# Words with their trailing whitespace, the unit the extractive answer is streamed in
+_STREAM_WORD_RE = re.compile(r'\S+\s*|\s+')
+# Patterns of the extractive answer path, compiled once
+_SENTENCE_SPLIT_RE = re.compile(r'([.!?]+\s*)')
+_LEADING_NUMBER_RE = re.compile(r'^\d+[-.)]\s*')
+_LEADING_LABEL_RE = re.compile(r'^[A-Z0-9]+[-.)]\s*')
+_LIST_ITEM_SPLIT_RE = re.compile(r',\s*(?:and\s+)?[aA]n?\s+')
 
-from app.services.document_processor import get_document_processor
+
+class PreparedQuery(NamedTuple):
+    """Outcome of everything in a query before answer generation"""
+    response: Optional[str]  # final answer when nothing needs to be generated
+    sources: List[str]
+    context_chunks: List[str]
+    query_embedding: Optional[List[float]] = None
+    primary_term: str = ""
+    corpus_version: int = 0
+    outcome: str = "generated"  # rag_queries_total label: early, cached, no_results, error or generated
+
+
+class StreamOutcome:
+    """Filled in while an answer streams, for the caller to read once it has finished"""
+    
+    def __init__(self):
+        self.fallback = False  # the LLM failed and the extractive method answered instead
 
 
 class RAGService:
     def __init__(self):
         self._processor = None
-        self.openai_client = None
+        self.async_openai_client = None
+        self.answer_cache = AnswerCache()
+        self.prompt_assembler = PromptAssembler()
+        self.context_compactor = ContextCompactor(self.prompt_assembler.counter) if CONTEXT_COMPACTION else None
         
         if OPENAI_AVAILABLE:
             api_key = os.getenv("OPENAI_API_KEY")
             if api_key:
-                self.openai_client = OpenAI(api_key=api_key)
+                from openai import AsyncOpenAI
+                self.async_openai_client = AsyncOpenAI(api_key=api_key)
     
     @property
     def document_processor(self):
@@ -80,312 +104,197 @@ class RAGService:
     
     def extract_answer_from_context(self, query: str, context: str) -> str:
         """Extract answer from context - SIMPLE and DIRECT approach"""
+        return self.extract_answer_from_chunks(query, [context])
+
+    def extract_answer_from_chunks(self, query: str, chunks: List[str]) -> str:
+        """Extract answer from context chunks using their sentence index"""
         search_terms = self.extract_search_terms(query)
         
         if not search_terms:
             return "I couldn't find specific information about that in the uploaded documents."
         
-        primary_term = search_terms[0]
-        primary_term_lower = primary_term.lower()
-        primary_words = primary_term.split()
-        
-        # ULTRA SIMPLE: Just find any sentence/paragraph that contains the term
-        # Split by sentences and paragraphs
-        # First, try to find definition sentences
-        definition_keywords = ['is', 'means', 'defined as', 'refers to', 'is a', 'are', 'denotes', 'called']
-        
-        # Split into sentences
-        sentences = []
-        parts = re.split(r'([.!?]+\s*)', context)
-        for i in range(0, len(parts), 2):
-            if i < len(parts):
-                sent = parts[i].strip()
-                if sent:
-                    punct = parts[i+1] if i+1 < len(parts) else '. '
-                    sentences.append((sent, punct))
+        primary_term_lower = search_terms[0].lower()
+        single_word = len(primary_term_lower.split()) == 1
+        pattern = term_pattern(primary_term_lower)
+        chunks = [as_indexed(chunk) for chunk in chunks]
+        
+        # Sentences that contain the primary term, in context order. Only the
+        # sentences around an occurrence of the term are looked at.
+        matches = []
+        for chunk in chunks:
+            lower = chunk.lower_text
+            pos = lower.find(primary_term_lower)
+            if pos < 0:
+                continue
+            spans = chunk.sentences
+            starts = [span.start for span in spans]
+            seen = set()
+            while pos >= 0:
+                i = bisect_right(starts, pos) - 1
+                if i >= 0 and i not in seen and pos + len(primary_term_lower) <= spans[i].end:
+                    seen.add(i)
+                    span = spans[i]
+                    sentence_lower = lower[span.start:span.end]
+                    if not single_word or pattern.search(sentence_lower):
+                        matches.append((chunk, span))
+                pos = lower.find(primary_term_lower, pos + 1)
         
         # Strategy 1: Find sentence with term + definition keyword
-        for sentence, punct in sentences:
-            sentence_lower = sentence.lower()
-            
-            # Must contain primary term
-            has_term = False
-            if len(primary_words) == 1:
-                if re.search(rf'\b{re.escape(primary_term_lower)}\b', sentence_lower):
-                    has_term = True
-            else:
-                if primary_term_lower in sentence_lower:
-                    has_term = True
-            
-            if not has_term:
+        for chunk, span in matches:
+            if not span.is_definition:
                 continue
+            # Found definition! Clean it up
+            clean = _LEADING_LABEL_RE.sub('', _LEADING_NUMBER_RE.sub('', chunk.sentence(span)))
+            
+            # If list sentence, extract only our part
+            if ', ' in clean or ' and ' in clean:
+                for part in _LIST_ITEM_SPLIT_RE.split(clean):
+                    part_lower = part.lower()
+                    if primary_term_lower in part_lower:
+                        if any(kw in part_lower for kw in DEFINITION_KEYWORDS):
+                            clean = part.strip()
+                            break
             
-            # Must have definition keyword
-            has_def = any(kw in sentence_lower for kw in definition_keywords)
-            
-            if has_def:
-                # Found definition! Clean it up
-                clean = sentence.strip()
-                clean = re.sub(r'^\d+[-.)]\s*', '', clean)
-                clean = re.sub(r'^[A-Z0-9]+[-.)]\s*', '', clean)
-                
-                # If list sentence, extract only our part
-                if ', ' in clean or ' and ' in clean:
-                    parts_list = re.split(r',\s*(?:and\s+)?[aA]n?\s+', clean)
-                    for part in parts_list:
-                        if primary_term_lower in part.lower():
-                            if any(kw in part.lower() for kw in definition_keywords):
-                                clean = part.strip()
-                                break
-                
-                if len(clean) > 20:
-                    return (clean + punct).strip()[:1000]
+            if len(clean) > 20:
+                annotate(extraction_strategy="definition", term_sentences=len(matches))
+                return (clean + chunk.punct(span)).strip()[:1000]
         
         # Strategy 2: Find ANY sentence with term (even without definition keyword)
-        for sentence, punct in sentences:
-            sentence_lower = sentence.lower()
-            
-            # Check if contains term
-            if len(primary_words) == 1:
-                if not re.search(rf'\b{re.escape(primary_term_lower)}\b', sentence_lower):
-                    continue
-            else:
-                if primary_term_lower not in sentence_lower:
-                    continue
-            
-            if len(sentence) > 20:
-                clean = sentence.strip()
-                clean = re.sub(r'^\d+[-.)]\s*', '', clean)
-                clean = re.sub(r'^[A-Z0-9]+[-.)]\s*', '', clean)
+        for chunk, span in matches:
+            if span.end - span.start > 20:
+                clean = _LEADING_LABEL_RE.sub('', _LEADING_NUMBER_RE.sub('', chunk.sentence(span)))
                 
                 # Extract from list if needed
                 if ', ' in clean:
-                    parts_list = re.split(r',\s*(?:and\s+)?[aA]n?\s+', clean)
-                    for part in parts_list:
+                    for part in _LIST_ITEM_SPLIT_RE.split(clean):
                         if primary_term_lower in part.lower() and len(part.strip()) > 15:
                             clean = part.strip()
                             break
                 
-                return (clean + punct).strip()[:1000]
-        
-        # Strategy 3: Find paragraph with term
-        paragraphs = re.split(r'\n\s*\n+', context)
-        for para in paragraphs:
-            para_lower = para.lower()
-            if primary_term_lower in para_lower:
-                # Get first few sentences
-                para_sents = re.split(r'([.!?]+\s*)', para)
+                annotate(extraction_strategy="sentence", term_sentences=len(matches))
+                return (clean + chunk.punct(span)).strip()[:1000]
+        
+        # Strategy 3: Find paragraph with term, answer with its first few sentences
+        for chunk in chunks:
+            paragraphs = {}
+            for span in chunk.sentences:
+                paragraphs.setdefault(span.paragraph, []).append(span)
+            lower = chunk.lower_text
+            for spans in paragraphs.values():
+                para_end = spans[-1].punct_end if spans[-1].punct_end >= 0 else spans[-1].end
+                if lower.find(primary_term_lower, spans[0].start, para_end) < 0:
+                    continue
                 result = []
-                for i in range(0, min(6, len(para_sents)), 2):
-                    if i < len(para_sents):
-                        sent = para_sents[i].strip()
-                        if sent and len(sent) > 10:
-                            punct = para_sents[i+1] if i+1 < len(para_sents) else '. '
-                            result.append(sent + punct)
-                            if len(''.join(result)) > 500:
-                                break
+                for span in spans[:3]:
+                    if span.end - span.start > 10:
+                        result.append(chunk.sentence(span) + chunk.punct(span))
+                        if len(''.join(result)) > 500:
+                            break
                 
                 if result:
-                    answer = ''.join(result)
-                    answer = re.sub(r'^\d+[-.)]\s*', '', answer)
+                    annotate(extraction_strategy="paragraph", term_sentences=len(matches))
+                    answer = _LEADING_NUMBER_RE.sub('', ''.join(result))
                     return answer.strip()[:1000]
         
+        annotate(extraction_strategy="none", term_sentences=len(matches))
         return "I couldn't find specific information about '{}' in the uploaded documents.".format(query)
-        
-        for sentence, punct in sentences:
-            sentence_lower = sentence.lower()
-            
-            # Check if sentence contains the PRIMARY term
-            contains_primary = False
-            if len(primary_words) == 1:
-                if re.search(rf'\b{re.escape(primary_term_lower)}\b', sentence_lower):
-                    contains_primary = True
-            else:
-                if primary_term_lower in sentence_lower:
-                    contains_primary = True
-                elif all(word in sentence_lower for word in primary_words):
-                    contains_primary = True
-            
-            if not contains_primary:
-                continue
-            
-            # CRITICAL: Skip if sentence contains excluded terms (other definitions)
-            # This prevents "path (as a graph) and cycle..." when asking for "complete graph"
-            if exclude_list:
-                has_excluded = any(excluded_term in sentence_lower for excluded_term in exclude_list)
-                if has_excluded:
-                    # Check if it's a list sentence (contains multiple definitions)
-                    # Pattern: "term1, term2, term3" or "term1 and term2"
-                    if ', ' in sentence_lower or ' and ' in sentence_lower:
-                        # It's a list - try to extract only our part
-                        # Split by commas and "and"
-                        parts_list = re.split(r',\s*(?:and\s+)?[aA]n?\s+', sentence)
-                        found_our_part = False
-                        for part in parts_list:
-                            part_lower = part.lower()
-                            # Check if this part is about our primary term
-                            if primary_term_lower in part_lower or all(w in part_lower for w in primary_words):
-                                # Check if it has definition keyword
-                                if any(kw in part_lower for kw in definition_keywords):
-                                    # Check if it doesn't have excluded terms
-                                    if not any(excluded_term in part_lower for excluded_term in exclude_list):
-                                        clean_sent = part.strip()
-                                        clean_sent = re.sub(r'^\d+[-.)]\s*', '', clean_sent)
-                                        clean_sent = re.sub(r'^[A-Z0-9]+[-.)]\s*', '', clean_sent)
-                                        found_our_part = True
-                                        return (clean_sent + punct).strip()[:1000]
-                        if found_our_part:
-                            # Already returned, but this shouldn't be reached
-                            break
-                        # If we couldn't extract our part from list, skip this sentence
-                        continue
-            
-            # Check for definition keywords
-            has_def_keyword = any(keyword in sentence_lower for keyword in definition_keywords)
-            
-            if has_def_keyword:
-                # Found a definition! Clean it up
-                clean_sent = sentence.strip()
-                clean_sent = re.sub(r'^\d+[-.)]\s*', '', clean_sent)
-                clean_sent = re.sub(r'^[A-Z0-9]+[-.)]\s*', '', clean_sent)
-                clean_sent = re.sub(r'^\d+\s*[-.)]?\s*[Dd]efine\s+', '', clean_sent)
-                
-                # Extract only our part if it's a list sentence
-                if ', ' in clean_sent or ' and ' in clean_sent:
-                    parts_list = re.split(r',\s*(?:and\s+)?[aA]n?\s+', clean_sent)
-                    for part in parts_list:
-                        part_lower = part.lower()
-                        if primary_term_lower in part_lower or all(w in part_lower for w in primary_words):
-                            if any(kw in part_lower for kw in definition_keywords):
-                                clean_sent = part.strip()
-                                break
-                
-                return (clean_sent + punct).strip()[:1000]
-        
-        # Strategy 2: Find ANY sentence with the term (even without definition keyword) - MORE AGGRESSIVE
-        for term in search_terms:
-            term_lower = term.lower()
-            term_words = term.split()
-            
-            for sentence, punct in sentences:
-                sentence_lower = sentence.lower()
-                
-                # Check if contains term - try multiple patterns
-                contains_term = False
-                
-                # Pattern 1: Exact phrase match
-                if term_lower in sentence_lower:
-                    contains_term = True
-                # Pattern 2: Word boundary match for single word
-                elif len(term_words) == 1:
-                    if re.search(rf'\b{re.escape(term_lower)}\b', sentence_lower):
-                        contains_term = True
-                # Pattern 3: All words present (fuzzy match)
-                elif all(word in sentence_lower for word in term_words):
-                    contains_term = True
-                
-                if contains_term:
-                    # Skip if it's clearly a list with excluded terms
-                    if exclude_list:
-                        has_many_excluded = sum(1 for excl in exclude_list if excl in sentence_lower)
-                        if has_many_excluded >= 2 and ', ' in sentence_lower:
-                            # Try to extract just our part
-                            parts_list = re.split(r',\s*(?:and\s+)?[aA]n?\s+', sentence)
-                            for part in parts_list:
-                                part_lower = part.lower()
-                                if (term_lower in part_lower or all(w in part_lower for w in term_words)):
-                                    if not any(excl in part_lower for excl in exclude_list):
-                                        if len(part.strip()) > 15:
-                                            clean_sent = part.strip()
-                                            clean_sent = re.sub(r'^\d+[-.)]\s*', '', clean_sent)
-                                            clean_sent = re.sub(r'^[A-Z0-9]+[-.)]\s*', '', clean_sent)
-                                            return (clean_sent + punct).strip()[:1000]
-                            continue  # Skip this sentence if we couldn't extract our part
-                    
-                    # Found a sentence with the term - return it if it's substantial
-                    if len(sentence) > 15:
-                        clean_sent = sentence.strip()
-                        clean_sent = re.sub(r'^\d+[-.)]\s*', '', clean_sent)
-                        clean_sent = re.sub(r'^[A-Z0-9]+[-.)]\s*', '', clean_sent)
-                        
-                        # Extract relevant part if it's a list
-                        if ', ' in clean_sent and len(term_words) <= 2:
-                            parts_list = re.split(r',\s*(?:and\s+)?[aA]n?\s+', clean_sent)
-                            for part in parts_list:
-                                if term_lower in part.lower() or all(w in part.lower() for w in term_words):
-                                    if len(part.strip()) > 15:
-                                        clean_sent = part.strip()
-                                        break
-                        
-                        return (clean_sent + punct).strip()[:1000]
-        
-        # Strategy 3: Find paragraph with the term
-        paragraphs = re.split(r'\n\s*\n+', context)
-        for term in search_terms:
-            term_lower = term.lower()
-            term_words = term.split()
-            
-            for para in paragraphs:
-                para_lower = para.lower()
-                if term_lower in para_lower or all(word in para_lower for word in term_words):
-                    # Found paragraph with term - extract first few sentences
-                    para_sents = re.split(r'([.!?]+\s*)', para)
-                    result_parts = []
-                    for i in range(0, min(6, len(para_sents)), 2):
-                        if i < len(para_sents):
-                            sent = para_sents[i].strip()
-                            if sent and len(sent) > 10:
-                                punct = para_sents[i+1] if i+1 < len(para_sents) else '. '
-                                result_parts.append(sent + punct)
-                                if len(''.join(result_parts)) > 500:
-                                    break
-                    
-                    if result_parts:
-                        answer = ''.join(result_parts)
-                        answer = re.sub(r'^\d+[-.)]\s*', '', answer)
-                        answer = re.sub(r'^[A-Z0-9]+[-.)]\s*', '', answer)
-                        return answer.strip()[:1000]
-        
-        return "I couldn't find specific information about '{}' in the uploaded documents. Please try rephrasing your question.".format(query)
     
-    def generate_response(self, query: str, context_chunks: List[str], use_rag: bool = True) -> str:
-        """Generate response - uses OpenAI if available, otherwise FREE method"""
-        if not use_rag or not context_chunks:
-            return "Please upload a document first to ask questions about it. This is a document-based RAG chatbot."
+    def _completion_messages(self, query: str, context_chunks: List[str],
+                             history: Optional[List[dict]] = None) -> List[dict]:
+        """Chat messages for the question, packed into the prompt token budget"""
+        prompt = self.prompt_assembler.assemble(query, context_chunks, history)
+        annotate(prompt_tokens=prompt.tokens_used, prompt_chunks=prompt.chunks_used)
+        print(f"Prompt: {prompt.tokens_used}/{self.prompt_assembler.budget} tokens, {prompt.tokens_dropped} dropped "
+              f"({prompt.chunks_used}/{len(context_chunks)} chunks, {prompt.history_used} history messages)")
+        return prompt.messages
+    
+    async def agenerate_response(self, query: str, context_chunks: List[str],
+                                 history: Optional[List[dict]] = None) -> Tuple[str, bool]:
+        """Generate response - OpenAI through the async client if available, otherwise FREE method on the CPU executor
+        Returns: (answer, whether the extractive method stood in for a failed LLM call)"""
+        if not context_chunks:
+            return "Please upload a document first to ask questions about it. This is a document-based RAG chatbot.", False
+        
+        if self.async_openai_client:
+            try:
+                # Token counting runs on the CPU executor like the rest of the CPU-bound work
+                messages = await run_cpu(self._completion_messages, query, context_chunks, history)
+                with trace_span("llm_generation", RAG_STAGE_SECONDS):
+                    response = await self.async_openai_client.chat.completions.create(
+                        model="gpt-3.5-turbo",
+                        messages=messages,
+                        temperature=0.7,
+                        max_tokens=500
+                    )
+                return response.choices[0].message.content, False
+            except Exception as e:
+                print(f"OpenAI error, using free method: {e}")
+                FALLBACKS.inc(kind="extractive_answer")
+                annotate(llm_error=type(e).__name__)
+                return await run_cpu(self._extractive_answer, query, context_chunks), True
         
-        # If OpenAI is available and configured, use it
-        if self.openai_client:
+        return await run_cpu(self._extractive_answer, query, context_chunks), False
+    
+    async def agenerate_response_stream(self, query: str, context_chunks: List[str],
+                                        history: Optional[List[dict]] = None,
+                                        outcome: Optional[StreamOutcome] = None) -> AsyncIterator[str]:
+        """Like agenerate_response, but yields the answer in pieces as it is produced
+        outcome, if given, records whether the extractive method stood in for a failed LLM call"""
+        if not context_chunks:
+            yield "Please upload a document first to ask questions about it. This is a document-based RAG chatbot."
+            return
+        
+        if self.async_openai_client:
+            stream = None
             try:
-                context = "\n\n---\n\n".join(context_chunks)
-                prompt = f"""Answer this question based ONLY on the document content below. Be specific and direct.
-
-Question: "{query}"
-
-Document Content:
-{context}
-
-Answer only what was asked. If asking for a definition, provide the definition from the document:"""
-                
-                response = self.openai_client.chat.completions.create(
+                messages = await run_cpu(self._completion_messages, query, context_chunks, history)
+                started = time.perf_counter()
+                stream = await self.async_openai_client.chat.completions.create(
                     model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": "You are a helpful assistant that answers questions based on provided document context."},
-                        {"role": "user", "content": prompt}
-                    ],
+                    messages=messages,
                     temperature=0.7,
-                    max_tokens=500
+                    max_tokens=500,
+                    stream=True
                 )
-                return response.choices[0].message.content
             except Exception as e:
                 print(f"OpenAI error, using free method: {e}")
-        
-        # FREE METHOD - Combine all chunks and extract answer
-        combined_context = "\n\n---\n\n".join(context_chunks)
-        answer = self.extract_answer_from_context(query, combined_context)
-        
+                FALLBACKS.inc(kind="extractive_answer")
+                annotate(llm_error=type(e).__name__)
+                if outcome is not None:
+                    outcome.fallback = True
+            if stream is not None:
+                streamed = False
+                try:
+                    async for event in stream:
+                        if event.choices and event.choices[0].delta.content:
+                            streamed = True
+                            yield event.choices[0].delta.content
+                    record_span("llm_generation", started, RAG_STAGE_SECONDS)
+                    return
+                except Exception as e:
+                    print(f"OpenAI stream failed, {'keeping the partial answer' if streamed else 'using free method'}: {e}")
+                    FALLBACKS.inc(kind="partial_answer" if streamed else "extractive_answer")
+                    annotate(llm_error=type(e).__name__)
+                    if outcome is not None:
+                        outcome.fallback = True
+                    if streamed:
+                        # The client already shows part of the LLM's answer; end it there rather than append another
+                        return
+        
+        # The extractive answer is ready at once; send it word by word so clients render it the same way
+        answer = await run_cpu(self._extractive_answer, query, context_chunks)
+        for piece in _STREAM_WORD_RE.findall(answer):
+            yield piece
+    
+    def _extractive_answer(self, query: str, context_chunks: List[str]) -> str:
+        """FREE METHOD - Extract answer from the chunks"""
+        with trace_span("extractive", RAG_STAGE_SECONDS):
+            return self._clean_extractive_answer(self.extract_answer_from_chunks(query, context_chunks))
+    
+    def _clean_extractive_answer(self, answer: str) -> str:
         # Clean up answer - remove duplicate sentences
         if answer and "couldn't find" not in answer.lower():
-            sentences = re.split(r'([.!?]+\s*)', answer)
+            sentences = _SENTENCE_SPLIT_RE.split(answer)
             seen = set()
             cleaned = []
             for i in range(0, len(sentences), 2):
@@ -412,18 +321,9 @@ Answer only what was asked. If asking for a definition, provide the definition f
         return answer if answer else "I couldn't find specific information about that in the uploaded documents."
     
     def has_documents(self) -> bool:
-        """Check if there are any documents in the collection"""
+        """Check if there are any documents in the collection (cached count, no DB round trip)"""
         try:
-            processor = self.document_processor
-            try:
-                count = processor.collection.count()
-                return count > 0
-            except AttributeError:
-                try:
-                    peek = processor.collection.peek(limit=1)
-                    return len(peek.get('ids', [])) > 0
-                except:
-                    return False
+            return self.document_processor.registry.chunk_count > 0
         except Exception as e:
             print(f"Error checking documents: {e}")
             return False
@@ -458,48 +358,21 @@ Answer only what was asked. If asking for a definition, provide the definition f
         if not page_type:
             return "", False
         
-        # Get page content
+        # Get page content from the persistent page store - no collection scans
         try:
-            # Get document ID
-            sample = processor.collection.peek(limit=100)
-            if not sample.get('ids'):
+            # Most recently uploaded document
+            document = processor.registry.latest()
+            if not document:
                 return "", False
+            doc_id = document["id"]
             
-            doc_ids = set()
-            if sample.get('metadatas'):
-                for meta in sample['metadatas']:
-                    if 'document_id' in meta:
-                        doc_ids.add(meta['document_id'])
-            
-            if not doc_ids:
-                return "", False
-            
-            doc_id = list(doc_ids)[0]
-            
-            # Get all data to find page chunks
-            all_data = processor.collection.get()
-            if not all_data or not all_data.get('documents'):
-                return "", False
-            
-            metadatas = all_data.get('metadatas', [])
-            documents = all_data['documents']
+            total_pages = processor.get_total_pages(doc_id)
+            if total_pages == 0:
+                return "Could not determine the pages of this document. Please re-upload the document.", True
             
             # Determine page number
             if page_type == 'last':
-                # Find max page number
-                max_page = 0
-                for meta in metadatas:
-                    pnum = meta.get('page_number', 0)
-                    if isinstance(pnum, (int, str)):
-                        try:
-                            pnum = int(pnum)
-                            if pnum > max_page:
-                                max_page = pnum
-                        except:
-                            pass
-                if max_page == 0:
-                    return "Could not determine the last page. Please re-upload the document.", True
-                page_num = max_page
+                page_num = total_pages
             elif page_type == 'first':
                 page_num = 1
             # else page_num already set from pattern
@@ -507,61 +380,11 @@ Answer only what was asked. If asking for a definition, provide the definition f
             if not page_num:
                 return "", False
             
-            # Method 1: Try to get from _document_pages (most reliable)
-            try:
-                if hasattr(processor, '_document_pages') and processor._document_pages:
-                    pages_data = processor._document_pages.get(doc_id, [])
-                    print(f"DEBUG: Looking in _document_pages for doc {doc_id}, found {len(pages_data)} pages")
-                    if pages_data:
-                        for pnum, ptext in pages_data:
-                            if int(pnum) == int(page_num):
-                                total_pages = len(pages_data)
-                                print(f"DEBUG: Found page {page_num} in _document_pages, content length: {len(ptext)}")
-                                return f"**Page {page_num} of {total_pages}:**\n\n{ptext.strip()}", True
-            except Exception as e:
-                print(f"Error getting from _document_pages: {e}")
-                import traceback
-                traceback.print_exc()
-            
-            # Method 2: Collect chunks from this page using metadata
-            page_chunks = []
-            for i, meta in enumerate(metadatas):
-                if i >= len(documents):
-                    break
-                meta_page = meta.get('page_number')
-                # Handle both int and string page numbers
-                if isinstance(meta_page, str):
-                    try:
-                        meta_page = int(meta_page)
-                    except:
-                        try:
-                            meta_page = int(float(meta_page))
-                        except:
-                            continue
-                elif isinstance(meta_page, float):
-                    meta_page = int(meta_page)
-                
-                if meta_page == page_num:
-                    page_chunks.append(documents[i])
+            page_text = processor.page_store.get_page(doc_id, page_num)
+            if page_text is None:
+                return f"Page {page_num} not found. The document has {total_pages} pages.", True
             
-            if page_chunks:
-                page_text = "\n\n".join(page_chunks).strip()
-                if page_text:
-                    # Calculate total pages
-                    all_pages = []
-                    for m in metadatas:
-                        p = m.get('page_number')
-                        if isinstance(p, (int, float)):
-                            all_pages.append(int(p))
-                        elif isinstance(p, str):
-                            try:
-                                all_pages.append(int(float(p)))
-                            except:
-                                pass
-                    total_pages = max(all_pages + [1])
-                    return f"**Page {page_num} of {total_pages}:**\n\n{page_text}", True
-            
-            return f"Page {page_num} content not found. The document may not have page information stored. Please re-upload the document.", True
+            return f"**Page {page_num} of {total_pages}:**\n\n{page_text.strip()}", True
             
         except Exception as e:
             print(f"Error in handle_page_query: {e}")
@@ -569,6 +392,13 @@ Answer only what was asked. If asking for a definition, provide the definition f
             traceback.print_exc()
             return "", False
     
+    async def _aquery_embedding(self, user_query: str):
+        try:
+            return (await self.document_processor.aget_query_embeddings([user_query]))[0]
+        except Exception as e:
+            print(f"Answer cache skipped: {e}")
+            return None
+    
     def select_best_chunks(self, query: str, search_results: List[Tuple[str, float]]) -> List[str]:
         """Select best chunks - prioritize chunks that contain the exact query term"""
         search_terms = self.extract_search_terms(query)
@@ -583,12 +413,12 @@ Answer only what was asked. If asking for a definition, provide the definition f
         other_chunks = []
         
         for chunk, distance in search_results:
-            chunk_lower = chunk.lower()
+            chunk_lower = as_indexed(chunk).lower_text
             
             # Check if chunk contains primary term
             has_primary = False
             if len(primary_words) == 1:
-                if re.search(rf'\b{re.escape(primary_term)}\b', chunk_lower):
+                if term_pattern(primary_term).search(chunk_lower):
                     has_primary = True
             else:
                 if primary_term in chunk_lower or all(w in chunk_lower for w in primary_words):
@@ -597,7 +427,7 @@ Answer only what was asked. If asking for a definition, provide the definition f
             if has_primary:
                 # Score by definition pattern and distance
                 score = 0
-                if re.search(rf'\b{re.escape(primary_term)}\b\s+(?:is|means|defined|refers)', chunk_lower):
+                if definition_pattern(primary_term).search(chunk_lower):
                     score += 20  # Big bonus for definition patterns
                 score += max(0, 10 - (distance * 10))  # Distance bonus
                 
@@ -638,8 +468,22 @@ Answer only what was asked. If asking for a definition, provide the definition f
         
         return result if result else [chunk for chunk, _ in search_results[:10]]
     
-    def query(self, user_query: str, n_results: int = 10) -> Tuple[str, List[str]]:
-        """Process a user query using RAG"""
+    def compact_context(self, context_chunks: List[str]) -> List[str]:
+        """Merge overlapping neighbours and drop near-duplicates among the selected chunks"""
+        with trace_span("compact_context", RAG_STAGE_SECONDS) as attributes:
+            compacted = self.context_compactor.compact(context_chunks)
+            attributes.update(chunks=len(compacted.chunks), merged=compacted.merged,
+                              duplicates=compacted.duplicates, tokens_saved=compacted.tokens_saved)
+        CONTEXT_TOKENS_SAVED.observe(compacted.tokens_saved)
+        if compacted.merged:
+            CONTEXT_CHUNKS_REMOVED.inc(compacted.merged, reason="merged")
+        if compacted.duplicates:
+            CONTEXT_CHUNKS_REMOVED.inc(compacted.duplicates, reason="duplicate")
+        annotate(context_tokens_saved=compacted.tokens_saved)
+        return compacted.chunks
+    
+    def _early_response(self, user_query: str) -> Optional[PreparedQuery]:
+        """Answers that need no retrieval: no documents yet, greetings and page queries"""
         # Check if we have documents
         has_docs = self.has_documents()
         
@@ -647,14 +491,14 @@ Answer only what was asked. If asking for a definition, provide the definition f
             query_lower = user_query.lower()
             greetings = ['hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening']
             if any(g in query_lower for g in greetings) and len(user_query.split()) <= 3:
-                return "Hello! 👋 Please upload a document (PDF, DOC, or DOCX) to ask questions about it.", []
-            return "Please upload a document first. This chatbot answers questions based on your uploaded documents.", []
+                return PreparedQuery("Hello! 👋 Please upload a document (PDF, DOC, or DOCX) to ask questions about it.", [], [])
+            return PreparedQuery("Please upload a document first. This chatbot answers questions based on your uploaded documents.", [], [])
         
         # Handle greetings
         query_lower = user_query.lower()
         greetings = ['hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening']
         if any(g in query_lower for g in greetings) and len(user_query.split()) <= 3:
-            return "Hello! I'm ready to answer questions about your uploaded documents. What would you like to know?", []
+            return PreparedQuery("Hello! I'm ready to answer questions about your uploaded documents. What would you like to know?", [], [])
         
         # Handle page queries FIRST - before any other processing
         page_response, is_page_query = self.handle_page_query(query_lower)
@@ -662,44 +506,151 @@ Answer only what was asked. If asking for a definition, provide the definition f
             # If page query was detected, MUST return page response (even if empty)
             # Don't fall through to normal search - page queries are explicit requests
             if page_response:
-                return page_response, ["Uploaded Document"]
+                return PreparedQuery(page_response, ["Uploaded Document"], [])
             else:
                 # Page query detected but content not found - give helpful error
-                return "I couldn't find the requested page. Please make sure the document has been uploaded recently (page information is only available for newly uploaded documents).", ["Uploaded Document"]
+                return PreparedQuery("I couldn't find the requested page. Please make sure the document has been uploaded recently (page information is only available for newly uploaded documents).", ["Uploaded Document"], [])
         
-        # Search for relevant chunks
-        try:
-            # Search with original query
-            search_results = self.document_processor.search_documents(user_query, n_results=30)
-            
-            # If no results, try with extracted terms
-            if not search_results:
-                search_terms = self.extract_search_terms(user_query)
-                if search_terms:
-                    # Try searching with just the main term
-                    alt_query = search_terms[0]
-                    search_results = self.document_processor.search_documents(alt_query, n_results=30)
-            
-            if not search_results:
-                return "I couldn't find any relevant information about '{}' in the uploaded documents. Please check if the term exists in the document.".format(user_query), []
-            
-            # Select best chunks that match the query
+        return None
+    
+    def _primary_term(self, user_query: str) -> str:
+        with trace_span("normalize", RAG_STAGE_SECONDS):
+            search_terms = self.extract_search_terms(user_query)
+        return search_terms[0] if search_terms else ""
+    
+    def _corpus_version(self) -> int:
+        return self.document_processor.registry.corpus_version
+    
+    def _answer_cacheable(self, history: Optional[List[dict]]) -> bool:
+        # With an LLM, follow-up answers depend on the conversation, not just the question
+        return not (history and self.async_openai_client)
+    
+    def _cached_answer(self, query_embedding, primary_term: str, corpus_version: int) -> Optional[PreparedQuery]:
+        """A near-identical question answered against the same corpus can be reused as is"""
+        if query_embedding is None:
+            return None
+        cached = self.answer_cache.lookup(query_embedding, primary_term, corpus_version)
+        return PreparedQuery(cached[0], cached[1], [], outcome="cached") if cached else None
+    
+    def _query_variants(self, user_query: str, primary_term: str) -> List[str]:
+        # Search with the original query, falling back to just the main term.
+        # Both variants are embedded in one batch (or come from the query cache).
+        query_variants = [user_query]
+        if primary_term and primary_term != user_query:
+            query_variants.append(primary_term)
+        return query_variants
+    
+    def _prepare_context(self, user_query: str, search_results: List[Tuple[str, float]], query_embedding,
+                         primary_term: str, corpus_version: int) -> PreparedQuery:
+        if not search_results:
+            return PreparedQuery("I couldn't find any relevant information about '{}' in the uploaded documents. Please check if the term exists in the document.".format(user_query), [], [], outcome="no_results")
+        
+        # Select best chunks that match the query
+        with trace_span("select_chunks", RAG_STAGE_SECONDS) as attributes:
             context_chunks = self.select_best_chunks(user_query, search_results)
-            
-            if not context_chunks:
-                return "I couldn't find relevant information in the uploaded documents. Please try rephrasing your question.", []
-            
-            # Generate response
-            response = self.generate_response(user_query, context_chunks, use_rag=True)
-            
-            return response, ["Uploaded Document"]
-            
+            attributes["chunks"] = len(context_chunks)
+        
+        if not context_chunks:
+            return PreparedQuery("I couldn't find relevant information in the uploaded documents. Please try rephrasing your question.", [], [], outcome="no_results")
+        
+        if self.context_compactor is not None:
+            context_chunks = self.compact_context(context_chunks)
+        
+        return PreparedQuery(None, ["Uploaded Document"], context_chunks, query_embedding, primary_term, corpus_version)
+    
+    def _error_response(self, error: Exception) -> PreparedQuery:
+        print(f"Error in RAGService.query: {error}")
+        import traceback
+        traceback.print_exc()
+        return PreparedQuery(f"An error occurred: {str(error)}. Please try again.", [], [], outcome="error")
+    
+    async def _aprepare_query(self, user_query: str, history: Optional[List[dict]] = None) -> PreparedQuery:
+        """Everything up to answer generation: greetings, page queries, the answer cache and retrieval.
+        Embedding calls are awaited, CPU-bound steps run on the CPU executor"""
+        try:
+            if self._processor is None:
+                await run_cpu(get_document_processor)
+            early = await run_cpu(self._early_response, user_query)
+            if early is not None:
+                return early._replace(outcome="early")
+            
+            primary_term = self._primary_term(user_query)
+            # Checks SQLite's data_version for other workers' writes, so it stays off the event loop
+            corpus_version = await run_cpu(self._corpus_version)
+            query_embedding = await self._aquery_embedding(user_query) if self._answer_cacheable(history) else None
+            cached = await run_cpu(self._cached_answer, query_embedding, primary_term, corpus_version)
+            if cached:
+                return cached
+            
+            with trace_span("search") as attributes:
+                search_results = await self.document_processor.asearch_variants(
+                    self._query_variants(user_query, primary_term), n_results=30)
+                attributes["candidates"] = len(search_results)
+            return await run_cpu(self._prepare_context, user_query, search_results, query_embedding,
+                                 primary_term, corpus_version)
+        except Exception as e:
+            return self._error_response(e)
+    
+    def _record_outcome(self, prepared: PreparedQuery):
+        RAG_QUERIES.inc(outcome=prepared.outcome)
+        annotate(outcome=prepared.outcome)
+    
+    def _cache_answer(self, prepared: PreparedQuery, response: str, fallback: bool = False):
+        # A fallback answer is only good until the LLM recovers; don't serve it for the rest of the corpus version
+        if fallback:
+            return
+        if prepared.query_embedding is not None and "couldn't find" not in response.lower():
+            self.answer_cache.store(prepared.query_embedding, prepared.primary_term, prepared.corpus_version,
+                                    response, prepared.sources)
+    
+    async def aquery(self, user_query: str, history: Optional[List[dict]] = None) -> Tuple[str, List[str]]:
+        """Process a user query using RAG; concurrent chats overlap their embedding and LLM waits
+        history: earlier messages of the conversation ({"role", "content"}, oldest first)"""
+        prepared = await self._aprepare_query(user_query, history)
+        self._record_outcome(prepared)
+        if prepared.response is not None:
+            return prepared.response, prepared.sources
+        
+        try:
+            response, fallback = await self.agenerate_response(user_query, prepared.context_chunks, history)
+            self._cache_answer(prepared, response, fallback)
+            return response, prepared.sources
         except Exception as e:
             print(f"Error in RAGService.query: {e}")
             import traceback
             traceback.print_exc()
             return f"An error occurred: {str(e)}. Please try again.", []
+    
+    async def astream_query(self, user_query: str,
+                            history: Optional[List[dict]] = None) -> Tuple[AsyncIterator[str], List[str]]:
+        """Process a user query using RAG, streaming the answer
+        Returns: (async iterator of answer pieces, sources)"""
+        prepared = await self._aprepare_query(user_query, history)
+        self._record_outcome(prepared)
+        
+        async def pieces():
+            if prepared.response is not None:
+                yield prepared.response
+                return
+            parts = []
+            outcome = StreamOutcome()
+            async for part in self.agenerate_response_stream(user_query, prepared.context_chunks, history, outcome):
+                parts.append(part)
+                yield part
+            self._cache_answer(prepared, "".join(parts), outcome.fallback)
+        
+        return pieces(), prepared.sources
+
+
+# Global instance - lazy initialization
+rag_service = None
+_rag_service_lock = threading.Lock()
 
 
-# Global instance
-rag_service = RAGService()
+def get_rag_service() -> RAGService:
+    global rag_service
+    if rag_service is None:
+        with _rag_service_lock:
+            if rag_service is None:
+                rag_service = RAGService()
+    return rag_service
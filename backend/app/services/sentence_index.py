@@ -0,0 +1,127 @@
+import re
+import json
+from functools import lru_cache
+from typing import List, NamedTuple, Optional
+
+# Words that mark a sentence as a likely definition (matched as substrings, like the original extractor)
+DEFINITION_KEYWORDS = ['is', 'means', 'defined as', 'refers to', 'is a', 'are', 'denotes', 'called']
+
+_PARAGRAPH_BREAK_RE = re.compile(r'\n\s*\n+')
+_SENTENCE_END_RE = re.compile(r'[.!?]+\s*')
+
+
+class SentenceSpan(NamedTuple):
+    start: int         # stripped sentence is text[start:end]
+    end: int
+    punct_start: int   # the punctuation (and whitespace) that closed it, -1 if none
+    punct_end: int
+    paragraph: int
+    is_definition: bool  # contains one of DEFINITION_KEYWORDS
+
+
+def lower_text(text: str) -> str:
+    """Lowercased text with the same character offsets as text"""
+    lower = text.lower()
+    if len(lower) == len(text):
+        return lower
+    # A few characters lowercase to more than one (e.g. "İ"); keep those as they are
+    return ''.join(c if len(c.lower()) != 1 else c.lower() for c in text)
+
+
+def segment_sentences(text: str) -> List[SentenceSpan]:
+    """Split text into paragraphs (blank lines) and sentences ([.!?]+), with offsets into text"""
+    lower = lower_text(text)
+    spans = []
+    paragraph_start = 0
+    paragraph_bounds = []
+    for match in _PARAGRAPH_BREAK_RE.finditer(text):
+        paragraph_bounds.append((paragraph_start, match.start()))
+        paragraph_start = match.end()
+    paragraph_bounds.append((paragraph_start, len(text)))
+
+    for paragraph, (p_start, p_end) in enumerate(paragraph_bounds):
+        pos = p_start
+        pieces = [(m.start(), m.start(), m.end()) for m in _SENTENCE_END_RE.finditer(text, p_start, p_end)]
+        pieces.append((p_end, -1, -1))
+        for raw_end, punct_start, punct_end in pieces:
+            start, end = pos, raw_end
+            while start < end and text[start].isspace():
+                start += 1
+            while end > start and text[end - 1].isspace():
+                end -= 1
+            if end > start:
+                sentence_lower = lower[start:end]
+                is_definition = any(keyword in sentence_lower for keyword in DEFINITION_KEYWORDS)
+                spans.append(SentenceSpan(start, end, punct_start, punct_end, paragraph, is_definition))
+            if punct_end >= 0:
+                pos = punct_end
+    return spans
+
+
+def encode_sentences(spans: List[SentenceSpan]) -> str:
+    """Compact JSON form for chunk metadata (vector store metadata values must be scalars)"""
+    return json.dumps([[s.start, s.end, s.punct_start, s.punct_end, s.paragraph, int(s.is_definition)]
+                       for s in spans], separators=(',', ':'))
+
+
+def decode_sentences(value) -> Optional[List[SentenceSpan]]:
+    if not value:
+        return None
+    try:
+        return [SentenceSpan(s, e, ps, pe, p, bool(d)) for s, e, ps, pe, p, d in json.loads(value)]
+    except (ValueError, TypeError):
+        return None
+
+
+class IndexedChunk(str):
+    """Chunk text that carries its sentence index and where it came from
+
+    Behaves as a plain string everywhere; the sentence spans come from the
+    chunk's metadata when it was indexed with them, and are computed on first
+    use for older chunks. document_id and chunk_index (when known) let context
+    compaction join neighbouring chunks of a document."""
+
+    def __new__(cls, text: str, sentences: Optional[List[SentenceSpan]] = None,
+                document_id: Optional[str] = None, chunk_index: Optional[int] = None):
+        chunk = super().__new__(cls, text)
+        chunk._sentences = sentences
+        chunk._lower = None
+        chunk.document_id = document_id
+        chunk.chunk_index = chunk_index
+        return chunk
+
+    @property
+    def sentences(self) -> List[SentenceSpan]:
+        if self._sentences is None:
+            self._sentences = segment_sentences(str(self))
+        return self._sentences
+
+    @property
+    def lower_text(self) -> str:
+        if self._lower is None:
+            self._lower = lower_text(str(self))
+        return self._lower
+
+    def sentence(self, span: SentenceSpan) -> str:
+        return str.__getitem__(self, slice(span.start, span.end))
+
+    def punct(self, span: SentenceSpan) -> str:
+        if span.punct_start < 0:
+            return '. '
+        return str.__getitem__(self, slice(span.punct_start, span.punct_end))
+
+
+def as_indexed(chunk: str) -> IndexedChunk:
+    return chunk if isinstance(chunk, IndexedChunk) else IndexedChunk(chunk)
+
+
+@lru_cache(maxsize=1024)
+def term_pattern(term: str) -> "re.Pattern":
+    """Compiled whole-word pattern for a search term, shared across requests"""
+    return re.compile(rf'\b{re.escape(term)}\b')
+
+
+@lru_cache(maxsize=1024)
+def definition_pattern(term: str) -> "re.Pattern":
+    """Compiled pattern for "<term> is/means/defined/refers"""
+    return re.compile(rf'\b{re.escape(term)}\b\s+(?:is|means|defined|refers)')
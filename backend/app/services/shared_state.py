@@ -0,0 +1,98 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+# Seconds a SQLite write waits for another worker process's write to finish before failing
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "30"))
+
+
+def connect_sqlite(path) -> sqlite3.Connection:
+    """Connection shared by this process's threads, in WAL mode so other worker
+    processes keep reading while one of them writes"""
+    conn = sqlite3.connect(str(path), timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def data_version(conn: sqlite3.Connection) -> int:
+    """Changes whenever another connection - in practice another worker process - commits to the database.
+    Served from the WAL index in shared memory, so it is cheap enough to check on every request."""
+    return conn.execute("PRAGMA data_version").fetchone()[0]
+
+
+class ReadWriteLock:
+    """Any number of readers or one writer; waiting writers hold off new readers"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+class ProcessWriteLock:
+    """Write lock shared by every worker process, with a count of the writes made under it
+
+    Backed by a one-row SQLite database: holding the lock is holding that
+    database's write lock, so it works on every platform SQLite does. A process
+    that remembers the generation of its own last write can tell from
+    generation() whether another process has written since."""
+
+    def __init__(self, path: Path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS writes (id INTEGER PRIMARY KEY CHECK (id = 0), "
+                           "generation INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO writes (id, generation) VALUES (0, 0)")
+
+    def generation(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT generation FROM writes").fetchone()[0]
+
+    @contextmanager
+    def hold(self, write: bool = True):
+        """Hold the lock for the with block, yielding the generation as of acquiring it.
+        Unless write is False, the generation goes up by one when the block succeeds."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn.execute("SELECT generation FROM writes").fetchone()[0]
+                if write:
+                    self._conn.execute("UPDATE writes SET generation = generation + 1")
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
@@ -0,0 +1,241 @@
+import os
+import re
+import time
+import uuid
+import random
+import asyncio
+import threading
+import contextvars
+import importlib.util
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+# Requests slower than this (milliseconds) print their trace; 0 prints every trace, a negative value none
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "2000"))
+# Opt-in request profiling: when true, a sample of chat requests is profiled and written to TRACE_PROFILE_DIR
+TRACE_PROFILING = os.getenv("TRACE_PROFILING", "false").lower() == "true"
+# Share of chat requests profiled when profiling is on; requests sent with "X-Debug-Profile: 1" always are
+TRACE_PROFILE_SAMPLE_RATE = float(os.getenv("TRACE_PROFILE_SAMPLE_RATE", "0.01"))
+TRACE_PROFILE_DIR = Path(os.getenv("TRACE_PROFILE_DIR", "./profiles"))
+
+# pyinstrument follows async requests across awaits; without it cProfile is used
+PYINSTRUMENT_AVAILABLE = importlib.util.find_spec("pyinstrument") is not None
+
+# Only chat requests are profiled - uploads return before their ingestion job runs
+_PROFILED_PATH_PREFIX = "/api/chat"
+# Server-Timing entries past this many spans are left out to keep the header small
+_MAX_SERVER_TIMING_SPANS = 24
+# Anything but printable ASCII, quotes and backslashes is dropped from Server-Timing descriptions
+_HEADER_UNSAFE_RE = re.compile(r'[^\x20-\x7e]|["\\]')
+
+
+class Span(NamedTuple):
+    name: str
+    start: float  # perf_counter seconds
+    duration: float  # seconds
+    attributes: Dict[str, object]
+
+
+def _describe(attributes: Dict[str, object]) -> str:
+    text = " ".join(f"{key}={value}" for key, value in attributes.items())
+    return _HEADER_UNSAFE_RE.sub("", text)[:120]
+
+
+class Trace:
+    """Spans and attributes of one HTTP request
+
+    Spans are added from the event loop and from executor threads (run_cpu
+    copies the request's context), so additions are locked."""
+
+    def __init__(self, method: str, path: str):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.start = time.perf_counter()
+        self.spans: List[Span] = []
+        self.attributes: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, start: float, end: float, attributes: Optional[Dict[str, object]] = None):
+        with self._lock:
+            self.spans.append(Span(name, start, end - start, dict(attributes or {})))
+
+    def annotate(self, **attributes):
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.start) * 1000.0
+
+    def server_timing(self) -> str:
+        """Server-Timing header value: one entry per span, the request's attributes, then the total so far"""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+            attributes = dict(self.attributes)
+        entries = []
+        for span in spans[:_MAX_SERVER_TIMING_SPANS]:
+            entry = f"{span.name};dur={span.duration * 1000.0:.1f}"
+            if span.attributes:
+                entry += f';desc="{_describe(span.attributes)}"'
+            entries.append(entry)
+        for key, value in attributes.items():
+            entries.append(f'{key};desc="{_HEADER_UNSAFE_RE.sub("", str(value))[:120]}"')
+        entries.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ", ".join(entries)
+
+    def summary(self) -> str:
+        """Multi-line trace for the log: spans by start offset, with their attributes"""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+            attributes = dict(self.attributes)
+        lines = [f"Trace {self.trace_id} {self.method} {self.path} {self.elapsed_ms():.1f} ms {_describe(attributes)}"]
+        for span in spans:
+            lines.append(f"  +{(span.start - self.start) * 1000.0:8.1f} ms  {span.name:<16}"
+                         f"{span.duration * 1000.0:8.1f} ms  {_describe(span.attributes)}")
+        return "\n".join(lines)
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def trace_span(name: str, histogram=None):
+    """Time the with block as a span of the current request's trace (if any)
+    and, if given, in histogram under stage=name. Yields a dict for attributes
+    such as candidate counts, recorded with the span."""
+    attributes = {}
+    start = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        end = time.perf_counter()
+        if histogram is not None:
+            histogram.observe(end - start, stage=name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_span(name, start, end, attributes)
+
+
+def record_span(name: str, start: float, histogram=None, **attributes):
+    """trace_span() for work that does not fit in one with block (a streamed answer); it ends now"""
+    end = time.perf_counter()
+    if histogram is not None:
+        histogram.observe(end - start, stage=name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, start, end, attributes)
+
+
+def annotate(**attributes):
+    """Attach attributes (outcome, extraction strategy, ...) to the current request's trace, if any"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.annotate(**attributes)
+
+
+class RequestProfiler:
+    """Profile of one request: pyinstrument HTML if installed, otherwise a cProfile .prof file
+
+    cProfile records everything on the event loop thread while it runs, other
+    requests' coroutines included, and nothing on executor threads."""
+
+    # Profilers hook the interpreter; only one request is profiled at a time
+    _active = threading.Lock()
+
+    def __init__(self):
+        if PYINSTRUMENT_AVAILABLE:
+            from pyinstrument import Profiler
+            self._profiler = Profiler(async_mode="enabled")
+        else:
+            import cProfile
+            self._profiler = cProfile.Profile()
+
+    @classmethod
+    def start(cls) -> Optional["RequestProfiler"]:
+        """A running profiler, or None if another request is being profiled"""
+        if not cls._active.acquire(blocking=False):
+            return None
+        try:
+            profiler = cls()
+            if PYINSTRUMENT_AVAILABLE:
+                profiler._profiler.start()
+            else:
+                profiler._profiler.enable()
+            return profiler
+        except Exception as e:
+            cls._active.release()
+            print(f"Could not start request profiler: {e}")
+            return None
+
+    def stop(self):
+        try:
+            if PYINSTRUMENT_AVAILABLE:
+                self._profiler.stop()
+            else:
+                self._profiler.disable()
+        finally:
+            self._active.release()
+
+    def save(self, trace_id: str) -> Path:
+        TRACE_PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        stem = f"{time.strftime('%Y%m%d-%H%M%S')}-{trace_id}"
+        if PYINSTRUMENT_AVAILABLE:
+            path = TRACE_PROFILE_DIR / f"{stem}.html"
+            path.write_text(self._profiler.output_html(), encoding="utf-8")
+        else:
+            path = TRACE_PROFILE_DIR / f"{stem}.prof"
+            self._profiler.dump_stats(str(path))
+        return path
+
+
+def _should_profile(scope) -> bool:
+    if not TRACE_PROFILING or not scope["path"].startswith(_PROFILED_PATH_PREFIX):
+        return False
+    if dict(scope.get("headers", [])).get(b"x-debug-profile") == b"1":
+        return True
+    return random.random() < TRACE_PROFILE_SAMPLE_RATE
+
+
+class TracingMiddleware:
+    """ASGI middleware giving each HTTP request a trace, summarized in a Server-Timing response header
+
+    The header goes out with the response start, so for a streamed chat answer
+    it only has what ran before streaming began; the full trace is printed
+    when the request is slower than TRACE_SLOW_MS."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace = Trace(scope["method"], scope["path"])
+        profiler = RequestProfiler.start() if _should_profile(scope) else None
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = _current_trace.set(trace)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_trace.reset(token)
+            if profiler is not None:
+                profiler.stop()
+                try:
+                    path = await asyncio.get_running_loop().run_in_executor(None, profiler.save, trace.trace_id)
+                    print(f"Profile of trace {trace.trace_id} ({trace.method} {trace.path}) written to {path}")
+                except Exception as e:
+                    print(f"Could not write profile of trace {trace.trace_id}: {e}")
+            if TRACE_SLOW_MS >= 0 and trace.elapsed_ms() >= TRACE_SLOW_MS:
+                print(trace.summary())
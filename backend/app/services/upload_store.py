@@ -0,0 +1,66 @@
+import os
+import time
+import uuid
+import hashlib
+from pathlib import Path
+from typing import BinaryIO, Callable, Tuple
+
+from app.services.document_processor import UPLOAD_DIR
+
+# Uploads younger than this are never garbage collected (they may still be queued)
+UPLOAD_GC_GRACE_SECONDS = int(os.getenv("UPLOAD_GC_GRACE_SECONDS", "3600"))
+
+INCOMING_PREFIX = ".incoming-"
+
+
+def upload_path_for(content_hash: str, file_ext: str) -> Path:
+    """Content-addressed location of an upload"""
+    return UPLOAD_DIR / f"{content_hash}{file_ext}"
+
+
+def save_upload(source: BinaryIO, file_ext: str) -> Tuple[Path, str]:
+    """Stream an upload to disk while hashing it, then move it to its content address
+    Returns: (path, sha256 hex digest)"""
+    UPLOAD_DIR.mkdir(exist_ok=True, parents=True)
+    temp_path = UPLOAD_DIR / f"{INCOMING_PREFIX}{uuid.uuid4().hex}"
+    digest = hashlib.sha256()
+    try:
+        with open(temp_path, "wb") as buffer:
+            while True:
+                block = source.read(1024 * 1024)
+                if not block:
+                    break
+                digest.update(block)
+                buffer.write(block)
+        content_hash = digest.hexdigest()
+        path = upload_path_for(content_hash, file_ext)
+        # Identical content may already be on disk; either way one copy is kept
+        os.replace(temp_path, path)
+        return path, content_hash
+    except Exception:
+        if temp_path.exists():
+            temp_path.unlink()
+        raise
+
+
+def collect_orphaned_uploads(is_referenced: Callable[[str], bool],
+                             grace_seconds: int = UPLOAD_GC_GRACE_SECONDS) -> int:
+    """Delete upload files that no indexed document or pending job refers to
+    is_referenced receives a content hash. Returns the number of files removed."""
+    if not UPLOAD_DIR.exists():
+        return 0
+    removed = 0
+    cutoff = time.time() - grace_seconds
+    for path in UPLOAD_DIR.iterdir():
+        try:
+            if not path.is_file() or path.stat().st_mtime > cutoff:
+                continue
+            # Leftover partial uploads and files saved under their original name are never referenced
+            if path.name.startswith(INCOMING_PREFIX) or not is_referenced(path.stem):
+                path.unlink()
+                removed += 1
+        except Exception as e:
+            print(f"Upload GC: could not check {path.name}: {e}")
+    if removed:
+        print(f"Upload GC: removed {removed} orphaned files")
+    return removed
@@ -0,0 +1,535 @@
+import os
+import json
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from app.services.embedding_compression import (
+    EMBEDDING_QUANTIZATION, EMBEDDING_RESCORE_FACTOR, QuantizedMatrix, quantize_int8, search_with_rescoring
+)
+from app.services.shared_state import ProcessWriteLock, ReadWriteLock, connect_sqlite, data_version
+
+# "chroma" (default) or "numpy" for the in-process memory-mapped matrix
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "chroma").lower()
+CHROMA_PATH = os.getenv("CHROMA_PATH", "./chroma_db")
+NUMPY_STORE_DIR = Path(os.getenv("NUMPY_STORE_DIR", "./vector_store"))
+# Compact the numpy store once this fraction of its rows are deleted
+NUMPY_STORE_COMPACT_RATIO = float(os.getenv("NUMPY_STORE_COMPACT_RATIO", "0.25"))
+
+# First-pass index modes the numpy store searches at least as fast as float32
+NUMPY_STORE_QUANTIZATION_MODES = ("none", "int8")
+
+COLLECTION_NAME = "documents"
+
+
+class VectorHit(NamedTuple):
+    id: str
+    document: str
+    metadata: dict
+    distance: float  # squared L2 distance, lower = more relevant
+
+
+class VectorStore:
+    """Storage and nearest-neighbour search for chunk embeddings
+
+    where filters are metadata equality dicts, e.g. {"document_id": id},
+    optionally combined as {"$and": [{...}, {...}]}."""
+
+    def add(self, ids: List[str], embeddings: List[List[float]], documents: List[str], metadatas: List[dict]):
+        raise NotImplementedError
+
+    def query(self, query_embeddings: List[List[float]], n_results: int) -> List[List[VectorHit]]:
+        """Nearest chunks for each query embedding, closest first"""
+        raise NotImplementedError
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[dict] = None, limit: Optional[int] = None,
+            offset: Optional[int] = None, include_embeddings: bool = False) -> Dict[str, list]:
+        """Stored items as {"ids", "documents", "metadatas"[, "embeddings"]}"""
+        raise NotImplementedError
+
+    def delete(self, where: dict):
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def refresh(self):
+        """Pick up what other worker processes wrote since this process last looked"""
+
+
+class ChromaVectorStore(VectorStore):
+    """ChromaDB persistent collection
+
+    Chroma's client is not safe to share between processes: each worker keeps
+    its own copy of the HNSW index in memory. Writes are serialised across
+    workers by a lock file in the Chroma directory, and a worker that finds
+    another one has written since reopens its client before going on."""
+
+    def __init__(self, path: str = CHROMA_PATH):
+        self.path = path
+        Path(path).mkdir(parents=True, exist_ok=True)
+        self._write_lock = ProcessWriteLock(Path(path) / "write_lock.sqlite3")
+        # Reads share the client; reopening it waits for them to finish
+        self._rw = ReadWriteLock()
+        with self._write_lock.hold(write=False) as generation:
+            self._open()
+        self._generation = generation
+
+    def _open(self):
+        import chromadb
+        # Use PersistentClient for newer ChromaDB versions
+        try:
+            self.client = chromadb.PersistentClient(path=self.path)
+        except AttributeError:
+            # Fallback for older versions
+            from chromadb.config import Settings
+            self.client = chromadb.Client(Settings(
+                chroma_db_impl="duckdb+parquet",
+                persist_directory=self.path
+            ))
+
+        # Get or create collection
+        self.collection = self.client.get_or_create_collection(
+            name=COLLECTION_NAME
+        )
+
+    def _reopen(self, generation: int):
+        with self._rw.write():
+            if generation == self._generation:
+                return
+            # The client is cached per path; drop it so the other workers' writes are read back in
+            if hasattr(self.client, "clear_system_cache"):
+                self.client.clear_system_cache()
+            self._open()
+            self._generation = generation
+
+    def refresh(self):
+        if self._write_lock.generation() != self._generation:
+            # Like __init__, open the files only while no other worker is halfway through writing them
+            with self._write_lock.hold(write=False) as generation:
+                self._reopen(generation)
+
+    @contextmanager
+    def _writing(self):
+        with self._write_lock.hold() as generation:
+            if generation != self._generation:
+                self._reopen(generation)
+            with self._rw.read():
+                yield
+            self._generation = generation + 1
+
+    def add(self, ids, embeddings, documents, metadatas):
+        with self._writing():
+            self.collection.add(embeddings=embeddings, ids=ids, metadatas=metadatas, documents=documents)
+
+    def query(self, query_embeddings, n_results):
+        with self._rw.read():
+            results = self.collection.query(query_embeddings=query_embeddings, n_results=n_results)
+        hits = []
+        for i in range(len(query_embeddings)):
+            documents = results['documents'][i] if results.get('documents') else []
+            ids = results['ids'][i]
+            metadatas = results['metadatas'][i] if results.get('metadatas') else [{}] * len(documents)
+            distances = results['distances'][i] if results.get('distances') else [0] * len(documents)
+            hits.append([VectorHit(*item) for item in zip(ids, documents, metadatas, distances)])
+        return hits
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include_embeddings=False):
+        include = ["documents", "metadatas"] + (["embeddings"] if include_embeddings else [])
+        with self._rw.read():
+            return self.collection.get(ids=ids, where=where, limit=limit, offset=offset, include=include)
+
+    def delete(self, where):
+        with self._writing():
+            self.collection.delete(where=where)
+
+    def count(self):
+        with self._rw.read():
+            return self.collection.count()
+
+
+def _where_sql(where: Optional[dict]):
+    """Translate a metadata equality filter into a SQL condition over the JSON metadata column"""
+    if not where:
+        return "1 = 1", []
+    if "$and" in where:
+        parts = [_where_sql(clause) for clause in where["$and"]]
+        return " AND ".join(f"({sql})" for sql, _ in parts), [p for _, params in parts for p in params]
+    conditions = []
+    params = []
+    for key, value in where.items():
+        conditions.append("json_extract(metadata, ?) = ?")
+        params.extend([f"$.{key}", value])
+    return " AND ".join(conditions), params
+
+
+class _Growable:
+    """Row-appendable numpy array with amortised O(1) appends"""
+
+    def __init__(self, data: np.ndarray):
+        self._data = data
+        self.size = len(data)
+
+    @property
+    def array(self) -> np.ndarray:
+        return self._data[:self.size]
+
+    def extend(self, rows: np.ndarray):
+        needed = self.size + len(rows)
+        if needed > len(self._data):
+            grown = np.empty((max(needed, 2 * len(self._data), 1024),) + self._data.shape[1:], dtype=self._data.dtype)
+            grown[:self.size] = self._data[:self.size]
+            self._data = grown
+        self._data[self.size:needed] = rows
+        self.size = needed
+
+
+class NumpyVectorStore(VectorStore):
+    """In-process exact search over a contiguous, memory-mapped float32 matrix
+
+    Full-precision vectors live in vectors.f32 and are memory-mapped; squared
+    norms (and, with EMBEDDING_QUANTIZATION=int8, codes used for the first
+    pass) are held in RAM. Ids, texts and metadata live in SQLite.
+    Deleted rows are masked until enough accumulate to compact the files.
+    Ranking uses dot products, which matches L2 order for the unit-length
+    vectors both embedding providers return.
+
+    Several worker processes can share one store: writes happen inside a
+    SQLite write transaction, which serializes them across processes, and
+    refresh() maps rows appended elsewhere (or reloads after a delete or
+    compaction, which bump the generation in the meta table)."""
+
+    def __init__(self, root: Path = NUMPY_STORE_DIR, quantization: str = EMBEDDING_QUANTIZATION):
+        self.root = Path(root)
+        self.root.mkdir(exist_ok=True, parents=True)
+        if quantization not in NUMPY_STORE_QUANTIZATION_MODES:
+            # numpy converts float16 slowly: a float16 first pass is several times slower than the float32 scan
+            raise ValueError(f"EMBEDDING_QUANTIZATION={quantization} is not supported by the numpy vector store "
+                             f"(use one of {', '.join(NUMPY_STORE_QUANTIZATION_MODES)})")
+        self.quantization = quantization
+        self._lock = threading.RLock()
+        self._conn = connect_sqlite(self.root / "rows.sqlite3")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS rows (
+                row INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                document TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                deleted INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', '0')")
+        self._conn.commit()
+        self._load()
+
+    # Files
+    @property
+    def _vectors_path(self) -> Path:
+        return self.root / "vectors.f32"
+
+    @property
+    def _norms_path(self) -> Path:
+        return self.root / "norms.f32"
+
+    @property
+    def _codes_path(self) -> Path:
+        return self.root / f"codes.{self.quantization}"
+
+    @property
+    def _scales_path(self) -> Path:
+        return self.root / "scales.f32"
+
+    @contextmanager
+    def _writing(self):
+        """Hold SQLite's write lock, so no other process appends, deletes or compacts meanwhile"""
+        with self._lock:
+            if self._conn.in_transaction:
+                yield
+                return
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    def _generation(self) -> int:
+        return int(self._conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0])
+
+    def _bump_generation(self):
+        self._conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'generation'")
+        self._loaded_generation = self._generation()
+
+    def _load(self):
+        # Trimming the vectors file below must not race another process's append
+        with self._writing():
+            self._data_version = data_version(self._conn)
+            self._loaded_generation = self._generation()
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'dimensions'").fetchone()
+            self.dimensions = int(row[0]) if row else 0
+            size = self._conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM rows").fetchone()[0]
+            deleted = [r[0] for r in self._conn.execute("SELECT row FROM rows WHERE deleted = 1")]
+            # Trim vectors a crashed write appended without recording rows
+            if self._vectors_path.exists() and self.dimensions:
+                with open(self._vectors_path, "r+b") as f:
+                    f.truncate(size * self.dimensions * 4)
+            self._remap(size)
+
+            norms = self._read_side_file(self._norms_path, np.float32, size)
+            if norms is None:
+                norms = np.einsum("ij,ij->i", self._vectors, self._vectors) if size else np.empty(0, np.float32)
+                norms.astype(np.float32).tofile(self._norms_path)
+            self._norms = _Growable(norms.astype(np.float32))
+
+            self._alive = _Growable(np.ones(size, dtype=bool))
+            self._alive.array[deleted] = False
+            self._deleted = len(deleted)
+
+            self._codes = self._scales = None
+            if self.quantization == "int8":
+                codes = self._read_side_file(self._codes_path, np.int8, size * self.dimensions)
+                scales = self._read_side_file(self._scales_path, np.float32, size)
+                if codes is None or scales is None:
+                    codes, scales = quantize_int8(np.asarray(self._vectors))
+                    codes.tofile(self._codes_path)
+                    scales.tofile(self._scales_path)
+                self._codes = _Growable(codes.reshape(size, self.dimensions) if size else
+                                        np.empty((0, self.dimensions), codes.dtype))
+                self._scales = _Growable(scales)
+
+    def refresh(self):
+        with self._lock:
+            version = data_version(self._conn)
+            if version == self._data_version:
+                return
+            self._data_version = version
+            if self._generation() != self._loaded_generation or not self.dimensions:
+                self._load()
+            else:
+                self._map_appended()
+
+    def _map_appended(self):
+        """Extend the in-memory arrays with rows other processes appended (all rows are still there)"""
+        size = self._conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM rows").fetchone()[0]
+        added = size - self._size
+        if added <= 0:
+            return
+        norms = self._read_side_file(self._norms_path, np.float32, added, offset=self._size)
+        codes = scales = None
+        if self._codes is not None:
+            codes = self._read_side_file(self._codes_path, self._codes.array.dtype, added * self.dimensions,
+                                         offset=self._size * self.dimensions)
+            if self._scales is not None:
+                scales = self._read_side_file(self._scales_path, np.float32, added, offset=self._size)
+        if norms is None or (self._codes is not None and codes is None) or (self._scales is not None and scales is None):
+            self._load()
+            return
+        self._norms.extend(norms)
+        if codes is not None:
+            self._codes.extend(codes.reshape(added, self.dimensions))
+        if scales is not None:
+            self._scales.extend(scales)
+        self._alive.extend(np.ones(added, dtype=bool))
+        self._remap(size)
+
+    def _read_side_file(self, path: Path, dtype, expected: int, offset: int = 0) -> Optional[np.ndarray]:
+        if not path.exists():
+            return None
+        data = np.fromfile(path, dtype=dtype, count=expected if offset else -1, offset=offset * np.dtype(dtype).itemsize)
+        if len(data) != expected:
+            # Out of sync (e.g. interrupted write) - rebuild from the vectors
+            return None
+        return data
+
+    def _remap(self, size: int):
+        self._size = size
+        if size and self.dimensions:
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(size, self.dimensions))
+        else:
+            self._vectors = np.empty((0, self.dimensions), dtype=np.float32)
+
+    def add(self, ids, embeddings, documents, metadatas):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            with self._writing():
+                # Rows other processes appended come first; new rows go after them
+                self.refresh()
+                if not self.dimensions:
+                    self.dimensions = vectors.shape[1]
+                    self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('dimensions', ?)",
+                                       (str(self.dimensions),))
+                    self._load()
+                if vectors.shape[1] != self.dimensions:
+                    raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the store ({self.dimensions})")
+                start = self._size
+                self._trim_files(start)
+                # Vectors first: rows recorded in SQLite always have their vectors on disk
+                with open(self._vectors_path, "ab") as f:
+                    vectors.tofile(f)
+                norms = np.einsum("ij,ij->i", vectors, vectors).astype(np.float32)
+                with open(self._norms_path, "ab") as f:
+                    norms.tofile(f)
+                codes = scales = None
+                if self._codes is not None:
+                    codes, scales = quantize_int8(vectors)
+                    with open(self._codes_path, "ab") as f:
+                        codes.tofile(f)
+                    with open(self._scales_path, "ab") as f:
+                        scales.tofile(f)
+                self._conn.executemany(
+                    "INSERT INTO rows (row, id, document, metadata) VALUES (?, ?, ?, ?)",
+                    [(start + i, id_, document, json.dumps(metadata))
+                     for i, (id_, document, metadata) in enumerate(zip(ids, documents, metadatas))]
+                )
+            # Committed - only now do the rows become searchable here
+            if codes is not None:
+                self._codes.extend(codes)
+                self._scales.extend(scales)
+            self._norms.extend(norms)
+            self._alive.extend(np.ones(len(vectors), dtype=bool))
+            self._data_version = data_version(self._conn)
+            self._remap(start + len(vectors))
+
+    def _trim_files(self, size: int):
+        """Cut off anything a crashed write (in any process) appended past the recorded rows"""
+        itemsize = self._codes.array.dtype.itemsize if self._codes is not None else 0
+        for path, row_bytes in ((self._vectors_path, self.dimensions * 4), (self._norms_path, 4),
+                                (self._codes_path, self.dimensions * itemsize), (self._scales_path, 4)):
+            if row_bytes and path.exists() and path.stat().st_size > size * row_bytes:
+                with open(path, "r+b") as f:
+                    f.truncate(size * row_bytes)
+
+    def query(self, query_embeddings, n_results):
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        while True:
+            with self._lock:
+                generation = self._loaded_generation
+                size, vectors, norms, alive = self._size, self._vectors, self._norms.array, self._alive.array
+                deleted = self._deleted
+                index = None
+                if self._codes is not None:
+                    index = QuantizedMatrix(self._codes.array, self._scales.array if self._scales else None,
+                                            self.quantization)
+            scored = []
+            for query in queries:
+                if size == 0:
+                    scored.append([])
+                    continue
+                if index is None:
+                    index = QuantizedMatrix(vectors, None, "none")
+                rows = search_with_rescoring(index, lambda rows: np.asarray(vectors[rows]), query, n_results,
+                                             EMBEDDING_RESCORE_FACTOR, alive=alive if deleted else None)
+                query_norm = float(query @ query)
+                # Rows deleted in this process since the snapshot are still dropped here
+                scored.append([(row, query_norm + float(norms[row]) - 2 * dot) for row, dot in rows if alive[row]])
+            hits = self._hits(generation, scored)
+            if hits is not None:
+                return hits
+            # A compaction renumbered the rows after the snapshot: score again against the new layout
+            self.refresh()
+
+    def _hits(self, generation: int, scored: List[List[Tuple[int, float]]]) -> Optional[List[List[VectorHit]]]:
+        """Hits for each query's (row, distance) pairs, or None if the rows were renumbered since generation"""
+        rows = sorted({row for pairs in scored for row, _ in pairs})
+        with self._lock:
+            # One read transaction, so the generation checked is the one the rows are read at
+            self._conn.execute("BEGIN")
+            try:
+                if self._generation() != generation:
+                    return None
+                found = {
+                    row: (id_, document, metadata)
+                    for row, id_, document, metadata in self._conn.execute(
+                        f"SELECT row, id, document, metadata FROM rows WHERE row IN ({','.join('?' * len(rows))})",
+                        rows)
+                } if rows else {}
+            finally:
+                self._conn.commit()
+        return [[VectorHit(found[row][0], found[row][1], json.loads(found[row][2]), distance)
+                 for row, distance in pairs if row in found] for pairs in scored]
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include_embeddings=False):
+        condition, params = _where_sql(where)
+        if ids is not None:
+            condition += f" AND id IN ({','.join('?' * len(ids))})"
+            params += list(ids)
+        sql = f"SELECT row, id, document, metadata FROM rows WHERE deleted = 0 AND {condition} ORDER BY row"
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params += [limit if limit is not None else -1, offset or 0]
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+            if include_embeddings and rows and max(r[0] for r in rows) >= self._size:
+                # Rows another process appended since the last refresh
+                self.refresh()
+            vectors = self._vectors
+        result = {
+            "ids": [r[1] for r in rows],
+            "documents": [r[2] for r in rows],
+            "metadatas": [json.loads(r[3]) for r in rows],
+        }
+        if include_embeddings:
+            result["embeddings"] = [np.asarray(vectors[r[0]]).tolist() for r in rows]
+        return result
+
+    def delete(self, where):
+        condition, params = _where_sql(where)
+        with self._lock:
+            with self._writing():
+                self.refresh()
+                rows = [r[0] for r in self._conn.execute(
+                    f"SELECT row FROM rows WHERE deleted = 0 AND {condition}", params)]
+                if not rows:
+                    return
+                self._conn.executemany("UPDATE rows SET deleted = 1 WHERE row = ?", [(r,) for r in rows])
+                self._bump_generation()
+                if self._deleted + len(rows) > max(1000, self._size * NUMPY_STORE_COMPACT_RATIO):
+                    # Same transaction: no other process appends or deletes between the delete and the rewrite
+                    self.compact()
+                    return
+            self._alive.array[rows] = False
+            self._deleted += len(rows)
+
+    def compact(self):
+        """Rewrite the store without deleted rows"""
+        with self._writing():
+            # Rows other processes appended must be mapped before the vectors file is rewritten
+            self.refresh()
+            # Which rows survive comes from SQLite, not this process's view of it
+            keep = np.array([r[0] for r in self._conn.execute("SELECT row FROM rows WHERE deleted = 0 ORDER BY row")],
+                            dtype=np.int64)
+            for path in (self._norms_path, self._codes_path, self._scales_path):
+                if path.exists():
+                    path.unlink()
+            temp_path = self._vectors_path.with_suffix(".tmp")
+            with open(temp_path, "wb") as f:
+                for start in range(0, len(keep), 10000):
+                    np.asarray(self._vectors[keep[start:start + 10000]]).tofile(f)
+            self._vectors = None
+            os.replace(temp_path, self._vectors_path)
+            self._conn.execute("DELETE FROM rows WHERE deleted = 1")
+            # Ascending order never collides: row i moves to its rank among the kept rows, which is <= i
+            self._conn.executemany("UPDATE rows SET row = ? WHERE row = ?",
+                                   [(new, int(old)) for new, old in enumerate(keep)])
+            self._bump_generation()
+            print(f"Vector store compacted to {len(keep)} rows")
+            self._load()
+
+    def count(self):
+        return self._size - self._deleted
+
+
+def create_vector_store(backend: str = VECTOR_STORE_BACKEND) -> VectorStore:
+    if backend == "numpy":
+        return NumpyVectorStore()
+    if backend == "chroma":
+        if EMBEDDING_QUANTIZATION != "none":
+            raise ValueError(f"EMBEDDING_QUANTIZATION={EMBEDDING_QUANTIZATION} needs VECTOR_STORE_BACKEND=numpy; "
+                             f"ChromaDB always stores float32")
+        return ChromaVectorStore()
+    raise ValueError(f"Unknown VECTOR_STORE_BACKEND: {backend}")
@@ -0,0 +1,59 @@
+import time
+import threading
+from typing import Optional
+
+from app.services.document_processor import get_document_processor
+from app.services.rag_service import get_rag_service
+
+
+class WarmupState:
+    """Progress of the startup warm-up, reported by /api/ready"""
+
+    def __init__(self):
+        self.status = "pending"  # pending -> warming -> ready | failed
+        self.error: Optional[str] = None
+        self.steps = {}  # step name -> seconds taken
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"status": self.status, "ready": self.ready, "error": self.error, "steps": dict(self.steps)}
+
+
+warmup_state = WarmupState()
+
+
+def _step(name: str, fn):
+    start = time.perf_counter()
+    fn()
+    with warmup_state._lock:
+        warmup_state.steps[name] = round(time.perf_counter() - start, 3)
+
+
+def warm_up():
+    """Build the services and load the embedding model and vector index before traffic arrives"""
+    warmup_state.status = "warming"
+    start = time.perf_counter()
+    try:
+        _step("document_processor", get_document_processor)
+        _step("rag_service", get_rag_service)
+        processor = get_document_processor()
+        _step("embedding_model", processor.warm_up_embeddings)
+        _step("vector_store", processor.warm_up_vector_store)
+    except Exception as e:
+        warmup_state.error = str(e)
+        warmup_state.status = "failed"
+        print(f"Warm-up failed: {e}")
+        return
+    warmup_state.status = "ready"
+    print(f"Warm-up finished in {time.perf_counter() - start:.1f}s")
+
+
+def start_warmup() -> threading.Thread:
+    thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
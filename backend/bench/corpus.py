@@ -0,0 +1,146 @@
+"""Generate a synthetic PDF/DOCX corpus for load tests
+
+Run from the backend directory:
+
+    python -m bench.corpus --out bench_corpus --documents 20 --pages 10
+    python -m bench.corpus --out big_corpus --documents 5 --pages 400 --formats pdf
+
+Pages are filler prose from a small technical vocabulary, mixed with
+definition sentences ("A <term> is ..."), so both retrieval and the extractive
+answer path have real work to do. A questions.txt with one question per term
+(plus a few page queries) is written next to the documents for bench.load.
+PDFs are written directly (uncompressed text, Helvetica) so no PDF library is
+needed; PyPDF2 extracts them like any other text PDF.
+"""
+import argparse
+import random
+from pathlib import Path
+from typing import List
+
+import docx
+
+TERMS = [
+    "graph", "tree", "vertex", "edge", "cycle", "path", "bipartite graph", "complete graph", "spanning tree",
+    "adjacency matrix", "hash table", "binary heap", "linked list", "stack", "queue", "trie", "b-tree",
+    "red-black tree", "skip list", "bloom filter", "merge sort", "quicksort", "dynamic programming",
+    "greedy algorithm", "topological sort", "shortest path", "minimum cut", "network flow", "matching",
+    "eigenvalue", "matrix", "vector space", "gradient", "convolution", "tensor", "regularization",
+]
+FILLER = (
+    "the of and to in is for on with as by that this from at an be are or which it these can its their "
+    "each when where between over under used using data structure algorithm node value set order time "
+    "memory operation element result method property case example number problem input output"
+).split()
+WORDS_PER_LINE = 14
+
+
+def definition(term: str, rng: random.Random) -> str:
+    qualities = ["structure", "method", "technique", "representation", "construction", "object"]
+    return (f"A {term} is a {rng.choice(qualities)} in which every {rng.choice(FILLER)} "
+            f"{rng.choice(FILLER)} is related to the {rng.choice(FILLER)} {rng.choice(FILLER)} of the input.")
+
+
+def filler_sentence(rng: random.Random) -> str:
+    words = [rng.choice(FILLER) for _ in range(rng.randint(8, 20))]
+    if rng.random() < 0.3:
+        words.insert(rng.randrange(len(words)), rng.choice(TERMS))
+    return " ".join(words).capitalize() + "."
+
+
+def page_text(rng: random.Random, words_per_page: int) -> str:
+    sentences = []
+    words = 0
+    while words < words_per_page:
+        sentence = definition(rng.choice(TERMS), rng) if rng.random() < 0.15 else filler_sentence(rng)
+        sentences.append(sentence)
+        words += len(sentence.split())
+    return " ".join(sentences)
+
+
+def wrap(text: str, width: int = WORDS_PER_LINE) -> List[str]:
+    words = text.split()
+    return [" ".join(words[i:i + width]) for i in range(0, len(words), width)]
+
+
+def _pdf_escape(line: str) -> str:
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: Path, pages: List[str]):
+    """Minimal PDF 1.4: one uncompressed content stream per page, standard Helvetica font"""
+    objects = {1: b"<< /Type /Catalog /Pages 2 0 R >>", 3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    page_ids = []
+    next_id = 4
+    for text in pages:
+        lines = wrap(text)
+        # Squeeze the line spacing so long pages still fit on the page
+        leading = min(14.0, 710.0 / max(1, len(lines)))
+        body = (f"BT /F1 10 Tf {leading:.2f} TL 50 760 Td "
+                + " ".join(f"({_pdf_escape(line)}) '" for line in lines) + " ET")
+        stream = body.encode("latin-1", "replace")
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        objects[content_id] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        objects[page_id] = (b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        page_ids.append(page_id)
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids).encode()
+    objects[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(out)
+        out += b"%d 0 obj\n%s\nendobj\n" % (object_id, objects[object_id])
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for object_id in sorted(objects):
+        out += b"%010d 00000 n \n" % offsets[object_id]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    path.write_bytes(bytes(out))
+
+
+def write_docx(path: Path, pages: List[str]):
+    document = docx.Document()
+    for i, text in enumerate(pages):
+        if i:
+            document.add_page_break()
+        document.add_paragraph(text)
+    document.save(str(path))
+
+
+def write_questions(path: Path, pages_per_document: int):
+    questions = [f"What is a {term}?" for term in TERMS]
+    questions += [f"define {term}" for term in TERMS[::3]]
+    questions += ["what is on page 1", "last page", f"page {max(1, pages_per_document // 2)}"]
+    path.write_text("\n".join(questions) + "\n", encoding="utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", default="bench_corpus", help="output directory")
+    parser.add_argument("--documents", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=10, help="pages per document")
+    parser.add_argument("--words-per-page", type=int, default=400)
+    parser.add_argument("--formats", nargs="+", choices=["pdf", "docx"], default=["pdf", "docx"],
+                        help="file formats, used in turn")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(args.seed)
+    total_bytes = 0
+    for i in range(args.documents):
+        file_format = args.formats[i % len(args.formats)]
+        pages = [page_text(rng, args.words_per_page) for _ in range(args.pages)]
+        path = out / f"doc_{i:04d}.{file_format}"
+        (write_pdf if file_format == "pdf" else write_docx)(path, pages)
+        total_bytes += path.stat().st_size
+    write_questions(out / "questions.txt", args.pages)
+    print(f"Wrote {args.documents} documents ({args.pages} pages each, {total_bytes / 1e6:.1f} MB) "
+          f"and questions.txt to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""Drive concurrent upload and chat traffic against the backend and report throughput and latency
+
+Run from the backend directory, either against a running server:
+
+    python -m bench.load --url http://127.0.0.1:8000 --corpus bench_corpus --chats 500 --concurrency 16
+
+or let it start the backend itself in a scratch directory, optionally behind the
+OpenAI stub (bench.stub_openai) so no real API calls are made:
+
+    python -m bench.load --spawn --stub --corpus bench_corpus --json results/baseline.json
+    python -m bench.load --spawn --env VECTOR_STORE_BACKEND=numpy --corpus bench_corpus --json results/numpy.json
+
+Documents of the corpus (see bench.corpus) are uploaded first and their
+ingestion jobs awaited, then the questions in questions.txt are sent as chat
+requests. With --mixed both run at the same time. The report has throughput,
+p50/p95/p99 latency and error counts per operation, the server's peak RSS
+(main process, spawned servers on Linux only) and the mean time per pipeline
+stage scraped from /metrics. --json writes it as a file for comparing runs.
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import requests
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+DOCUMENT_SUFFIXES = {".pdf", ".doc", ".docx"}
+_STAGE_SAMPLE_RE = re.compile(r'^(rag|ingest)_stage_seconds_(sum|count)\{stage="(\w+)"\} (\S+)$')
+
+
+class Recorder:
+    """Latencies and failures per operation, from many threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.windows: Dict[str, List[float]] = {}  # operation -> [first start, last end]
+
+    def record(self, operation: str, started: float, ok: bool = True):
+        ended = time.perf_counter()
+        with self._lock:
+            window = self.windows.setdefault(operation, [started, ended])
+            window[0] = min(window[0], started)
+            window[1] = max(window[1], ended)
+            if ok:
+                self.latencies.setdefault(operation, []).append(ended - started)
+            else:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+
+    def summary(self) -> Dict[str, dict]:
+        result = {}
+        for operation in sorted(self.windows):
+            latencies = np.asarray(self.latencies.get(operation, []), dtype=np.float64) * 1000.0
+            elapsed = self.windows[operation][1] - self.windows[operation][0]
+            result[operation] = {
+                "count": int(len(latencies)),
+                "errors": self.errors.get(operation, 0),
+                "elapsed_seconds": round(elapsed, 3),
+                "throughput_per_second": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+                "latency_ms": {
+                    "mean": round(float(latencies.mean()), 2) if len(latencies) else None,
+                    "p50": round(float(np.percentile(latencies, 50)), 2) if len(latencies) else None,
+                    "p95": round(float(np.percentile(latencies, 95)), 2) if len(latencies) else None,
+                    "p99": round(float(np.percentile(latencies, 99)), 2) if len(latencies) else None,
+                    "max": round(float(latencies.max()), 2) if len(latencies) else None,
+                },
+            }
+        return result
+
+
+_sessions = threading.local()
+
+
+def session() -> requests.Session:
+    if not hasattr(_sessions, "session"):
+        _sessions.session = requests.Session()
+    return _sessions.session
+
+
+def upload(base_url: str, path: Path, recorder: Recorder, retries: int = 20) -> Optional[dict]:
+    """Upload one document, retrying while the ingestion queue is full; returns the job to wait for"""
+    for _ in range(retries):
+        started = time.perf_counter()
+        try:
+            with open(path, "rb") as f:
+                response = session().post(f"{base_url}/api/documents/upload", files={"file": (path.name, f)},
+                                          timeout=300)
+        except requests.RequestException:
+            recorder.record("upload", started, ok=False)
+            return None
+        if response.status_code == 503:
+            recorder.record("upload_rejected_busy", started)
+            time.sleep(1.0)
+            continue
+        recorder.record("upload", started, ok=response.ok)
+        if not response.ok:
+            return None
+        body = response.json()
+        return {"job_id": body.get("job_id"), "submitted": started}
+    return None
+
+
+def wait_for_jobs(base_url: str, jobs: List[dict], recorder: Recorder, timeout: float):
+    """Poll ingestion jobs until they finish, recording upload-to-completion time as "ingest" """
+    pending = [job for job in jobs if job and job["job_id"]]
+    deadline = time.perf_counter() + timeout
+    while pending and time.perf_counter() < deadline:
+        still_pending = []
+        for job in pending:
+            try:
+                state = session().get(f"{base_url}/api/documents/jobs/{job['job_id']}", timeout=30).json()["state"]
+            except (requests.RequestException, ValueError, KeyError):
+                state = "unknown"
+            if state == "completed":
+                recorder.record("ingest", job["submitted"])
+            elif state == "failed":
+                recorder.record("ingest", job["submitted"], ok=False)
+            else:
+                still_pending.append(job)
+        pending = still_pending
+        time.sleep(0.2)
+    for job in pending:
+        recorder.record("ingest", job["submitted"], ok=False)
+
+
+def chat(base_url: str, question: str, recorder: Recorder, stream: bool):
+    started = time.perf_counter()
+    try:
+        if not stream:
+            response = session().post(f"{base_url}/api/chat/", json={"message": question}, timeout=300)
+            recorder.record("chat", started, ok=response.ok)
+            return
+        with session().post(f"{base_url}/api/chat/stream", json={"message": question}, stream=True,
+                            timeout=300) as response:
+            first_token = True
+            ok = response.ok
+            for line in response.iter_lines(decode_unicode=True):
+                if line == "event: token" and first_token:
+                    recorder.record("chat_first_token", started)
+                    first_token = False
+                elif line == "event: error":
+                    ok = False
+            recorder.record("chat_stream", started, ok=ok)
+    except requests.RequestException:
+        recorder.record("chat_stream" if stream else "chat", started, ok=False)
+
+
+def run_uploads(base_url: str, documents: List[Path], concurrency: int, recorder: Recorder, timeout: float):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        jobs = list(pool.map(lambda path: upload(base_url, path, recorder), documents))
+    wait_for_jobs(base_url, jobs, recorder, timeout)
+
+
+def run_chats(base_url: str, questions: List[str], total: int, concurrency: int, recorder: Recorder, stream: bool):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda i: chat(base_url, questions[i % len(questions)], recorder, stream), range(total)))
+
+
+class RSSMonitor:
+    """Peak resident memory of a local process, from /proc (Linux)"""
+
+    supported = sys.platform.startswith("linux")
+
+    def __init__(self, pid: int, interval: float = 0.25):
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _read(self, field: str) -> int:
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith(field + ":"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return 0
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_kb = max(self.peak_kb, self._read("VmRSS"))
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self) -> Optional[float]:
+        """Peak RSS in MB (the kernel's high-water mark when available), None if unknown"""
+        self.peak_kb = max(self.peak_kb, self._read("VmHWM"))
+        self._stop.set()
+        return round(self.peak_kb / 1024.0, 1) if self.peak_kb else None
+
+
+def driver_peak_rss_mb() -> Optional[float]:
+    """Peak RSS of this process in MB, None where getrusage is unavailable (Windows)"""
+    if sys.platform == "win32":
+        return None
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0), 1)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url: str, timeout: float, process: subprocess.Popen) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            if requests.get(url, timeout=2).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def stage_means(base_url: str) -> Dict[str, float]:
+    """Mean milliseconds per rag_* and ingest_* pipeline stage, from the server's /metrics"""
+    try:
+        response = requests.get(f"{base_url}/metrics", timeout=10)
+    except requests.RequestException:
+        return {}
+    if not response.ok:
+        return {}
+    sums, counts = {}, {}
+    for line in response.text.splitlines():
+        match = _STAGE_SAMPLE_RE.match(line)
+        if match:
+            kind, field, stage, value = match.groups()
+            (sums if field == "sum" else counts)[f"{kind}.{stage}"] = float(value)
+    return {key: round(sums[key] / counts[key] * 1000.0, 2) for key in sorted(sums) if counts.get(key)}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report: dict):
+    print(f"\n{'operation':<22}{'count':>7}{'errors':>8}{'per sec':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for operation, stats in report["results"].items():
+        latency = stats["latency_ms"]
+        cells = [latency[key] if latency[key] is not None else "-" for key in ("p50", "p95", "p99")]
+        print(f"{operation:<22}{stats['count']:>7}{stats['errors']:>8}{stats['throughput_per_second']:>10}"
+              f"{cells[0]:>10}{cells[1]:>10}{cells[2]:>10}")
+    server, driver = (f"{mb} MB" if mb is not None else "unavailable"
+                      for mb in (report["server_peak_rss_mb"], report["driver_peak_rss_mb"]))
+    print(f"server peak RSS: {server}, driver peak RSS: {driver}")
+    for stage, mean in report["stage_means_ms"].items():
+        print(f"  {stage:<28}{mean:>10} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="backend to test (ignored with --spawn)")
+    parser.add_argument("--spawn", action="store_true", help="start the backend in a scratch directory")
+    parser.add_argument("--workdir", help="data directory for the spawned backend (default: a new temp dir)")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="environment for the spawned backend, e.g. VECTOR_STORE_BACKEND=numpy")
+    parser.add_argument("--stub", action="store_true", help="start bench.stub_openai and point the backend at it")
+    parser.add_argument("--stub-embedding-latency-ms", type=float, default=40.0)
+    parser.add_argument("--stub-chat-latency-ms", type=float, default=400.0)
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--corpus", default="bench_corpus", help="directory made by bench.corpus")
+    parser.add_argument("--uploads", type=int, help="documents to upload (default: all in the corpus)")
+    parser.add_argument("--upload-concurrency", type=int, default=4)
+    parser.add_argument("--chats", type=int, default=200, help="chat requests to send")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent chat requests")
+    parser.add_argument("--questions", help="one question per line (default: questions.txt in the corpus)")
+    parser.add_argument("--stream", action="store_true", help="use /api/chat/stream and record time to first token")
+    parser.add_argument("--mixed", action="store_true", help="send chats while uploads are being ingested")
+    parser.add_argument("--ingest-timeout", type=float, default=1800.0)
+    parser.add_argument("--label", default="", help="free-form name stored with the results")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    corpus = Path(args.corpus)
+    documents = sorted(p for p in corpus.iterdir() if p.suffix.lower() in DOCUMENT_SUFFIXES)[:args.uploads]
+    questions_path = Path(args.questions) if args.questions else corpus / "questions.txt"
+    questions = [line.strip() for line in questions_path.read_text(encoding="utf-8").splitlines() if line.strip()]
+
+    processes = []
+    base_url = args.url.rstrip("/")
+    monitor = None
+    try:
+        if args.spawn:
+            workdir = Path(args.workdir or tempfile.mkdtemp(prefix="bench-"))
+            workdir.mkdir(parents=True, exist_ok=True)
+            env = dict(os.environ, PYTHONPATH=str(BACKEND_DIR))
+            if args.stub:
+                stub_port = free_port()
+                stub = subprocess.Popen(
+                    [sys.executable, "-m", "bench.stub_openai", "--port", str(stub_port),
+                     "--embedding-latency-ms", str(args.stub_embedding_latency_ms),
+                     "--chat-latency-ms", str(args.stub_chat_latency_ms),
+                     "--error-rate", str(args.stub_error_rate)],
+                    cwd=BACKEND_DIR, env=env)
+                processes.append(stub)
+                if not wait_for(f"http://127.0.0.1:{stub_port}/docs", 60, stub):
+                    raise SystemExit("OpenAI stub did not start")
+                env.update(OPENAI_API_KEY="stub", OPENAI_BASE_URL=f"http://127.0.0.1:{stub_port}/v1")
+            env.update(item.split("=", 1) for item in args.env)
+            port = free_port()
+            log = open(workdir / "backend.log", "w")
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+                cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+            processes.append(server)
+            base_url = f"http://127.0.0.1:{port}"
+            monitor = RSSMonitor(server.pid).start() if RSSMonitor.supported else None
+            print(f"Backend starting in {workdir} (log: {workdir / 'backend.log'})")
+            if not wait_for(f"{base_url}/api/ready", 600, server):
+                raise SystemExit(f"Backend did not become ready, see {workdir / 'backend.log'}")
+
+        recorder = Recorder()
+        started = time.perf_counter()
+        print(f"Uploading {len(documents)} documents, then {args.chats} chats at concurrency {args.concurrency}"
+              + (" (mixed)" if args.mixed else ""))
+        if args.mixed:
+            uploads = threading.Thread(target=run_uploads, args=(base_url, documents, args.upload_concurrency,
+                                                                 recorder, args.ingest_timeout))
+            uploads.start()
+            run_chats(base_url, questions, args.chats, args.concurrency, recorder, args.stream)
+            uploads.join()
+        else:
+            run_uploads(base_url, documents, args.upload_concurrency, recorder, args.ingest_timeout)
+            run_chats(base_url, questions, args.chats, args.concurrency, recorder, args.stream)
+
+        report = {
+            "label": args.label,
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "config": {key: value for key, value in vars(args).items() if key not in ("json",)},
+            "corpus": {"documents": len(documents), "bytes": sum(p.stat().st_size for p in documents),
+                       "questions": len(questions)},
+            "wall_seconds": round(time.perf_counter() - started, 3),
+            "results": recorder.summary(),
+            "server_peak_rss_mb": monitor.stop() if monitor else None,
+            "driver_peak_rss_mb": driver_peak_rss_mb(),
+            "stage_means_ms": stage_means(base_url),
+        }
+        print_report(report)
+        if args.json:
+            Path(args.json).parent.mkdir(parents=True, exist_ok=True)
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            print(f"Results written to {args.json}")
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    main()
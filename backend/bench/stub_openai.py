@@ -0,0 +1,155 @@
+"""Local stand-in for the OpenAI embeddings and chat completions endpoints
+
+Run from the backend directory:
+
+    python -m bench.stub_openai --port 8100 --embedding-latency-ms 40 --chat-latency-ms 400
+
+and point the backend at it (the OpenAI SDK reads OPENAI_BASE_URL):
+
+    OPENAI_API_KEY=stub OPENAI_BASE_URL=http://127.0.0.1:8100/v1 python -m uvicorn app.main:app
+
+Embeddings are deterministic hashed bag-of-words vectors, so similar texts get
+similar vectors and retrieval behaves sensibly. Chat answers quote the start of
+the prompt's document content; streamed answers arrive word by word after the
+first-token latency. --error-rate makes a share of requests fail with 500 to
+exercise the backend's fallbacks.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Set from the command line in main()
+CONFIG = {
+    "embedding_latency_ms": 40.0,
+    "embedding_latency_per_input_ms": 0.5,
+    "chat_latency_ms": 400.0,
+    "token_latency_ms": 15.0,
+    "dimensions": 1536,
+    "error_rate": 0.0,
+}
+
+_WORD_RE = re.compile(r'\w+')
+
+app = FastAPI(title="OpenAI stub")
+
+
+def embed(text: str, dimensions: int) -> list:
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in _WORD_RE.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+        slot = int.from_bytes(digest[:4], "little") % dimensions
+        vector[slot] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return vector.tolist()
+
+
+def _fail() -> bool:
+    return random.random() < CONFIG["error_rate"]
+
+
+def _error():
+    return JSONResponse(status_code=500, content={"error": {"message": "stub failure", "type": "server_error"}})
+
+
+def _answer(messages: list) -> str:
+    prompt = messages[-1]["content"] if messages else ""
+    content = prompt.split("Document Content:", 1)[-1]
+    words = content.split()[:40]
+    return " ".join(words) or "I don't know."
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    await asyncio.sleep((CONFIG["embedding_latency_ms"]
+                         + CONFIG["embedding_latency_per_input_ms"] * len(inputs)) / 1000.0)
+    if _fail():
+        return _error()
+    dimensions = body.get("dimensions") or CONFIG["dimensions"]
+    tokens = sum(len(text.split()) for text in inputs)
+    return {
+        "object": "list",
+        "data": [{"object": "embedding", "index": i, "embedding": embed(text, dimensions)}
+                 for i, text in enumerate(inputs)],
+        "model": body.get("model", "text-embedding-3-small"),
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "gpt-3.5-turbo")
+    answer = _answer(body.get("messages", []))
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+    await asyncio.sleep(CONFIG["chat_latency_ms"] / 1000.0)
+    if _fail():
+        return _error()
+
+    if not body.get("stream"):
+        await asyncio.sleep(CONFIG["token_latency_ms"] * len(answer.split()) / 1000.0)
+        prompt_tokens = sum(len(m["content"].split()) for m in body.get("messages", []))
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": answer},
+                         "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(answer.split()),
+                      "total_tokens": prompt_tokens + len(answer.split())},
+        }
+
+    def chunk(delta: dict, finish_reason=None) -> str:
+        event = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                 "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+        return f"data: {json.dumps(event)}\n\n"
+
+    async def events():
+        yield chunk({"role": "assistant", "content": ""})
+        for piece in re.findall(r'\S+\s*', answer):
+            yield chunk({"content": piece})
+            await asyncio.sleep(CONFIG["token_latency_ms"] / 1000.0)
+        yield chunk({}, "stop")
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--embedding-latency-ms", type=float, default=CONFIG["embedding_latency_ms"])
+    parser.add_argument("--embedding-latency-per-input-ms", type=float,
+                        default=CONFIG["embedding_latency_per_input_ms"])
+    parser.add_argument("--chat-latency-ms", type=float, default=CONFIG["chat_latency_ms"],
+                        help="time to the first token")
+    parser.add_argument("--token-latency-ms", type=float, default=CONFIG["token_latency_ms"])
+    parser.add_argument("--dimensions", type=int, default=CONFIG["dimensions"])
+    parser.add_argument("--error-rate", type=float, default=CONFIG["error_rate"])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    for key in CONFIG:
+        CONFIG[key] = getattr(args, key)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import math
+
+import pytest
+
+from app.services.answer_cache import AnswerCache
+
+QUESTION = [1.0, 0.0, 0.0]
+
+
+def _at_similarity(similarity: float):
+    """A question embedding with the given cosine similarity to QUESTION"""
+    return [similarity, math.sqrt(1 - similarity ** 2), 0.0]
+
+
+@pytest.fixture
+def cache():
+    cache = AnswerCache(threshold=0.95)
+    cache.store(QUESTION, "complete graph", 1, "A complete graph joins every pair of vertices.", ["doc"])
+    return cache
+
+
+@pytest.mark.parametrize("similarity, hit", [
+    (1.0, True),
+    (0.97, True),
+    (0.951, True),
+    (0.949, False),
+    (0.5, False),
+])
+def test_similarity_threshold(cache, similarity, hit):
+    found = cache.lookup(_at_similarity(similarity), "complete graph", 1)
+
+    assert (found is not None) == hit
+    if hit:
+        assert found == ("A complete graph joins every pair of vertices.", ["doc"])
+
+
+def test_primary_term_must_match(cache):
+    assert cache.lookup(QUESTION, "complete path", 1) is None
+    assert cache.lookup(QUESTION, "complete graph", 1) is not None
+
+
+def test_new_corpus_version_empties_the_cache(cache):
+    assert cache.lookup(QUESTION, "complete graph", 2) is None
+    assert len(cache) == 0
+    assert cache.lookup(QUESTION, "complete graph", 1) is None
+
+
+def test_stale_corpus_version_leaves_the_cache_alone(cache):
+    cache.lookup(QUESTION, "complete graph", 2)
+    cache.store(QUESTION, "complete graph", 2, "Current answer", ["doc"])
+
+    assert cache.lookup(QUESTION, "complete graph", 1) is None
+    cache.store(QUESTION, "complete graph", 1, "Stale answer", ["doc"])
+
+    assert cache.lookup(QUESTION, "complete graph", 2) == ("Current answer", ["doc"])
+    assert cache.stats()["corpus_version"] == 2
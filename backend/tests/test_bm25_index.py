@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+from app.services.bm25_index import BM25Index, reciprocal_rank_fusion
+from app.services.document_processor import DocumentProcessor
+from app.services.vector_store import NumpyVectorStore
+
+CORPUS = {
+    "trees": [
+        "A tree is a connected graph without cycles.",
+        "Every tree with n vertices has n - 1 edges.",
+    ],
+    "complete": [
+        "A complete graph joins every pair of distinct vertices by an edge.",
+        "The complete graph on n vertices is written K_n; a complete graph is also a regular graph.",
+    ],
+    "coloring": [
+        "A proper coloring gives adjacent vertices different colors.",
+    ],
+}
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = BM25Index(str(tmp_path / "bm25.sqlite3"))
+    for document_id, texts in CORPUS.items():
+        index.add(document_id, [f"{document_id}-{i}" for i in range(len(texts))], texts)
+    return index
+
+
+def _ids(index: BM25Index, query: str, n_results: int = 10):
+    return [chunk_id for chunk_id, _ in index.search(query, n_results)]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("complete graph", ["complete-1", "complete-0", "trees-0"]),
+    ("tree edges", ["trees-1", "trees-0"]),
+    ("adjacent colors", ["coloring-0"]),
+    ("hamiltonian", []),
+    # Stopwords are neither indexed nor searched
+    ("the of and", []),
+])
+def test_ranking(index, query, expected):
+    assert _ids(index, query) == expected
+
+
+def test_n_results_keeps_the_best(index):
+    assert _ids(index, "complete graph", n_results=1) == ["complete-1"]
+
+
+def test_deleted_document_is_not_found(index, tmp_path):
+    index.delete_document("complete")
+
+    assert len(index) == 3
+    assert _ids(index, "complete graph") == ["trees-0"]
+    # Other processes read the same postings
+    assert _ids(BM25Index(str(tmp_path / "bm25.sqlite3")), "complete graph") == ["trees-0"]
+
+
+def test_adding_a_chunk_twice_indexes_it_once(index):
+    index.add("trees", ["trees-0"], [CORPUS["trees"][0]])
+
+    assert len(index) == 5
+    assert _ids(index, "cycles") == ["trees-0"]
+
+
+def test_terms_above_the_df_cutoff_are_skipped(tmp_path):
+    index = BM25Index(str(tmp_path / "bm25.sqlite3"), max_df_ratio=0.1)
+    texts = [f"graph number {i}" for i in range(60)] + ["graph with an eigenvalue"]
+    index.add("doc", [f"doc-{i}" for i in range(len(texts))], texts)
+
+    # In 61 of 61 chunks, above the cutoff of max(50, 61 * 0.1)
+    assert _ids(index, "graph") == []
+    assert _ids(index, "graph eigenvalue") == ["doc-60"]
+
+
+def test_common_terms_score_in_small_corpora(index):
+    # "graph" is in 3 of 5 chunks, but corpora below the minimum cutoff keep every term
+    assert len(_ids(index, "graph")) == 3
+
+
+@pytest.mark.parametrize("rankings, expected", [
+    ([["a", "b", "c"]], ["a", "b", "c"]),
+    # Found by both rankings beats first place in one of them
+    ([["a", "b", "c"], ["c", "d"]], ["c", "a", "b", "d"]),
+    ([["a", "b"], ["b", "a"]], ["a", "b"]),
+    ([[], ["x"]], ["x"]),
+    ([], []),
+])
+def test_reciprocal_rank_fusion(rankings, expected):
+    assert reciprocal_rank_fusion(rankings) == expected
+
+
+def test_search_fuses_lexical_only_matches(tmp_path):
+    """A chunk far from the query embedding still comes back when its terms match exactly"""
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((30, 16)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids = [f"doc-{i}" for i in range(30)]
+    texts = [f"filler chunk {i}" for i in range(29)] + ["the eigenvalue of the adjacency matrix"]
+
+    processor = DocumentProcessor.__new__(DocumentProcessor)
+    processor.vector_store = NumpyVectorStore(tmp_path / "vector_store")
+    processor.vector_store.add(ids, vectors.tolist(), texts, [{"document_id": "doc", "chunk_index": i}
+                                                             for i in range(30)])
+    processor.bm25_index = BM25Index(str(tmp_path / "bm25.sqlite3"))
+    processor.bm25_index.add("doc", ids, texts)
+
+    # Closest to doc-0, farthest from doc-29
+    query_embedding = vectors[0] - vectors[29]
+    query_embedding /= np.linalg.norm(query_embedding)
+    results = processor._search("eigenvalue", query_embedding.tolist(), n_results=3)
+
+    chunks = [chunk for chunk, _ in results]
+    assert len(results) == 3
+    assert [chunk.chunk_index for chunk in chunks[:2]] == [0, 29]
+    distance = results[1][1]
+    assert distance == pytest.approx(float(np.sum((vectors[29] - query_embedding) ** 2)), abs=1e-5)
+    assert str(chunks[1]) == texts[29]
@@ -0,0 +1,20 @@
+from app.services.context_compactor import ContextCompactor
+
+SHORT = "a complete graph is a simple graph in which every pair of distinct vertices is joined by an edge"
+# Contains every shingle of SHORT, but most of it is text found nowhere else
+LONG = SHORT + " " + " ".join(f"word{i}" for i in range(400))
+
+
+def test_long_chunk_containing_a_short_one_is_kept():
+    compacted = ContextCompactor().compact([SHORT, LONG])
+
+    assert compacted.chunks == [SHORT, LONG]
+    assert compacted.duplicates == 0
+    assert compacted.tokens_saved == 0
+
+
+def test_short_chunk_contained_in_a_long_one_is_dropped():
+    compacted = ContextCompactor().compact([LONG, SHORT])
+
+    assert compacted.chunks == [LONG]
+    assert compacted.duplicates == 1
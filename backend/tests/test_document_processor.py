@@ -0,0 +1,106 @@
+import pytest
+
+from app.services.document_processor import DocumentProcessor, PageOffsets
+
+
+def _reference_chunk_text(text: str, chunk_size: int = 1500, overlap: int = 300):
+    """chunk_text as it was before chunking streamed, the output iter_chunks must keep"""
+    chunks = []
+    current_chunk = []
+    for para in text.split('\n\n'):
+        para_words = para.split()
+        if len(para_words) > chunk_size:
+            if current_chunk:
+                chunks.append(" ".join(current_chunk))
+                current_chunk = []
+            for i in range(0, len(para_words), chunk_size - overlap):
+                chunks.append(" ".join(para_words[i:i + chunk_size]))
+        else:
+            if len(current_chunk) + len(para_words) > chunk_size and current_chunk:
+                chunks.append(" ".join(current_chunk))
+                overlap_words = min(overlap // 10, len(current_chunk))
+                current_chunk = current_chunk[-overlap_words:] if overlap_words > 0 else []
+            current_chunk.extend(para_words)
+    if current_chunk:
+        chunks.append(" ".join(current_chunk))
+    return chunks
+
+
+def _words(count: int, prefix: str = "w") -> str:
+    return " ".join(f"{prefix}{i}" for i in range(count))
+
+
+def _chunk_texts(pieces, chunk_size, overlap):
+    return [chunk.text for chunk in DocumentProcessor.iter_chunks(pieces, chunk_size, overlap)]
+
+
+CHUNKER_CASES = [
+    # (text, chunk_size, overlap)
+    ("", 20, 10),
+    ("   \n\n \t \n", 20, 10),
+    (_words(5), 20, 10),
+    (_words(20), 20, 10),
+    # Paragraphs packed into chunks, the last overlap // 10 words carried over
+    ("\n\n".join(_words(8, f"p{i}_") for i in range(12)), 40, 30),
+    # A paragraph larger than chunk_size is cut into overlapping windows
+    (_words(57), 20, 5),
+    (_words(8, "a") + "\n\n" + _words(45, "b") + "\n\n" + _words(8, "c"), 20, 5),
+    # Odd whitespace: runs of blank lines, tabs, trailing spaces
+    ("one two\n\n\n\nthree\tfour  \n five\n\n\n six ", 3, 1),
+    (_words(12) + "\n" + _words(12, "x"), 10, 2),
+]
+
+
+@pytest.mark.parametrize("text, chunk_size, overlap", CHUNKER_CASES)
+def test_chunks_match_the_original_chunker(text, chunk_size, overlap):
+    assert _chunk_texts([text], chunk_size, overlap) == _reference_chunk_text(text, chunk_size, overlap)
+
+
+@pytest.mark.parametrize("text, chunk_size, overlap", CHUNKER_CASES)
+def test_chunks_do_not_depend_on_how_the_text_is_split(text, chunk_size, overlap):
+    pieces = [text[i:i + 7] for i in range(0, len(text), 7)]
+    assert _chunk_texts(pieces, chunk_size, overlap) == _chunk_texts([text], chunk_size, overlap)
+
+
+@pytest.mark.parametrize("text", ["", " ", "\n\n", "\t\n \n\n  "])
+def test_empty_input_has_no_chunks(text):
+    assert list(DocumentProcessor.iter_chunks([text])) == []
+    assert list(DocumentProcessor.iter_chunks([])) == []
+
+
+def test_chunk_spans_index_the_concatenated_text():
+    pieces = ["alpha beta\n", "gamma\n\n", "delta epsilon\n"]
+    text = "".join(pieces)
+    for chunk in DocumentProcessor.iter_chunks(pieces, chunk_size=2, overlap=0):
+        assert " ".join(text[chunk.start:chunk.end].split()) == chunk.text
+
+
+@pytest.mark.parametrize("pages, chunk_size, expected", [
+    # A page ending in a paragraph break closes its chunk
+    ([(1, _words(4, "a") + "\n"), (2, _words(4, "b"))], 4, [(1, 1), (2, 2)]),
+    # Otherwise the paragraph carries on over the page break and is windowed across it
+    ([(1, _words(4, "a")), (2, _words(4, "b"))], 4, [(1, 1), (1, 2), (2, 2)]),
+    ([(1, _words(3, "a")), (2, _words(3, "b")), (3, _words(3, "c"))], 4, [(1, 2), (2, 3), (3, 3)]),
+    # An empty page in between is skipped over
+    ([(1, _words(2, "a")), (2, ""), (3, _words(2, "c"))], 4, [(1, 3)]),
+    # Page numbers come from the document, not the position
+    ([(5, _words(2, "a")), (9, _words(2, "b"))], 3, [(5, 9), (9, 9)]),
+])
+def test_chunk_pages(pages, chunk_size, expected):
+    page_offsets = PageOffsets()
+
+    def page_texts():
+        for page_num, page_text in pages:
+            page_offsets.add(page_num, page_text)
+            yield page_text + "\n"
+
+    chunks = DocumentProcessor.iter_chunks(page_texts(), chunk_size=chunk_size, overlap=1)
+    assert [(page_offsets.page_at(chunk.start), page_offsets.page_at(chunk.end - 1)) for chunk in chunks] == expected
+
+
+def test_page_at_boundaries():
+    page_offsets = PageOffsets()
+    page_offsets.add(1, "abc")   # offsets 0-2, newline at 3
+    page_offsets.add(2, "de")    # offsets 4-5, newline at 6
+
+    assert [page_offsets.page_at(offset) for offset in range(7)] == [1, 1, 1, 1, 2, 2, 2]
@@ -0,0 +1,48 @@
+import threading
+
+import pytest
+
+from app.services.micro_batcher import MicroBatcher
+
+
+def test_cancelled_request_does_not_stop_the_worker():
+    release = threading.Event()
+
+    def double(items):
+        release.wait(5)
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(double, max_wait_ms=0)
+    running = batcher.submit([1])
+    # Queued behind the running batch, then abandoned by its caller
+    abandoned = batcher.submit([2])
+    assert abandoned.cancel()
+    release.set()
+
+    assert running.result(timeout=5) == [2]
+    assert batcher.submit([3]).result(timeout=5) == [6]
+    assert batcher._thread.is_alive()
+
+
+def test_failed_batch_reaches_only_its_callers():
+    def fail_on_zero(items):
+        if 0 in items:
+            raise ValueError("bad item")
+        return items
+
+    batcher = MicroBatcher(fail_on_zero, max_wait_ms=0)
+    failed = batcher.submit([0])
+    with pytest.raises(ValueError):
+        failed.result(timeout=5)
+    assert batcher.submit([1]).result(timeout=5) == [1]
+
+
+def test_close_runs_submitted_requests_then_stops():
+    batcher = MicroBatcher(lambda items: items, max_wait_ms=50)
+    pending = batcher.submit([1, 2])
+    batcher.close(timeout=5)
+
+    assert pending.result(timeout=0) == [1, 2]
+    assert not batcher._thread.is_alive()
+    with pytest.raises(RuntimeError):
+        batcher.submit([3])
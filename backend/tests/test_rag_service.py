@@ -0,0 +1,114 @@
+import asyncio
+from types import SimpleNamespace
+
+from app.services.rag_service import PreparedQuery, RAGService, StreamOutcome
+
+CHUNKS = ["A complete graph is a simple graph in which every pair of distinct vertices is joined by an edge."]
+QUESTION = "what is a complete graph"
+
+
+class _FailingCompletions:
+    async def create(self, **kwargs):
+        raise ConnectionError("LLM unavailable")
+
+
+class _FailingClient:
+    class chat:
+        completions = _FailingCompletions()
+
+
+def _service() -> RAGService:
+    service = RAGService()
+    service.async_openai_client = _FailingClient()
+    return service
+
+
+def _prepared() -> PreparedQuery:
+    return PreparedQuery(None, ["Uploaded Document"], CHUNKS, [1.0, 0.0], "complete graph", 1)
+
+
+def test_fallback_answer_is_not_cached():
+    service = _service()
+
+    answer, fallback = asyncio.run(service.agenerate_response(QUESTION, CHUNKS))
+    service._cache_answer(_prepared(), answer, fallback)
+
+    assert fallback
+    assert "complete graph" in answer.lower()
+    assert len(service.answer_cache) == 0
+
+
+def test_streamed_fallback_answer_is_flagged():
+    service = _service()
+    outcome = StreamOutcome()
+
+    async def collect():
+        return [piece async for piece in service.agenerate_response_stream(QUESTION, CHUNKS, outcome=outcome)]
+
+    answer = "".join(asyncio.run(collect()))
+
+    assert outcome.fallback
+    assert "complete graph" in answer.lower()
+
+
+def test_extractive_answer_without_llm_is_cached():
+    service = RAGService()
+    service.async_openai_client = None
+
+    answer, fallback = asyncio.run(service.agenerate_response(QUESTION, CHUNKS))
+    service._cache_answer(_prepared(), answer, fallback)
+
+    assert not fallback
+    assert len(service.answer_cache) == 1
+
+
+class _BrokenStream:
+    """Yields the given pieces, then fails like a dropped connection"""
+
+    def __init__(self, pieces):
+        self.pieces = list(pieces)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.pieces:
+            raise ConnectionError("stream interrupted")
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=self.pieces.pop(0)))])
+
+
+def _streaming_client(pieces):
+    class Completions:
+        async def create(self, **kwargs):
+            return _BrokenStream(pieces)
+
+    class Client:
+        class chat:
+            completions = Completions()
+
+    return Client()
+
+
+def _stream(service: RAGService, outcome: StreamOutcome) -> str:
+    async def collect():
+        return [piece async for piece in service.agenerate_response_stream(QUESTION, CHUNKS, outcome=outcome)]
+
+    return "".join(asyncio.run(collect()))
+
+
+def test_stream_failing_mid_answer_keeps_the_partial_answer():
+    service = RAGService()
+    service.async_openai_client = _streaming_client(["A complete graph ", "has an edge"])
+    outcome = StreamOutcome()
+
+    assert _stream(service, outcome) == "A complete graph has an edge"
+    assert outcome.fallback
+
+
+def test_stream_failing_before_any_text_uses_the_extractive_answer():
+    service = RAGService()
+    service.async_openai_client = _streaming_client([])
+    outcome = StreamOutcome()
+
+    assert "every pair of distinct vertices" in _stream(service, outcome)
+    assert outcome.fallback
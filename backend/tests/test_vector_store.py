@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from app.services.vector_store import NumpyVectorStore
+
+DIMENSIONS = 16
+
+
+def _vectors(count: int, seed: int) -> np.ndarray:
+    vectors = np.random.default_rng(seed).standard_normal((count, DIMENSIONS)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _add(store: NumpyVectorStore, document_id: str, vectors: np.ndarray):
+    ids = [f"{document_id}-{i}" for i in range(len(vectors))]
+    store.add(ids, vectors.tolist(), [f"text of {id_}" for id_ in ids], [{"document_id": document_id}] * len(ids))
+
+
+def _nearest_ids(store: NumpyVectorStore, vectors: np.ndarray):
+    return [hits[0].id if hits else None for hits in store.query(vectors.tolist(), n_results=1)]
+
+
+@pytest.fixture
+def store_dir(tmp_path):
+    return tmp_path / "vector_store"
+
+
+def test_compact_keeps_rows_another_worker_appended(store_dir):
+    first = NumpyVectorStore(store_dir)
+    other = NumpyVectorStore(store_dir)
+    _add(first, "a", _vectors(10, 1))
+    _add(first, "b", _vectors(10, 2))
+    # Deleted and appended by another worker after `first` last looked at the store
+    other.delete({"document_id": "a"})
+    _add(other, "c", _vectors(10, 3))
+
+    first.compact()
+
+    reopened = NumpyVectorStore(store_dir)
+    assert reopened.count() == 20
+    assert _nearest_ids(reopened, _vectors(10, 3)) == [f"c-{i}" for i in range(10)]
+    assert _nearest_ids(reopened, _vectors(10, 2)) == [f"b-{i}" for i in range(10)]
+
+
+def test_query_after_another_worker_compacts(store_dir):
+    first = NumpyVectorStore(store_dir)
+    other = NumpyVectorStore(store_dir)
+    _add(first, "a", _vectors(10, 1))
+    _add(first, "b", _vectors(10, 2))
+    other.refresh()
+
+    # Renumbers the rows behind the back of `first`, which has not refreshed
+    other.delete({"document_id": "a"})
+    other.compact()
+
+    assert _nearest_ids(first, _vectors(10, 2)) == [f"b-{i}" for i in range(10)]
+
+
+@pytest.mark.parametrize("quantization", ["none", "int8"])
+def test_query_skips_deleted_rows(store_dir, quantization):
+    store = NumpyVectorStore(store_dir, quantization=quantization)
+    _add(store, "a", _vectors(10, 1))
+    _add(store, "b", _vectors(10, 2))
+
+    store.delete({"document_id": "a"})
+
+    hits = store.query(_vectors(10, 1).tolist(), n_results=5)
+    assert all(len(query_hits) == 5 for query_hits in hits)
+    assert all(hit.metadata["document_id"] == "b" for query_hits in hits for hit in query_hits)
+    assert store.count() == 10
+    assert store.get(where={"document_id": "a"})["ids"] == []
+
+
+@pytest.mark.parametrize("quantization", ["none", "int8"])
+def test_query_after_compact_and_reopen(store_dir, quantization):
+    store = NumpyVectorStore(store_dir, quantization=quantization)
+    _add(store, "a", _vectors(10, 1))
+    _add(store, "b", _vectors(10, 2))
+    _add(store, "c", _vectors(10, 3))
+
+    store.delete({"document_id": "b"})
+    store.compact()
+    expected = [f"a-{i}" for i in range(10)] + [f"c-{i}" for i in range(10)]
+    queries = np.concatenate([_vectors(10, 1), _vectors(10, 3)])
+    assert _nearest_ids(store, queries) == expected
+
+    reopened = NumpyVectorStore(store_dir, quantization=quantization)
+    assert reopened.count() == 20
+    assert _nearest_ids(reopened, queries) == expected
+    assert reopened.get(ids=["c-3"], include_embeddings=True)["embeddings"][0] == pytest.approx(
+        _vectors(10, 3)[3].tolist(), abs=1e-6)
+
+
+def test_int8_recall_matches_float32(tmp_path):
+    vectors = _vectors(2000, 4)
+    queries = _vectors(50, 5)
+    results = {}
+    for quantization in ("none", "int8"):
+        store = NumpyVectorStore(tmp_path / quantization, quantization=quantization)
+        _add(store, "doc", vectors)
+        results[quantization] = [[hit.id for hit in hits] for hits in store.query(queries.tolist(), n_results=10)]
+
+    found = sum(len(set(exact) & set(approximate)) for exact, approximate in zip(results["none"], results["int8"]))
+    assert found / (10 * len(queries)) >= 0.95
+
+
+def test_unsupported_quantization_is_rejected(store_dir):
+    with pytest.raises(ValueError):
+        NumpyVectorStore(store_dir, quantization="float16")
@@ -0,0 +1 @@
+# Maintenance and evaluation scripts
@@ -0,0 +1,115 @@
+"""Measure recall@k of compact embedding settings against full-precision search
+
+Uses the vectors already indexed in the vector store. Run from the backend directory:
+
+    python -m tools.embedding_recall --k 10 --samples 200
+    python -m tools.embedding_recall --queries questions.txt --json recall.json
+
+Queries are either lines of a text file (embedded with the configured model)
+or a random sample of indexed chunks (each chunk is excluded from its own
+results). Dimension truncation is only meaningful for Matryoshka-trained
+models such as OpenAI's text-embedding-3 family.
+"""
+import argparse
+import json
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from app.services.document_processor import get_document_processor
+from app.services.embedding_compression import (
+    QUANTIZATION_MODES, QuantizedMatrix, search_with_rescoring, top_k, truncate_embeddings
+)
+
+
+def load_embeddings(processor, page_size: int = 5000) -> np.ndarray:
+    rows = []
+    offset = 0
+    while True:
+        result = processor.vector_store.get(limit=page_size, offset=offset, include_embeddings=True)
+        embeddings = result.get("embeddings")
+        if embeddings is None or len(embeddings) == 0:
+            break
+        rows.extend(embeddings)
+        offset += len(embeddings)
+    return truncate_embeddings(np.asarray(rows, dtype=np.float32), 0)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+def recall_at_k(matrix: np.ndarray, queries: np.ndarray, exclude: List[int], k: int,
+                dimensions: int, mode: str, rescore_factor: int) -> Tuple[float, float]:
+    """Mean recall@k and mean search time per query in milliseconds"""
+    stored = truncate_embeddings(matrix, dimensions)
+    index = QuantizedMatrix.from_float(stored, mode)
+    total = 0.0
+    search_seconds = 0.0
+    for query, skip in zip(queries, exclude):
+        # +1 so a sampled chunk can be dropped from its own results
+        baseline = [int(row) for row in top_k(matrix @ query, k + 1) if row != skip][:k]
+        start = time.perf_counter()
+        results = search_with_rescoring(index, lambda rows: stored[rows], truncate_embeddings(query, dimensions),
+                                        k + 1, rescore_factor)
+        search_seconds += time.perf_counter() - start
+        found = [row for row, _ in results if row != skip][:k]
+        total += len(set(baseline) & set(found)) / max(1, len(baseline))
+    count = max(1, len(queries))
+    return total / count, search_seconds * 1000.0 / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--samples", type=int, default=200, help="indexed chunks used as queries")
+    parser.add_argument("--queries", help="text file with one question per line")
+    parser.add_argument("--dimensions", type=int, nargs="*", help="truncation sizes to test")
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    processor = get_document_processor()
+    matrix = normalize(load_embeddings(processor))
+    if len(matrix) == 0:
+        print("No embeddings indexed - upload documents first")
+        return
+    full_dims = matrix.shape[1]
+    print(f"{len(matrix)} vectors x {full_dims} dimensions ({processor.embedding_model_name})")
+
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+        queries = normalize(np.asarray(processor.get_embeddings(questions), dtype=np.float32))
+        exclude = [-1] * len(queries)
+    else:
+        rng = np.random.default_rng(args.seed)
+        sample = rng.choice(len(matrix), size=min(args.samples, len(matrix)), replace=False)
+        queries = matrix[sample]
+        exclude = [int(row) for row in sample]
+
+    dimensions = args.dimensions or [d for d in (full_dims, 1024, 512, 256, 128) if d <= full_dims]
+    results = []
+    print(f"{'dims':>6} {'quant':>8} {'rescore':>8} {'bytes/vec':>10} {'recall@' + str(args.k):>10} {'ms/query':>9}")
+    for dims in sorted(set(dimensions), reverse=True):
+        for mode in QUANTIZATION_MODES:
+            for rescore in ([1] if mode == "none" else [1, args.rescore_factor]):
+                recall, ms_per_query = recall_at_k(matrix, queries, exclude, args.k,
+                                     0 if dims == full_dims else dims, mode, rescore)
+                bytes_per_vector = dims * {"none": 4, "float16": 2, "int8": 1}[mode] + (4 if mode == "int8" else 0)
+                results.append({"dimensions": dims, "quantization": mode, "rescore_factor": rescore,
+                                "bytes_per_vector": bytes_per_vector, f"recall_at_{args.k}": round(recall, 4),
+                                "ms_per_query": round(ms_per_query, 3)})
+                print(f"{dims:>6} {mode:>8} {rescore:>8} {bytes_per_vector:>10} {recall:>10.4f} {ms_per_query:>9.2f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"vectors": len(matrix), "model": processor.embedding_model_name, "k": args.k,
+                       "queries": len(queries), "results": results}, f, indent=2)
+        print(f"Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -49,6 +49,19 @@ function App() {
         }
       );
 
+      // Processing happens in the background - poll the job until it finishes
+      let job = { state: response.data.status };
+      while (job.state === 'queued' || job.state === 'running') {
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        const jobResponse = await axios.get(`${API_BASE_URL}/api/documents/jobs/${response.data.job_id}`);
+        job = jobResponse.data;
+      }
+
+      if (job.state === 'failed') {
+        addMessage('assistant', `❌ Error processing document: ${job.error || 'Unknown error occurred'}`);
+        return;
+      }
+
       addMessage('assistant', `✅ Document "${response.data.filename}" uploaded and processed successfully! You can now ask questions about it.`);
     } catch (error) {
       console.error('Upload error:', error);
@@ -87,35 +100,82 @@ function App() {
     addMessage('user', userMessage);
     setLoading(true);
 
+    // Abort if nothing arrives for 60 seconds
+    const controller = new AbortController();
+    let timeoutId = setTimeout(() => controller.abort(), 60000);
+    let started = false;
+
     try {
-      const response = await axios.post(`${API_BASE_URL}/api/chat/`, {
-        message: userMessage,
-        conversation_id: conversationId,
-      }, {
-        timeout: 60000, // 60 seconds timeout
+      const response = await fetch(`${API_BASE_URL}/api/chat/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          message: userMessage,
+          conversation_id: conversationId,
+        }),
+        signal: controller.signal,
       });
 
-      addMessage('assistant', response.data.response);
-      
-      if (!conversationId) {
-        setConversationId(response.data.conversation_id);
+      if (!response.ok) {
+        const data = await response.json().catch(() => ({}));
+        throw new Error(data.detail || `Server error: ${response.status}`);
+      }
+
+      // Server-sent events: "token" events append to the answer, "done" carries the conversation id
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        clearTimeout(timeoutId);
+        timeoutId = setTimeout(() => controller.abort(), 60000);
+        buffer += decoder.decode(value, { stream: true });
+
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        for (const rawEvent of events) {
+          const eventName = rawEvent.match(/^event: (.*)$/m)?.[1];
+          const dataLine = rawEvent.match(/^data: (.*)$/m)?.[1];
+          if (!eventName || !dataLine) continue;
+          const data = JSON.parse(dataLine);
+
+          if (eventName === 'token') {
+            if (!started) {
+              // First token: replace the typing indicator with the answer being written
+              started = true;
+              setLoading(false);
+              addMessage('assistant', data.text);
+            } else {
+              setMessages((prev) => {
+                const last = prev[prev.length - 1];
+                return [...prev.slice(0, -1), { ...last, content: last.content + data.text }];
+              });
+            }
+          } else if (eventName === 'done') {
+            if (!conversationId) {
+              setConversationId(data.conversation_id);
+            }
+          } else if (eventName === 'error') {
+            throw new Error(data.detail);
+          }
+        }
       }
     } catch (error) {
       console.error('Chat error:', error);
       let errorMessage = 'Unknown error occurred';
-      
-      if (error.code === 'ECONNABORTED') {
+
+      if (error.name === 'AbortError') {
         errorMessage = 'Request timeout. The server is taking too long to respond.';
-      } else if (error.response) {
-        errorMessage = error.response.data?.detail || `Server error: ${error.response.status}`;
-      } else if (error.request) {
+      } else if (error instanceof TypeError) {
         errorMessage = 'Cannot connect to server. Please make sure the backend is running on http://localhost:8000';
       } else {
         errorMessage = error.message || 'Network error';
       }
-      
+
       addMessage('assistant', `❌ Error: ${errorMessage}`);
     } finally {
+      clearTimeout(timeoutId);
       setLoading(false);
     }
   };